@@ -1,6 +1,10 @@
 import streamlit as st #can be alterd according to the user needs
 from utils.authentication import check_authentication
-from utils.database import save_user_profile, get_user_profile
+import os
+from pathlib import Path
+from utils.database import save_user_profile, get_user_profile, export_user_data_to_file, import_logs, show_query_stats
+from utils.export import CONTENT_TYPES
+from utils.enums import Gender, Goal, ActivityLevel
 from streamlit_lottie import st_lottie
 import requests
 from streamlit_extras.colored_header import colored_header
@@ -131,8 +135,8 @@ with st.form("profile_form"):
         
         gender = st.selectbox(
             "Gender",
-            options=["Male", "Female"],
-            index=0 if not profile or profile['gender'] == "Male" else 1,
+            options=Gender.values(),
+            index=0 if not profile or profile['gender'] != Gender.FEMALE else 1,
             help="Select your gender for accurate calculations"
         )
     
@@ -140,47 +144,35 @@ with st.form("profile_form"):
         # Fitness goals and activity level
         goal = st.selectbox(
             "What is your fitness goal?",
-            options=["Maintaining", "Bulking", "Cutting"],
-            index=0 if not profile else ["Maintaining", "Bulking", "Cutting"].index(profile['goal']) if profile['goal'] else 0,
+            options=Goal.values(),
+            index=Goal.values().index(profile['goal']) if profile and profile['goal'] else 0,
             help="Select your fitness goal"
         )
         
         activity_level = st.selectbox(
             "Activity Level",
-            options=[
-                "Sedentary (little or no exercise)",
-                "Lightly active (light exercise/sports 1-3 days/week)",
-                "Moderately active (moderate exercise/sports 3-5 days/week)",
-                "Very active (hard exercise/sports 6-7 days/week)",
-                "Extra active (very hard exercise & physical job or training twice a day)"
-            ],
-            index=0 if not profile else ["sedentary", "lightly_active", "moderately_active", "very_active", "extra_active"].index(profile['activity_level']) if profile['activity_level'] else 0,
+            options=list(ActivityLevel),
+            index=list(ActivityLevel).index(profile['activity_level']) if profile and profile['activity_level'] else 0,
+            format_func=lambda level: level.label,
             help="Select your typical activity level"
         )
-        
-        # Map activity level selection to database values
-        activity_mapping = {
-            "Sedentary (little or no exercise)": "sedentary",
-            "Lightly active (light exercise/sports 1-3 days/week)": "lightly_active",
-            "Moderately active (moderate exercise/sports 3-5 days/week)": "moderately_active",
-            "Very active (hard exercise/sports 6-7 days/week)": "very_active",
-            "Extra active (very hard exercise & physical job or training twice a day)": "extra_active"
-        }
     
     # Submit button
     submitted = st.form_submit_button("Save Profile")
     
     if submitted:
-        # Save profile to database
-        if save_user_profile(
+        # Save profile to database; the stored row comes back with the save
+        saved_profile = save_user_profile(
             st.session_state.user_id,
             weight,
             height,
             age,
             gender,
             goal,
-            activity_mapping[activity_level]
-        ):
+            activity_level
+        )
+        if saved_profile:
+            profile = saved_profile
             st.success("Profile updated successfully!")
             st.info("Head to the Health Metrics page to see your calculated metrics.")
         else:
@@ -227,3 +219,69 @@ if profile:
         """ % profile['goal'], unsafe_allow_html=True)
     
     st.markdown("</div>", unsafe_allow_html=True)
+
+# Export of everything the user has logged
+with st.expander("Export Your Data", expanded=False):
+    col1, col2 = st.columns(2)
+    with col1:
+        export_table = st.selectbox(
+            "Data",
+            options=["food_logs", "exercise_logs", "health_metrics"],
+            format_func=lambda name: name.replace('_', ' ').title()
+        )
+    with col2:
+        export_format = st.selectbox("Format", options=["csv", "jsonl", "parquet"])
+    
+    if st.button("Prepare Export"):
+        # Rows are streamed to a temporary file in batches rather than held in memory
+        previous = st.session_state.pop('export', None)
+        if previous and os.path.exists(previous['path']):
+            os.unlink(previous['path'])
+        result = export_user_data_to_file(st.session_state.user_id, export_table, export_format)
+        if result is not None:
+            path, row_count = result
+            st.session_state.export = {
+                'path': path, 'rows': row_count, 'table': export_table, 'format': export_format
+            }
+    
+    export = st.session_state.get('export')
+    if export and (export['table'], export['format']) == (export_table, export_format):
+        # The file is only read when the button is clicked, not on every rerun
+        st.download_button(
+            f"Download {export['rows']} rows",
+            data=Path(export['path']).read_bytes,
+            file_name=f"{export_table}.{export_format}",
+            mime=CONTENT_TYPES[export_format]
+        )
+
+# Import of history from another tracker
+with st.expander("Import History", expanded=False):
+    import_table = st.selectbox(
+        "Import into",
+        options=["food_logs", "exercise_logs"],
+        format_func=lambda name: name.replace('_', ' ').title()
+    )
+    upload = st.file_uploader("CSV or JSON file", type=["csv", "json", "jsonl"])
+    st.caption("Columns are matched by name, e.g. date, food or exercise, calories, protein, fat, carbs, meal.")
+    
+    if upload is not None and st.button("Import"):
+        progress_bar = st.progress(0.0)
+        
+        def show_progress(rows_loaded):
+            # The upload is read in order, so its position tracks progress
+            progress_bar.progress(min(upload.tell() / max(upload.size, 1), 1.0), text=f"{rows_loaded:,} rows loaded")
+        
+        import_format = "csv" if upload.name.lower().endswith(".csv") else "json"
+        result = import_logs(st.session_state.user_id, import_table, upload, import_format, progress=show_progress)
+        if result is not None:
+            progress_bar.progress(1.0, text=f"{result['rows']:,} rows loaded")
+            st.success(f"Imported {result['rows']:,} rows")
+            if result['skipped']:
+                st.warning(f"Skipped {result['skipped']} invalid rows")
+                st.dataframe(
+                    [{'line': line, 'problem': message} for line, message in result['errors']],
+                    use_container_width=True
+                )
+
+
+show_query_stats()
@@ -1,7 +1,7 @@
 import streamlit as st
 import plotly.graph_objects as go
 from utils.authentication import check_authentication
-from utils.database import get_user_profile, save_health_metrics, get_health_metrics
+from utils.database import get_user_profile, save_health_metrics, get_health_metrics, show_query_stats
 from utils.health_calculations import (
     calculate_bmi, get_bmi_category, calculate_bmr, 
     calculate_tdee, calculate_target_calories, calculate_macronutrients
@@ -100,6 +100,11 @@ if not profile:
     st.info("Go to the User Profile page to enter your information.")
     st.stop()
 
+if not all(profile[field] for field in ('gender', 'goal', 'activity_level')):
+    st.warning("Your profile is missing your gender, goal or activity level.")
+    st.info("Go to the User Profile page to complete your information.")
+    st.stop()
+
 # Calculate health metrics
 bmi = calculate_bmi(profile['weight'], profile['height'])
 bmi_category = get_bmi_category(bmi)
@@ -108,17 +113,27 @@ tdee = calculate_tdee(bmr, profile['activity_level'])
 target_calories = calculate_target_calories(tdee, profile['goal'])
 macros = calculate_macronutrients(target_calories, profile['goal'])
 
-# Save calculated metrics to database
-save_health_metrics(
-    st.session_state.user_id,
-    bmi,
-    bmr,
-    tdee,
-    target_calories,
-    macros['protein'],
-    macros['fat'],
-    macros['carbs']
-)
+# Save calculated metrics to database, skipping the write when nothing changed
+calculated_metrics = {
+    'bmi': bmi,
+    'bmr': bmr,
+    'tdee': tdee,
+    'target_calories': target_calories,
+    'protein_target': macros['protein'],
+    'fat_target': macros['fat'],
+    'carbs_target': macros['carbs']
+}
+if get_health_metrics(st.session_state.user_id) != calculated_metrics:
+    save_health_metrics(
+        st.session_state.user_id,
+        bmi,
+        bmr,
+        tdee,
+        target_calories,
+        macros['protein'],
+        macros['fat'],
+        macros['carbs']
+    )
 
 # Display main metrics with enhanced styling
 colored_header(
@@ -308,3 +323,5 @@ with st.expander("Macronutrients"):
     The recommended distribution varies based on your fitness goal, ensuring you get the right balance 
     to support your objectives.
     """)
+
+show_query_stats()
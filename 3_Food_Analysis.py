@@ -3,7 +3,9 @@ from PIL import Image
 import os
 from utils.authentication import check_authentication
 from utils.food_analysis import analyze_food_image
-from utils.database import log_food, get_health_metrics
+from utils.database import log_food, log_foods_bulk, get_health_metrics, show_query_stats
+from utils.enums import LOGGABLE_MEAL_TYPES
+from utils.image_preprocessing import format_bytes
 from streamlit_lottie import st_lottie
 import requests
 from streamlit_extras.colored_header import colored_header
@@ -246,7 +248,7 @@ def display_nutritional_info(analysis_results):
             # Meal type selection
             meal_type = st.selectbox(
                 "Meal",
-                options=["Breakfast", "Lunch", "Dinner", "Snack"],
+                options=LOGGABLE_MEAL_TYPES,
                 key=f"meal_{i}"
             )
             
@@ -274,6 +276,21 @@ def display_nutritional_info(analysis_results):
         
         st.markdown("---")
     
+    # Log every detected item at once
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        whole_meal_type = st.selectbox(
+            "Meal",
+            options=LOGGABLE_MEAL_TYPES,
+            key="meal_all"
+        )
+    with col2:
+        if st.button("Log whole meal", key="log_all", use_container_width=True):
+            if log_foods_bulk(st.session_state.user_id, food_items, whole_meal_type):
+                st.success(f"Logged {len([item for item in food_items if item['name'] != 'Total'])} items as {whole_meal_type}")
+            else:
+                st.error("Failed to log meal")
+    
     # Display portion estimation details
     if portion_info and len(portion_info) > 0:
         with st.expander("📏 Portion Size Estimation Details", expanded=True):
@@ -342,6 +359,24 @@ def display_nutritional_info(analysis_results):
         </div>
         """, unsafe_allow_html=True)
 
+# Show each part of the analysis as soon as Gemini has produced it
+def render_analysis_event(kind, value):
+    if kind == 'item':
+        st.markdown(
+            f"**{value['name']}** · {value['calories']} kcal · Protein {value['protein']}g · "
+            f"Fat {value['fat']}g · Carbs {value['carbs']}g · {value['portion_size']}"
+        )
+    elif kind == 'total':
+        st.markdown(
+            f"**Total: {value['calories']} kcal** · Protein {value['protein']}g · "
+            f"Fat {value['fat']}g · Carbs {value['carbs']}g"
+        )
+    elif kind == 'portion':
+        food, portion = value
+        st.caption(f"{food}: {portion}")
+    elif kind == 'tip':
+        st.markdown(f"• {value}")
+
 # Streamlit camera input widget to capture an image
 st.subheader("Take a Photo of Your Food")
 captured_image = st.camera_input("Take a picture")
@@ -370,26 +405,48 @@ if 'analysis_results' not in st.session_state:
     st.session_state.analysis_results = None
 
 if analyze_button and image_source is not None:
-    with st.spinner("Analyzing food image..."):
+    with st.status("Analyzing food image...", expanded=True) as status:
         # Get the user's profile and health metrics for personalized analysis
-        from utils.database import get_user_profile, get_health_metrics
+        from utils.database import get_user_context
         
-        user_profile = get_user_profile(st.session_state.user_id)
-        health_metrics = get_health_metrics(st.session_state.user_id)
+        user_context = get_user_context(st.session_state.user_id)
+        user_profile = user_context['profile']
+        health_metrics = user_context['health_metrics']
         
-        # Analyze the image with user context for personalized feedback
-        analysis_results = analyze_food_image(
+        # Analyze the image with user context for personalized feedback,
+        # rendering food items, totals, portions and tips as they arrive
+        analysis_results = None
+        for kind, value in analyze_food_image(
             image_source, 
             description=input_prompt,
             user_profile=user_profile,
-            health_metrics=health_metrics
-        )
+            health_metrics=health_metrics,
+            stream=True
+        ):
+            if kind == 'result':
+                analysis_results = value
+            else:
+                render_analysis_event(kind, value)
         
         if analysis_results['success']:
-            st.session_state.analysis_results = analysis_results
-            st.success("Analysis complete!")
+            status.update(label="Analysis complete!", state="complete", expanded=False)
+        else:
+            status.update(label="Analysis failed", state="error")
+        
+    if analysis_results['success']:
+        st.session_state.analysis_results = analysis_results
+        if analysis_results.get('cached'):
+            st.success("Analysis complete! (reused the earlier analysis of this photo)")
         else:
-            st.error(f"Analysis failed: {analysis_results['error']}")
+            st.success("Analysis complete!")
+        image_report = analysis_results['image']
+        if image_report['prepared']:
+            st.caption(
+                f"Photo sent as {format_bytes(image_report['bytes_after'])} "
+                f"(uploaded {format_bytes(image_report['bytes_before'])})"
+            )
+    else:
+        st.error(f"Analysis failed: {analysis_results['error']}")
 
 # Display results if available
 if st.session_state.analysis_results:
@@ -419,7 +476,7 @@ with st.form("manual_food_entry"):
         
         meal_type = st.selectbox(
             "Meal Type",
-            options=["Breakfast", "Lunch", "Dinner", "Snack"]
+            options=LOGGABLE_MEAL_TYPES
         )
     
     # Submit button
@@ -493,3 +550,5 @@ st.markdown("""
     </a>
 </div>
 """, unsafe_allow_html=True)
+
+show_query_stats()
@@ -4,10 +4,7 @@ import plotly.graph_objects as go
 import plotly.express as px
 from datetime import datetime, timedelta
 from utils.authentication import check_authentication
-from utils.database import (
-    get_daily_food_logs, get_daily_exercise_logs, 
-    get_daily_summary, get_health_metrics, log_exercise
-)
+from utils.database import get_day_snapshot, get_nutrition_series, log_exercise, show_query_stats
 from streamlit_lottie import st_lottie  ## i have used stremlit but not shown visually to the user.
 import requests
 from streamlit_extras.colored_header import colored_header
@@ -162,11 +159,13 @@ with col2:
         max_value=datetime.now().date()
     )
 
-# Get user data for the selected date
-food_logs = get_daily_food_logs(st.session_state.user_id, selected_date)
-exercise_logs = get_daily_exercise_logs(st.session_state.user_id, selected_date)
-daily_summary = get_daily_summary(st.session_state.user_id, selected_date)
-health_metrics = get_health_metrics(st.session_state.user_id)
+# Get user data for the selected date in a single round trip
+snapshot = get_day_snapshot(st.session_state.user_id, selected_date)
+food_logs = snapshot['food_logs']
+exercise_logs = snapshot['exercise_logs']
+meal_totals = snapshot['meal_totals']
+daily_summary = snapshot['summary']
+health_metrics = snapshot['health_metrics']
 
 # Calculate daily progress
 calories_consumed = daily_summary['total_calories']
@@ -174,7 +173,7 @@ calories_burned = daily_summary['total_calories_burned']
 net_calories = calories_consumed - calories_burned
 
 # Create tabs for different sections
-tab1, tab2, tab3 = st.tabs(["Daily Summary", "Food Log", "Exercise Log"])
+tab1, tab2, tab3, tab4 = st.tabs(["Daily Summary", "Food Log", "Exercise Log", "Trends"])
 
 with tab1:
     st.markdown("<div class='tracker-container'>", unsafe_allow_html=True)
@@ -421,11 +420,11 @@ with tab2:
                 </div>
                 """, unsafe_allow_html=True)
             
-            # Calculate meal totals
-            meal_calories = meal_data['calories'].sum()
-            meal_protein = meal_data['protein'].sum()
-            meal_fat = meal_data['fat'].sum()
-            meal_carbs = meal_data['carbs'].sum()
+            # Meal totals come precomputed with the snapshot
+            meal_calories = meal_totals[meal_type]['calories']
+            meal_protein = meal_totals[meal_type]['protein']
+            meal_fat = meal_totals[meal_type]['fat']
+            meal_carbs = meal_totals[meal_type]['carbs']
             
             # Display meal totals with better styling
             st.markdown(f"""
@@ -535,3 +534,70 @@ with tab3:
         """, unsafe_allow_html=True)
         
     st.markdown("</div>", unsafe_allow_html=True)
+
+with tab4:
+    st.markdown("<div class='tracker-container'>", unsafe_allow_html=True)
+    colored_header(
+        label="Trends",
+        description="Your nutrition and exercise over time",
+        color_name="green-70",
+    )
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        trend_range = st.selectbox(
+            "Range",
+            options=["Last 30 days", "Last 90 days", "Last 365 days"],
+            key="trend_range"
+        )
+    with col2:
+        trend_granularity = st.selectbox(
+            "Group by",
+            options=["day", "week", "month"],
+            key="trend_granularity"
+        )
+    
+    range_days = {"Last 30 days": 30, "Last 90 days": 90, "Last 365 days": 365}[trend_range]
+    trend_df = get_nutrition_series(
+        st.session_state.user_id,
+        start=selected_date - timedelta(days=range_days - 1),
+        end=selected_date,
+        granularity=trend_granularity
+    )
+    
+    if not trend_df.empty and (trend_df['food_count'].sum() > 0 or trend_df['exercise_count'].sum() > 0):
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=trend_df['period'], y=trend_df['calories'], name="Consumed", line=dict(color='#FFA15A')))
+        fig.add_trace(go.Scatter(x=trend_df['period'], y=trend_df['calories_burned'], name="Burned", line=dict(color='#00CC96')))
+        if health_metrics and health_metrics['target_calories'] and trend_granularity == "day":
+            fig.add_hline(y=health_metrics['target_calories'], line_dash="dash", line_color="#636EFA", annotation_text="Target")
+        fig.update_layout(
+            title="Calories",
+            yaxis_title="Calories (kcal)",
+            paper_bgcolor='rgba(0,0,0,0)',
+            plot_bgcolor='rgba(0,0,0,0)'
+        )
+        st.plotly_chart(fig, use_container_width=True)
+        
+        fig = go.Figure()
+        fig.add_trace(go.Bar(x=trend_df['period'], y=trend_df['protein'], name="Protein", marker_color='#FFA15A'))
+        fig.add_trace(go.Bar(x=trend_df['period'], y=trend_df['fat'], name="Fat", marker_color='#00CC96'))
+        fig.add_trace(go.Bar(x=trend_df['period'], y=trend_df['carbs'], name="Carbs", marker_color='#636EFA'))
+        fig.update_layout(
+            title="Macronutrients",
+            barmode='stack',
+            yaxis_title="Grams",
+            paper_bgcolor='rgba(0,0,0,0)',
+            plot_bgcolor='rgba(0,0,0,0)'
+        )
+        st.plotly_chart(fig, use_container_width=True)
+    else:
+        st.markdown("""
+        <div class="tracker-card" style="text-align: center; padding: 30px;">
+            <div style="color: #ADB5BD; font-size: 1.1rem;">No data logged in this range.</div>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    st.markdown("</div>", unsafe_allow_html=True)
+
+show_query_stats()
@@ -0,0 +1,235 @@
+"""
+Cache of Gemini food analyses keyed by a perceptual hash of the photo.
+
+Re-uploading a photo, or pressing "Analyze Food" twice, reuses the earlier
+response instead of calling the API. Photos are identified by a 64-bit
+difference hash (dHash): the image is shrunk to 9x8 grayscale and each
+bit records whether a pixel is brighter than its right neighbour, so
+re-encoded, resized or recompressed copies hash alike. A lookup matches
+a stored analysis made with the same description and prompt version
+whose hash differs in at most ANALYSIS_HASH_DISTANCE bits.
+
+Responses are kept in an in-process LRU tier of ANALYSIS_CACHE_SIZE
+entries in front of a SQLite file (ANALYSIS_CACHE_PATH, empty to disable)
+that survives restarts and is shared by the server processes on a host.
+The file indexes every hash by each of its eight bytes. Hashes within 7
+bits of each other share at least one byte, so near duplicates are found
+with index lookups rather than a scan.
+
+Only the raw response text is stored; parsing and the per-user warnings
+are redone on every hit.
+"""
+import io
+import os
+import logging
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+HASH_BANDS = 8
+
+# With eight 8-bit bands the index finds every match up to this distance
+MAX_HASH_DISTANCE = HASH_BANDS - 1
+
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "256"))
+ANALYSIS_CACHE_PATH = os.getenv("ANALYSIS_CACHE_PATH", "analysis_cache.db")
+ANALYSIS_HASH_DISTANCE = min(int(os.getenv("ANALYSIS_HASH_DISTANCE", "4")), MAX_HASH_DISTANCE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    phash INTEGER NOT NULL,
+    response TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (key, phash)
+);
+
+CREATE TABLE IF NOT EXISTS analysis_bands (
+    band INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    analysis_id INTEGER NOT NULL,
+    PRIMARY KEY (band, value, analysis_id)
+) WITHOUT ROWID;
+"""
+
+EXACT_SELECT = "SELECT phash, response FROM analyses WHERE key = ? AND phash = ?"
+
+NEAR_SELECT = """
+SELECT phash, response FROM analyses
+WHERE key = ? AND id IN (
+    SELECT analysis_id FROM analysis_bands WHERE {}
+)
+""".format(" OR ".join(f"(band = {band} AND value = ?)" for band in range(HASH_BANDS)))
+
+ANALYSIS_INSERT = "INSERT OR IGNORE INTO analyses (key, phash, response) VALUES (?, ?, ?)"
+
+BAND_INSERT = "INSERT OR IGNORE INTO analysis_bands (band, value, analysis_id) VALUES (?, ?, ?)"
+
+
+def dhash(image_bytes):
+    """Return the 64-bit difference hash of an encoded image, or None if it cannot be decoded."""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # Lets JPEG decode at a fraction of full size
+            image.draft('L', (64, 64))
+            pixels = image.convert('L').resize((9, 8), Image.Resampling.LANCZOS).tobytes()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def cache_key(description, prompt_version):
+    """Identify the request an image was analysed with."""
+    return hashlib.sha256(f"{prompt_version}\n{description.strip()}".encode('utf-8')).hexdigest()[:32]
+
+
+def _bands(phash):
+    return [(phash >> (8 * band)) & 0xFF for band in range(HASH_BANDS)]
+
+
+def _to_sql(phash):
+    # SQLite integers are signed 64-bit
+    return phash - (1 << 64) if phash >> 63 else phash
+
+
+def _from_sql(value):
+    return value & ((1 << 64) - 1)
+
+
+class AnalysisCache:
+    """Two-tier store of analysis responses by (cache key, perceptual hash)."""
+
+    def __init__(self, maxsize=ANALYSIS_CACHE_SIZE, path=ANALYSIS_CACHE_PATH, max_distance=ANALYSIS_HASH_DISTANCE):
+        self.maxsize = maxsize
+        self.path = path or None
+        self.max_distance = min(max_distance, MAX_HASH_DISTANCE)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {'lookups': 0, 'memory_hits': 0, 'disk_hits': 0, 'near_hits': 0,
+                       'misses': 0, 'stores': 0, 'disk_errors': 0}
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, phash):
+        """Return the cached response for an image, or None."""
+        with self._lock:
+            self._stats['lookups'] += 1
+            found = self._memory_lookup(key, phash)
+            if found is not None:
+                self._stats['memory_hits'] += 1
+                self._stats['near_hits'] += found[0] != phash
+                return found[1]
+
+        found = self._disk_lookup(key, phash)
+        with self._lock:
+            if found is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['disk_hits'] += 1
+            self._stats['near_hits'] += found[0] != phash
+            self._remember(key, *found)
+        return found[1]
+
+    def put(self, key, phash, response):
+        """Store a response in both tiers."""
+        with self._lock:
+            self._stats['stores'] += 1
+            self._remember(key, phash, response)
+        if self.path is None:
+            return
+        try:
+            conn = self._connection()
+            with conn:
+                cur = conn.execute(ANALYSIS_INSERT, (key, _to_sql(phash), response))
+                if cur.rowcount == 1:
+                    conn.executemany(
+                        BAND_INSERT,
+                        [(band, value, cur.lastrowid) for band, value in enumerate(_bands(phash))]
+                    )
+        except sqlite3.Error as e:
+            self._disk_failed(e)
+
+    def _memory_lookup(self, key, phash):
+        response = self._memory.get((key, phash))
+        if response is not None:
+            self._memory.move_to_end((key, phash))
+            return phash, response
+        if self.max_distance == 0:
+            return None
+        best = None
+        for (entry_key, entry_hash), response in self._memory.items():
+            if entry_key != key:
+                continue
+            distance = hamming(entry_hash, phash)
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, entry_hash, response)
+        if best is None:
+            return None
+        self._memory.move_to_end((key, best[1]))
+        return best[1], best[2]
+
+    def _disk_lookup(self, key, phash):
+        if self.path is None:
+            return None
+        try:
+            conn = self._connection()
+            row = conn.execute(EXACT_SELECT, (key, _to_sql(phash))).fetchone()
+            if row is not None:
+                return phash, row[1]
+            if self.max_distance == 0:
+                return None
+            rows = conn.execute(NEAR_SELECT, (key, *_bands(phash))).fetchall()
+        except sqlite3.Error as e:
+            self._disk_failed(e)
+            return None
+        candidates = [(hamming(_from_sql(stored), phash), _from_sql(stored), response) for stored, response in rows]
+        candidates = [candidate for candidate in candidates if candidate[0] <= self.max_distance]
+        if not candidates:
+            return None
+        _, entry_hash, response = min(candidates)
+        return entry_hash, response
+
+    def _remember(self, key, phash, response):
+        self._memory[(key, phash)] = response
+        self._memory.move_to_end((key, phash))
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def _disk_failed(self, error):
+        # The cache only saves API calls, so analyses go on without it
+        logger.warning("Analysis cache at %s failed: %s", self.path, error)
+        with self._lock:
+            self._stats['disk_errors'] += 1
+
+    def stats(self):
+        """Return hit/miss counters for both tiers."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_size'] = len(self._memory)
+        hits = stats['memory_hits'] + stats['disk_hits']
+        stats['hit_rate'] = hits / stats['lookups'] if stats['lookups'] else 0.0
+        stats['path'] = self.path
+        stats['max_distance'] = self.max_distance
+        return stats
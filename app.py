@@ -1,7 +1,8 @@
 import streamlit as st
 import os
 from utils.authentication import login, register, check_authentication
-from utils.database import initialize_database
+from utils.database import ensure_schema
+from utils.enums import Gender, Goal
 from streamlit_lottie import st_lottie
 import json
 from streamlit_extras.colored_header import colored_header
@@ -10,8 +11,8 @@ from streamlit_extras.card import card
 import requests
 from datetime import datetime
 
-# Initialize the database when the app starts
-initialize_database()
+# Check the schema once per server process; migrations run at deploy time
+ensure_schema()
 
 # Function to load lottie animations
 def load_lottieurl(url):
@@ -303,7 +304,7 @@ if not st.session_state.authenticated:
             
             gender = st.selectbox(
                 "Gender", 
-                options=["Male", "Female"],
+                options=Gender.values(),
                 index=0
             )
             
@@ -315,7 +316,7 @@ if not st.session_state.authenticated:
             
             goal = st.selectbox(
                 "Fitness Goal", 
-                options=["Bulking", "Cutting", "Maintaining"],
+                options=[Goal.BULKING, Goal.CUTTING, Goal.MAINTAINING],
                 index=2
             )
             
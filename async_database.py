@@ -0,0 +1,98 @@
+"""
+Asyncio data-access layer built on psycopg 3 and its async pool.
+
+It runs the same statements as database.py (see queries.py), so
+independent reads can be issued concurrently with asyncio.gather. It does
+not import Streamlit and raises errors instead of reporting them, so a
+headless API server can use it directly.
+
+Streamlit scripts run in plain threads without an event loop; run()
+executes a coroutine on a process-wide background loop that owns the
+pools. Each PostgresRepository opens its own pool with open_pool() from
+its connection settings, so every session shares that repository's
+connections. A pool's size is carved out of the process's
+PGPOOL_MAXCONN budget (see connection_pool.get_pool_sizes).
+
+Writes go through the Repository in database.py, which owns routing,
+write fences, cache notifications and enum parsing; this layer is
+read-only.
+"""
+import os
+import asyncio
+import threading
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+from utils.connection_pool import get_pool_sizes
+from utils.queries import USER_PROFILE_SELECT, HEALTH_METRICS_SELECT, profile_from_row, metrics_from_row
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop():
+    """Return the background event loop, starting its thread on first use."""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="async-db", daemon=True)
+                thread.start()
+                _loop = loop
+    return _loop
+
+
+def run(coro, timeout=None):
+    """Run a coroutine on the background loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result(timeout)
+
+
+async def open_pool(dsn='', **connect_kwargs):
+    """
+    Open an async connection pool.
+
+    Parameters:
+    dsn (str): Connection string, combined with connect_kwargs
+    connect_kwargs: psycopg2-style connection keywords; empty ones are skipped
+
+    Returns:
+    AsyncConnectionPool: The opened pool
+    """
+    params = {key: value for key, value in connect_kwargs.items() if value}
+    max_size = get_pool_sizes()[1]
+    pool = AsyncConnectionPool(
+        make_conninfo(dsn or '', **params),
+        min_size=min(int(os.getenv("PGPOOL_MINCONN", "1")), max_size),
+        max_size=max_size,
+        timeout=float(os.getenv("PGPOOL_TIMEOUT", "10")),
+        check=AsyncConnectionPool.check_connection,
+        open=False
+    )
+    await pool.open()
+    return pool
+
+
+async def _fetchone(pool, query, params):
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            return await cur.fetchone()
+
+
+async def get_user_profile(pool, user_id):
+    """Retrieve user profile information."""
+    return profile_from_row(await _fetchone(pool, USER_PROFILE_SELECT, (user_id,)))
+
+
+async def get_health_metrics(pool, user_id):
+    """Retrieve user health metrics."""
+    return metrics_from_row(await _fetchone(pool, HEALTH_METRICS_SELECT, (user_id,)))
+
+
+async def get_user_context(pool, user_id):
+    """Fetch profile and health metrics concurrently."""
+    profile, metrics = await asyncio.gather(
+        get_user_profile(pool, user_id),
+        get_health_metrics(pool, user_id)
+    )
+    return {'profile': profile, 'health_metrics': metrics}
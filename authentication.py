@@ -1,8 +1,7 @@
 import streamlit as st
 import hashlib
 import os
-import psycopg2
-from utils.database import get_connection
+from utils.database import get_repository
 
 def hash_password(password):
     """Hash a password for storing."""
@@ -11,24 +10,8 @@ def hash_password(password):
 def register(username, password):
     """Register a new user in the database."""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        
-        # Check if username already exists
-        cur.execute("SELECT id FROM users WHERE username = %s", (username,))
-        if cur.fetchone() is not None:
-            conn.close()
-            return False
-        
-        # Insert new user
-        hashed_password = hash_password(password)
-        cur.execute(
-            "INSERT INTO users (username, password) VALUES (%s, %s) RETURNING id",
-            (username, hashed_password)
-        )
-        conn.commit()
-        conn.close()
-        return True
+        # The insert skips taken usernames and returns no id for them
+        return get_repository().create_user(username, hash_password(password)) is not None
     except Exception as e:
         st.error(f"An error occurred during registration: {e}")
         return False
@@ -36,13 +19,7 @@ def register(username, password):
 def login(username, password):
     """Authenticate a user and set session state if successful."""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        
-        # Get user by username
-        cur.execute("SELECT id, username, password FROM users WHERE username = %s", (username,))
-        user = cur.fetchone()
-        conn.close()
+        user = get_repository().get_user_by_username(username)
         
         if user and user[2] == hash_password(password):
             # Set session state
@@ -0,0 +1,354 @@
+"""
+Bulk import of historical food and exercise logs.
+
+Rows are read from a CSV or JSON stream (a JSON array or JSON Lines),
+mapped onto the food_logs / exercise_logs columns, validated, and handed
+to the repository in fixed-size chunks. The Postgres backend loads each
+chunk with COPY FROM STDIN. Parsing is lazy, so memory use depends on the
+chunk size and not on the size of the file.
+
+Invalid rows are skipped and reported with their line or record number,
+up to max_errors; beyond that the import is aborted and nothing is kept.
+"""
+import io
+import csv
+import json
+import math
+from datetime import date, datetime
+from utils.enums import MealType
+
+IMPORT_FORMATS = ('csv', 'json')
+
+# Column names accepted for each target column, besides the column itself
+COLUMN_ALIASES = {
+    'food_logs': {
+        'food_name': ('food', 'name', 'item', 'description'),
+        'calories': ('kcal', 'energy', 'energy_kcal'),
+        'protein': ('protein_g', 'proteins'),
+        'fat': ('fat_g', 'fats', 'total_fat'),
+        'carbs': ('carbs_g', 'carbohydrates', 'carbohydrate'),
+        'portion_size': ('portion', 'serving', 'serving_size', 'quantity'),
+        'meal_type': ('meal', 'meal_name'),
+        'consumed_at': ('date', 'day', 'consumed', 'logged_at', 'timestamp')
+    },
+    'exercise_logs': {
+        'exercise_name': ('exercise', 'activity', 'name', 'workout'),
+        'duration': ('minutes', 'duration_min', 'duration_minutes'),
+        'calories_burned': ('calories', 'kcal', 'burned', 'energy'),
+        'performed_at': ('date', 'day', 'performed', 'logged_at', 'timestamp')
+    }
+}
+
+
+def _text(limit):
+    def convert(value):
+        if value is None:
+            return None
+        value = str(value).strip()
+        if len(value) > limit:
+            raise ValueError(f"longer than {limit} characters")
+        return value or None
+    return convert
+
+
+def _number(value):
+    if value is None or value == '':
+        return None
+    number = float(value)
+    if not math.isfinite(number) or number < 0:
+        raise ValueError(f"invalid amount {value!r}")
+    return number
+
+
+def _integer(value):
+    if value is None or value == '':
+        return None
+    return round(_number(value))
+
+
+def _date(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, date):
+        return value
+    value = str(value).strip()
+    # Accept plain dates and ISO timestamps, keeping only the day
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        return datetime.strptime(value, "%m/%d/%Y").date()
+
+
+def _meal_type(value):
+    return MealType.parse(value)
+
+
+# (column, converter, required) in the order rows are loaded, after user_id
+IMPORT_COLUMNS = {
+    'food_logs': (
+        ('food_name', _text(100), True),
+        ('calories', _number, True),
+        ('protein', _number, False),
+        ('fat', _number, False),
+        ('carbs', _number, False),
+        ('portion_size', _text(50), False),
+        ('meal_type', _meal_type, False),
+        ('consumed_at', _date, True)
+    ),
+    'exercise_logs': (
+        ('exercise_name', _text(100), True),
+        ('duration', _integer, False),
+        ('calories_burned', _number, True),
+        ('performed_at', _date, True)
+    )
+}
+
+
+def table_columns(table):
+    """Target columns of an import table, user_id first."""
+    return ('user_id',) + tuple(column for column, _, _ in IMPORT_COLUMNS[table])
+
+
+def resolve_columns(table, fields, column_map=None):
+    """
+    Map each target column to a source field name.
+
+    column_map ({source: target}) takes precedence over the built-in
+    aliases; names are matched case-insensitively.
+    """
+    by_name = {field.strip().lower(): field for field in fields if field is not None}
+    mapping = {}
+    for source, target in (column_map or {}).items():
+        if source.strip().lower() in by_name:
+            mapping[target] = by_name[source.strip().lower()]
+    for column, aliases in COLUMN_ALIASES[table].items():
+        if column in mapping:
+            continue
+        for name in (column,) + aliases:
+            if name in by_name and by_name[name] not in mapping.values():
+                mapping[column] = by_name[name]
+                break
+
+    missing = [column for column, _, required in IMPORT_COLUMNS[table] if required and column not in mapping]
+    if missing:
+        raise ValueError(f"No column found for {', '.join(missing)} in {sorted(by_name)}")
+    return mapping
+
+
+def _iter_json_array(text, chunk_size=1 << 16):
+    """Yield the elements of a top-level JSON array without loading it whole."""
+    decoder = json.JSONDecoder()
+    buffer = text.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError("Expected a JSON array")
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            value, end = decoder.raw_decode(buffer)
+        except ValueError:
+            more = text.read(chunk_size)
+            if not more:
+                raise ValueError("Truncated JSON array")
+            buffer += more
+            continue
+        yield value
+        buffer = buffer[end:]
+        if len(buffer) < chunk_size:
+            buffer += text.read(chunk_size)
+
+
+class _Prefixed:
+    """Text stream with characters already consumed pushed back in front."""
+
+    def __init__(self, prefix, text):
+        self._prefix = prefix
+        self._text = text
+
+    def read(self, size=-1):
+        prefix, self._prefix = self._prefix, ''
+        if size is None or size < 0:
+            return prefix + self._text.read()
+        return prefix + self._text.read(max(size - len(prefix), 0))
+
+    def __iter__(self):
+        lines = iter(self._text)
+        prefix, self._prefix = self._prefix, ''
+        yield prefix + next(lines, '')
+        yield from lines
+
+
+def read_records(stream, fmt):
+    """
+    Yield (position, record dict) from a CSV or JSON stream.
+
+    stream may be binary or text. For JSON, a leading '[' selects array
+    mode, otherwise each line is one object (JSON Lines). position is the
+    line number, or the element number for arrays.
+    """
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Unknown import format {fmt!r}")
+    text = stream if isinstance(stream, io.TextIOBase) else io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    first = text.read(1)
+    while first.isspace():
+        first = text.read(1)
+    if first == '[':
+        yield from enumerate(_iter_json_array(_Prefixed(first, text)), start=1)
+        return
+
+    for position, line in enumerate(_Prefixed(first, text), start=1):
+        if not line.strip():
+            continue
+        try:
+            yield position, json.loads(line)
+        except ValueError as e:
+            # Reported by validate_records like any other bad row
+            yield position, e
+
+
+class ImportReport:
+    """Counts and per-row errors collected while an import runs."""
+
+    def __init__(self, max_errors=100):
+        self.max_errors = max_errors
+        self.rows = 0
+        self.skipped = 0
+        self.errors = []
+
+    def reject(self, position, message):
+        self.skipped += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((position, message))
+        if self.skipped > self.max_errors:
+            raise ValueError(f"More than {self.max_errors} invalid rows; import aborted "
+                             f"(first error at {self.errors[0][0]}: {self.errors[0][1]})")
+
+    def as_dict(self):
+        return {'rows': self.rows, 'skipped': self.skipped, 'errors': list(self.errors)}
+
+
+def validate_records(table, user_id, records, report, column_map=None):
+    """Yield load-ready row tuples, user_id first; bad rows go to the report."""
+    converters = IMPORT_COLUMNS[table]
+    mapping = None
+    fields = None
+    for position, record in records:
+        if isinstance(record, ValueError):
+            report.reject(position, f"invalid JSON: {record}")
+            continue
+        if not isinstance(record, dict):
+            report.reject(position, "not an object")
+            continue
+        # JSON records may not all share the same keys
+        if mapping is None or record.keys() != fields:
+            fields = record.keys()
+            try:
+                mapping = resolve_columns(table, fields, column_map)
+            except ValueError as e:
+                # A header that cannot be mapped fails the whole import
+                if report.rows == 0 and report.skipped == 0:
+                    raise
+                report.reject(position, str(e))
+                mapping = None
+                continue
+
+        row = [user_id]
+        try:
+            for column, convert, required in converters:
+                value = convert(record.get(mapping[column])) if column in mapping else None
+                if required and value is None:
+                    raise ValueError("required")
+                row.append(value)
+        except (ValueError, TypeError) as e:
+            report.reject(position, f"{column}: {e}")
+            continue
+        report.rows += 1
+        yield tuple(row)
+
+
+def validate_csv(table, user_id, stream, report, column_map=None):
+    """
+    Fast path of validate_records for CSV streams.
+
+    The header is mapped once and each line is converted by position,
+    without building a dict per row.
+    """
+    text = stream if isinstance(stream, io.TextIOBase) else io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text)
+    header = next(reader, None)
+    if header is None:
+        return
+    mapping = resolve_columns(table, header, column_map)
+    index = {field: position for position, field in enumerate(header)}
+    plan = [
+        (index[mapping[column]] if column in mapping else None, convert, required, column)
+        for column, convert, required in IMPORT_COLUMNS[table]
+    ]
+    width = len(header)
+
+    for values in reader:
+        if not values:
+            continue
+        if len(values) < width:
+            values += [''] * (width - len(values))
+        row = [user_id]
+        try:
+            for position, convert, required, column in plan:
+                value = None if position is None else convert(values[position])
+                if required and value is None:
+                    raise ValueError("required")
+                row.append(value)
+        except (ValueError, TypeError) as e:
+            report.reject(reader.line_num, f"{column}: {e}")
+            continue
+        report.rows += 1
+        yield tuple(row)
+
+
+def iter_chunks(rows, chunk_size):
+    """Group an iterable of rows into lists of at most chunk_size."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def rows_to_csv(rows):
+    """Render rows as a CSV text buffer for COPY ... FROM STDIN (FORMAT csv)."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    return buffer
+
+
+def prepare_import(user_id, table, stream, fmt, column_map=None, chunk_size=50000, max_errors=100):
+    """
+    Parse and validate an import stream lazily.
+
+    Returns:
+    tuple: (chunks, report), where chunks yields lists of row tuples in
+    table_columns(table) order and report fills in as they are consumed
+    """
+    if table not in IMPORT_COLUMNS:
+        raise ValueError(f"Unknown import table {table!r}")
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Unknown import format {fmt!r}")
+    report = ImportReport(max_errors)
+    if fmt == 'csv':
+        rows = validate_csv(table, user_id, stream, report, column_map)
+    else:
+        rows = validate_records(table, user_id, read_records(stream, fmt), report, column_map)
+    return iter_chunks(rows, chunk_size), report
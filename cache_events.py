@@ -0,0 +1,120 @@
+"""
+Cross-process cache invalidation over Postgres LISTEN/NOTIFY.
+
+With CACHE_NOTIFY=1, every write of a profile, health metrics or logs
+sends a notification on CACHE_CHANNEL inside the write's transaction, so
+it is delivered only if the write commits. The payload is
+"<entity>:<user_id>:<process id>". Each server process runs a
+CacheListener thread on a dedicated connection. It evicts the matching
+entries from its caches and ignores its own notifications, since the
+writer already updated its cache.
+
+If the listener loses its connection, it may have missed notifications.
+Once it reconnects it calls on_reset, which clears the caches.
+"""
+import uuid
+import select
+import logging
+import threading
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+CACHE_CHANNEL = 'kcap_cache'
+
+# Entities carried in notifications
+CACHE_ENTITIES = ('profile', 'health_metrics', 'logs')
+
+PROCESS_ID = uuid.uuid4().hex[:12]
+
+NOTIFY = "SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload"
+
+
+def payload(entity, user_id):
+    return f"{entity}:{user_id}:{PROCESS_ID}"
+
+
+def parse_payload(text):
+    """Return (entity, user_id, process id), or None for a malformed payload."""
+    try:
+        entity, user_id, origin = text.split(':')
+        return entity, int(user_id), origin
+    except ValueError:
+        return None
+
+
+def notify(cur, channel, entity, user_ids):
+    """Queue one notification per user in the cursor's transaction."""
+    cur.execute(NOTIFY, (channel, [payload(entity, user_id) for user_id in sorted(user_ids)]))
+
+
+class CacheListener(threading.Thread):
+    """Background thread turning notifications into on_event(entity, user_id) calls."""
+
+    def __init__(self, connect_kwargs, on_event, on_reset, channel=CACHE_CHANNEL, poll_interval=5.0):
+        super().__init__(name='cache-listener', daemon=True)
+        self.connect_kwargs = connect_kwargs
+        self.on_event = on_event
+        self.on_reset = on_reset
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self._stopped = threading.Event()
+        self._stats = {'received': 0, 'evicted': 0, 'own': 0, 'reconnects': 0}
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {self.channel}")
+        return conn
+
+    def run(self):
+        backoff = 1.0
+        first = True
+        while not self._stopped.is_set():
+            try:
+                conn = self._connect()
+            except psycopg2.Error as e:
+                logger.warning("Cache listener cannot connect, retrying in %.0fs: %s", backoff, e)
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+                continue
+
+            backoff = 1.0
+            if not first:
+                # Anything written while disconnected went unannounced
+                self._stats['reconnects'] += 1
+                self.on_reset()
+            first = False
+            try:
+                self._listen(conn)
+            except (psycopg2.Error, OSError) as e:
+                logger.warning("Cache listener lost its connection: %s", e)
+            finally:
+                conn.close()
+
+    def _listen(self, conn):
+        while not self._stopped.is_set():
+            if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                self._handle(conn.notifies.pop(0).payload)
+
+    def _handle(self, text):
+        self._stats['received'] += 1
+        event = parse_payload(text)
+        if event is None:
+            return
+        entity, user_id, origin = event
+        if origin == PROCESS_ID:
+            self._stats['own'] += 1
+            return
+        self.on_event(entity, user_id)
+        self._stats['evicted'] += 1
+
+    def stop(self):
+        self._stopped.set()
+
+    def stats(self):
+        return dict(self._stats, alive=self.is_alive())
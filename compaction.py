@@ -0,0 +1,234 @@
+"""
+Retention compaction of old food and exercise logs.
+
+Rows older than the retention horizon are folded into aggregate tables:
+food_log_compacted keeps one row per user, day and meal type, and
+exercise_log_compacted one row per user and day. Totals stay exact, and
+the raw rows move into log_archive as gzip-compressed JSON, one entry per
+user and day. daily_rollup is left untouched, since its totals do not
+change.
+
+Reads that cover compacted days (day snapshots, daily logs, meal series
+and rollup rebuilds) union the aggregate tables with the raw ones. A
+compacted meal appears as a single "N items (compacted)" entry.
+
+Run it from a scheduler with `python -m utils.compaction [days]`.
+"""
+import os
+import sys
+import gzip
+import json
+from datetime import date, timedelta
+from psycopg2.extras import execute_values
+from utils.partitions import add_months
+from utils.enums import MealType
+
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "180"))
+
+# Meal type used for food rows logged without one, as the key cannot be NULL
+UNSPECIFIED_MEAL = MealType.OTHER.value
+
+COMPACTED_TABLES_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS food_log_compacted (
+        user_id INTEGER NOT NULL,
+        day DATE NOT NULL,
+        meal_type VARCHAR(20) NOT NULL,
+        calories FLOAT NOT NULL DEFAULT 0,
+        protein FLOAT NOT NULL DEFAULT 0,
+        fat FLOAT NOT NULL DEFAULT 0,
+        carbs FLOAT NOT NULL DEFAULT 0,
+        items INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day, meal_type)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS exercise_log_compacted (
+        user_id INTEGER NOT NULL,
+        day DATE NOT NULL,
+        duration INTEGER NOT NULL DEFAULT 0,
+        calories_burned FLOAT NOT NULL DEFAULT 0,
+        sessions INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS log_archive (
+        id BIGSERIAL PRIMARY KEY,
+        source VARCHAR(20) NOT NULL,
+        user_id INTEGER NOT NULL,
+        day DATE NOT NULL,
+        row_count INTEGER NOT NULL,
+        rows BYTEA NOT NULL,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS log_archive_source_user_day_idx ON log_archive (source, user_id, day)"
+)
+
+# Column order of the archived rows, per source table
+ARCHIVE_COLUMNS = {
+    'food_logs': ('id', 'food_name', 'calories', 'protein', 'fat', 'carbs', 'portion_size', 'meal_type'),
+    'exercise_logs': ('id', 'exercise_name', 'duration', 'calories_burned')
+}
+
+# Each statement deletes one date range, folds the deleted rows into the
+# aggregate table and returns them grouped per user and day for the archive
+COMPACT_FOOD_LOGS = """
+WITH moved AS (
+    DELETE FROM food_logs
+    WHERE consumed_at >= %(start)s AND consumed_at < %(end)s
+    RETURNING id, user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type, consumed_at
+), compacted AS (
+    INSERT INTO food_log_compacted (user_id, day, meal_type, calories, protein, fat, carbs, items)
+    SELECT user_id, consumed_at, COALESCE(meal_type, %(unspecified)s),
+           COALESCE(SUM(calories), 0), COALESCE(SUM(protein), 0),
+           COALESCE(SUM(fat), 0), COALESCE(SUM(carbs), 0), COUNT(*)
+    FROM moved
+    GROUP BY 1, 2, 3
+    ON CONFLICT (user_id, day, meal_type) DO UPDATE
+    SET calories = food_log_compacted.calories + EXCLUDED.calories,
+        protein = food_log_compacted.protein + EXCLUDED.protein,
+        fat = food_log_compacted.fat + EXCLUDED.fat,
+        carbs = food_log_compacted.carbs + EXCLUDED.carbs,
+        items = food_log_compacted.items + EXCLUDED.items
+)
+SELECT user_id, consumed_at,
+       json_agg(json_build_array(id, food_name, calories, protein, fat, carbs, portion_size, meal_type)
+                ORDER BY id)::text
+FROM moved
+GROUP BY 1, 2
+"""
+
+COMPACT_EXERCISE_LOGS = """
+WITH moved AS (
+    DELETE FROM exercise_logs
+    WHERE performed_at >= %(start)s AND performed_at < %(end)s
+    RETURNING id, user_id, exercise_name, duration, calories_burned, performed_at
+), compacted AS (
+    INSERT INTO exercise_log_compacted (user_id, day, duration, calories_burned, sessions)
+    SELECT user_id, performed_at, COALESCE(SUM(duration), 0), COALESCE(SUM(calories_burned), 0), COUNT(*)
+    FROM moved
+    GROUP BY 1, 2
+    ON CONFLICT (user_id, day) DO UPDATE
+    SET duration = exercise_log_compacted.duration + EXCLUDED.duration,
+        calories_burned = exercise_log_compacted.calories_burned + EXCLUDED.calories_burned,
+        sessions = exercise_log_compacted.sessions + EXCLUDED.sessions
+)
+SELECT user_id, performed_at,
+       json_agg(json_build_array(id, exercise_name, duration, calories_burned) ORDER BY id)::text
+FROM moved
+GROUP BY 1, 2
+"""
+
+COMPACT_STATEMENTS = {
+    'food_logs': COMPACT_FOOD_LOGS,
+    'exercise_logs': COMPACT_EXERCISE_LOGS
+}
+
+ARCHIVE_INSERT = """
+INSERT INTO log_archive (source, user_id, day, row_count, rows) VALUES %s
+"""
+
+ARCHIVE_SELECT = """
+SELECT day, rows FROM log_archive
+WHERE source = %s AND user_id = %s AND day BETWEEN %s AND %s
+ORDER BY day, id
+"""
+
+
+def create_compaction_tables(cur):
+    for statement in COMPACTED_TABLES_DDL:
+        cur.execute(statement)
+
+
+def retention_cutoff(days=None, today=None):
+    """First day that is kept as raw rows."""
+    days = LOG_RETENTION_DAYS if days is None else days
+    return (today or date.today()) - timedelta(days=days)
+
+
+def pack_rows(rows_json):
+    """Compress a JSON array of rows for log_archive."""
+    if not isinstance(rows_json, str):
+        rows_json = json.dumps(rows_json, default=str)
+    return gzip.compress(rows_json.encode('utf-8'))
+
+
+def unpack_rows(table, blob):
+    """Turn a log_archive blob back into row dicts."""
+    columns = ARCHIVE_COLUMNS[table]
+    return [dict(zip(columns, row)) for row in json.loads(gzip.decompress(bytes(blob)).decode('utf-8'))]
+
+
+def archive_entries(table, grouped_rows):
+    """log_archive rows for (user_id, day, rows_json) groups."""
+    entries = []
+    for user_id, day, rows_json in grouped_rows:
+        rows = json.loads(rows_json) if isinstance(rows_json, str) else rows_json
+        entries.append((table, user_id, day, len(rows), pack_rows(rows_json)))
+    return entries
+
+
+def compact_range(cur, table, start, end):
+    """
+    Compact one table's rows dated in [start, end) within the caller's transaction.
+
+    Returns the number of raw rows moved.
+    """
+    cur.execute(COMPACT_STATEMENTS[table], {'start': start, 'end': end, 'unspecified': UNSPECIFIED_MEAL})
+    entries = archive_entries(table, cur.fetchall())
+    if entries:
+        execute_values(cur, ARCHIVE_INSERT, entries)
+    return sum(entry[3] for entry in entries)
+
+
+def compact_logs(conn, cutoff, fence=None):
+    """
+    Compact food_logs and exercise_logs rows dated before cutoff.
+
+    Works one calendar month at a time, each in its own transaction, so
+    locks and the archive batch stay bounded. fence(cur) is called first
+    in each of those transactions.
+
+    Returns:
+    dict: Rows moved per table
+    """
+    moved = {table: 0 for table in COMPACT_STATEMENTS}
+    for table, column in (('food_logs', 'consumed_at'), ('exercise_logs', 'performed_at')):
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT MIN({column}) FROM {table} WHERE {column} < %s", (cutoff,))
+            oldest = cur.fetchone()[0]
+        conn.commit()
+        if oldest is None:
+            continue
+
+        start = oldest.replace(day=1)
+        while start < cutoff:
+            end = min(add_months(start, 1), cutoff)
+            try:
+                with conn.cursor() as cur:
+                    if fence is not None:
+                        fence(cur)
+                    moved[table] += compact_range(cur, table, start, end)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            start = end
+    return moved
+
+
+def read_archive(cur, user_id, table, start, end):
+    """Archived raw rows for a user between two dates, as dicts with a day key."""
+    cur.execute(ARCHIVE_SELECT, (table, user_id, start, end))
+    return [dict(row, day=day) for day, blob in cur.fetchall() for row in unpack_rows(table, blob)]
+
+
+if __name__ == '__main__':
+    from utils.database import get_repository
+
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    cutoff = retention_cutoff(days)
+    moved = get_repository().compact_logs(cutoff)
+    print(f"Compacted rows before {cutoff}: " + ", ".join(f"{table} {count}" for table, count in moved.items()))
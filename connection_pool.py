@@ -0,0 +1,167 @@
+import os
+import time
+import threading
+import psycopg2
+from psycopg2 import pool
+from psycopg2 import extensions
+from contextlib import contextmanager
+
+
+def get_connection_params():
+    """Return the connection keyword arguments from the environment."""
+    return {
+        'dbname': os.getenv("PGDATABASE"),
+        'user': os.getenv("PGUSER"),
+        'password': os.getenv("PGPASSWORD"),
+        'host': os.getenv("PGHOST"),
+        'port': os.getenv("PGPORT")
+    }
+
+
+def get_pool_sizes():
+    """
+    Split the per-process PGPOOL_MAXCONN budget between the psycopg2 pool
+    and the asyncio pool, which gets PGPOOL_ASYNC_MAXCONN of it.
+
+    Returns:
+    tuple: (psycopg2 maxconn, async max_size), at least one each
+    """
+    total = int(os.getenv("PGPOOL_MAXCONN", "10"))
+    async_max = max(1, min(int(os.getenv("PGPOOL_ASYNC_MAXCONN", "2")), total - 1))
+    return max(1, total - async_max), async_max
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    Borrowing blocks for up to `timeout` seconds when all `maxconn`
+    connections are in use instead of failing straight away. Connections
+    that were idle for longer than `ping_after` seconds are checked with
+    a `SELECT 1` before being handed out, and broken ones are replaced.
+    """
+
+    def __init__(self, minconn=1, maxconn=10, timeout=10.0, ping_after=30.0, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, **connect_kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self._stats = {
+            'borrowed': 0,
+            'returned': 0,
+            'discarded': 0,
+            'pings': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0
+        }
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _is_healthy(self, conn):
+        """Check a connection before handing it out."""
+        if conn.closed:
+            return False
+        if conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        idle = time.monotonic() - self._last_used.get(id(conn), 0)
+        if idle < self.ping_after:
+            return True
+
+        self._count('pings')
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Borrow a healthy connection from the pool."""
+        start = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            self._count('waits')
+            if not self._slots.acquire(timeout=self.timeout):
+                self._count('timeouts')
+                raise pool.PoolError(
+                    f"No database connection available after {self.timeout}s "
+                    f"({self.maxconn} in use)"
+                )
+            self._count('wait_time', time.monotonic() - start)
+
+        try:
+            # A dead connection is dropped and a fresh one taken in its place
+            for _ in range(self.maxconn + 1):
+                conn = self._pool.getconn()
+                if self._is_healthy(conn):
+                    self._count('borrowed')
+                    return conn
+                self._count('discarded')
+                self._pool.putconn(conn, close=True)
+            raise pool.PoolError("Unable to obtain a healthy database connection")
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, close=False):
+        """Return a borrowed connection to the pool."""
+        try:
+            if not close and not conn.closed:
+                status = conn.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    close = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    # Never hand a half-finished transaction to the next caller
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        close = True
+
+            if close or conn.closed:
+                self._count('discarded')
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn, close=close or bool(conn.closed))
+            self._count('returned')
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a `with` block."""
+        conn = self.getconn()
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            raise
+        finally:
+            self.putconn(conn)
+
+    def stats(self):
+        """Return a snapshot of the pool counters."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['minconn'] = self.minconn
+        stats['maxconn'] = self.maxconn
+        stats['in_use'] = len(self._pool._used)
+        stats['idle'] = len(self._pool._pool)
+        return stats
+
+    def closeall(self):
+        """Close every connection held by the pool."""
+        self._pool.closeall()
+        self._last_used.clear()
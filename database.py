@@ -1,308 +1,390 @@
 import os
+import atexit
+import logging
+import tempfile
+import threading
 import psycopg2
+import pandas as pd
 import streamlit as st
-from psycopg2 import sql
-from datetime import datetime
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from utils.connection_pool import get_connection_params
+from utils import query_stats
+from utils.cache import TTLCache
+from utils.cache_events import CACHE_CHANNEL, CacheListener
+from utils.compaction import retention_cutoff
+from utils.bulk_import import prepare_import
+from utils.write_behind import WriteBehindBuffer
+from utils.enums import Gender, Goal, ActivityLevel, MealType
+from utils.queries import (
+    NUTRITION_SERIES_COLUMNS, MEAL_SERIES_COLUMNS,
+    food_rows_from_items, empty_summary, empty_snapshot
+)
+
+DB_BACKENDS = ('postgres', 'sqlite', 'sharded')
+
+logger = logging.getLogger(__name__)
+
+_repository = None
+_repository_lock = threading.Lock()
+
+_write_buffer = None
+_write_buffer_lock = threading.Lock()
+
+# Per-user read-through caches; saves refresh the entry for that user
+_profile_cache = TTLCache(
+    maxsize=int(os.getenv("PROFILE_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("PROFILE_CACHE_TTL", "300"))
+)
+_metrics_cache = TTLCache(
+    maxsize=int(os.getenv("PROFILE_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("PROFILE_CACHE_TTL", "300"))
+)
+# Day totals per (user_id, date); any log write for the user drops them
+_summary_cache = TTLCache(
+    maxsize=int(os.getenv("SUMMARY_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("SUMMARY_CACHE_TTL", "60"))
+)
+# Marks users known to have no row, so they are not queried again either
+_NO_ROW = object()
+
+_cache_listeners = []
 
 def get_connection():
     """Create and return a database connection."""##u can make use of any databse which convinent to you
     try:
-        conn = psycopg2.connect(
-            dbname=os.getenv("PGDATABASE"),
-            user=os.getenv("PGUSER"),
-            password=os.getenv("PGPASSWORD"),
-            host=os.getenv("PGHOST"),
-            port=os.getenv("PGPORT")
-        )
+        conn = psycopg2.connect(**get_connection_params())
         return conn
     except psycopg2.Error as e:
         st.error(f"Unable to connect to the database: {e}")
         raise e
 
+def get_repository():
+    """Return the process-wide storage backend selected by DB_BACKEND."""
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                backend = os.getenv("DB_BACKEND", "postgres").lower()
+                if backend == 'postgres':
+                    from utils.postgres_repository import PostgresRepository
+                    _repository = PostgresRepository(replica_dsn=os.getenv("PGREPLICA_DSN") or None)
+                elif backend == 'sqlite':
+                    from utils.sqlite_repository import SqliteRepository
+                    _repository = SqliteRepository()
+                elif backend == 'sharded':
+                    from utils.sharded_repository import ShardedRepository
+                    _repository = ShardedRepository(directory_dsn=os.getenv("PGDIRECTORY_DSN"))
+                else:
+                    raise ValueError(f"DB_BACKEND must be one of {DB_BACKENDS}, got {backend!r}")
+                if os.getenv("CACHE_NOTIFY", "0").lower() in ('1', 'true', 'yes'):
+                    _start_cache_listeners(_repository)
+    return _repository
+
+def _start_cache_listeners(repository):
+    """Have writes announce themselves and listen for other processes' writes."""
+    for connect_kwargs in repository.enable_cache_events(CACHE_CHANNEL):
+        listener = CacheListener(connect_kwargs, _evict_cached, _clear_caches)
+        listener.start()
+        _cache_listeners.append(listener)
+
+def _evict_cached(entity, user_id):
+    if entity == 'profile':
+        _profile_cache.invalidate(user_id)
+    elif entity == 'health_metrics':
+        _metrics_cache.invalidate(user_id)
+    elif entity == 'logs':
+        _summary_cache.invalidate_where(lambda key: key[0] == user_id)
+
+def _evict_logs(user_ids):
+    user_ids = set(user_ids)
+    _summary_cache.invalidate_where(lambda key: key[0] in user_ids)
+
+def _clear_caches():
+    _profile_cache.clear()
+    _metrics_cache.clear()
+    _summary_cache.clear()
+
+def get_write_buffer():
+    """Return the write-behind buffer for log writes, or None when WRITE_BEHIND is off."""
+    global _write_buffer
+    if _write_buffer is None and os.getenv("WRITE_BEHIND", "0").lower() in ('1', 'true', 'yes'):
+        with _write_buffer_lock:
+            if _write_buffer is None:
+                _write_buffer = WriteBehindBuffer(
+                    get_repository(),
+                    journal_path=os.getenv("WRITE_BEHIND_JOURNAL", "write_behind.journal"),
+                    interval=int(os.getenv("WRITE_BEHIND_INTERVAL_MS", "500")) / 1000,
+                    max_rows=int(os.getenv("WRITE_BEHIND_MAX_ROWS", "100")),
+                    on_flush=_evict_logs
+                )
+                atexit.register(_write_buffer.close)
+    return _write_buffer
+
+@contextmanager
+def _buffered_read():
+    """Yield the write-behind buffer, or None, for a read that merges its queued rows."""
+    buffer = get_write_buffer()
+    if buffer is None:
+        yield None
+        return
+    with buffer.reading():
+        yield buffer
+
+def _flush_write_buffer():
+    if _write_buffer is not None:
+        _write_buffer.flush()
+
+@contextmanager
+def db_connection():
+    """Borrow a connection from the configured backend."""
+    with get_repository().connection() as conn:
+        yield conn
+
+def _cache_get(cache, user_id):
+    """Return (found, value) for a user from one of the caches."""
+    value = cache.get(user_id, None)
+    if value is None:
+        return False, None
+    if value is _NO_ROW:
+        return True, None
+    return True, dict(value)
+
+def _cache_set(cache, user_id, value):
+    cache.set(user_id, _NO_ROW if value is None else dict(value))
+
+def get_cache_stats():
+    """Return hit/miss counters for the caches and the invalidation listeners."""
+    return {
+        'profile': _profile_cache.stats(),
+        'health_metrics': _metrics_cache.stats(),
+        'daily_summary': _summary_cache.stats(),
+        'listeners': [listener.stats() for listener in _cache_listeners]
+    }
+
+def get_write_buffer_stats():
+    """Return queue and flush counters for the write-behind buffer."""
+    if _write_buffer is None:
+        return None
+    return _write_buffer.stats()
+
+def get_query_stats():
+    """Return the per-query latency histogram and recent slow queries."""
+    return query_stats.snapshot()
+
+def get_rerun_query_stats():
+    """Return query count and time spent so far in the current Streamlit rerun."""
+    return query_stats.rerun_totals()
+
+def show_query_stats():
+    """
+    Show this rerun's query totals in the sidebar when SHOW_QUERY_STATS is set.
+
+    Call it at the end of a page so it covers every query the render made;
+    the totals are reset afterwards.
+    """
+    totals = query_stats.rerun_totals()
+    query_stats.reset_rerun()
+    if os.getenv("SHOW_QUERY_STATS", "0").lower() not in ('1', 'true', 'yes'):
+        return
+    st.sidebar.caption(
+        f"{totals['queries']} queries, {totals['total_ms']:.0f} ms "
+        f"(connect {totals['connect_ms']:.0f}, execute {totals['execute_ms']:.0f}, "
+        f"fetch {totals['fetch_ms']:.0f}), {totals['rows']} rows"
+    )
+
+def get_pool_stats():
+    """Return connection statistics for the configured backend."""
+    if _repository is None:
+        return None
+    return _repository.stats()
+
 def initialize_database():
-    """Create necessary tables if they don't exist."""
-    conn = get_connection()
-    cur = conn.cursor()
-    
+    """Create necessary tables and apply pending schema migrations."""
     try:
-        # Create users table
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            username VARCHAR(50) UNIQUE NOT NULL,
-            password VARCHAR(256) NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-        
-        # Create user_profiles table
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS user_profiles (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id),
-            weight FLOAT,
-            height FLOAT,
-            age INTEGER,
-            gender VARCHAR(10),
-            goal VARCHAR(20),
-            activity_level VARCHAR(20),
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-        
-        # Create health_metrics table
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS health_metrics (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id),
-            bmi FLOAT,
-            bmr FLOAT,
-            tdee FLOAT,
-            target_calories FLOAT,
-            protein_target FLOAT,
-            fat_target FLOAT,
-            carbs_target FLOAT,
-            calculated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-        
-        # Create food_logs table
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS food_logs (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id),
-            food_name VARCHAR(100),
-            calories FLOAT,
-            protein FLOAT,
-            fat FLOAT,
-            carbs FLOAT,
-            portion_size VARCHAR(50),
-            meal_type VARCHAR(20),
-            consumed_at DATE DEFAULT CURRENT_DATE
-        )
-        """)
-        
-        # Create exercise_logs table
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS exercise_logs (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id),
-            exercise_name VARCHAR(100),
-            duration INTEGER,
-            calories_burned FLOAT,
-            performed_at DATE DEFAULT CURRENT_DATE
+        get_repository().initialize()
+    except Exception as e:
+        st.error(f"Error initializing database: {e}")
+
+@st.cache_resource(show_spinner=False)
+def _checked_schema_version():
+    """
+    Check the schema version once per server process.
+
+    A current schema costs one lookup in schema_version and no DDL. An
+    older one is reported until `python -m utils.migrations migrate` has
+    been run, or migrated here if SCHEMA_AUTO_MIGRATE is turned on.
+    Errors are not cached, so the next rerun checks again.
+    """
+    repository = get_repository()
+    version = repository.schema_version()
+    if version < repository.latest_schema_version:
+        if os.getenv("SCHEMA_AUTO_MIGRATE", "0").lower() not in ('1', 'true', 'yes'):
+            raise RuntimeError(
+                f"the schema is at version {version} but this release needs "
+                f"{repository.latest_schema_version}; ask an operator to run "
+                f"`python -m utils.migrations migrate`"
+            )
+        repository.initialize()
+        version = repository.schema_version()
+    return version
+
+@st.cache_resource(show_spinner=False)
+def _checked_log_partitions(month):
+    """
+    Check once per process and calendar month, with one catalog query,
+    that the log partitions for the coming months exist. Missing ones are
+    only reported: creating them takes locks on the log tables, which is
+    left to the monthly migrate run.
+    """
+    missing = get_repository().check_log_partitions()
+    if missing:
+        logger.warning(
+            "Log partitions missing: %s; run `python -m utils.migrations migrate`",
+            ", ".join(missing)
         )
-        """)
-        
-        conn.commit()
+    return missing
+
+def ensure_schema():
+    """Make sure the schema is up to date; reruns reuse the first check's result."""
+    try:
+        _checked_schema_version()
+        _checked_log_partitions(datetime.now().date().replace(day=1))
+        return True
     except Exception as e:
-        conn.rollback()
         st.error(f"Error initializing database: {e}")
-    finally:
-        cur.close()
-        conn.close()
+        return False
 
 def save_user_profile(user_id, weight, height, age, gender, goal, activity_level):
-    """Save or update user profile information."""
-    conn = get_connection()
-    cur = conn.cursor()
-    
+    """Save or update user profile information and return the stored profile."""
     try:
-        # Check if profile already exists
-        cur.execute("SELECT id FROM user_profiles WHERE user_id = %s", (user_id,))
-        profile = cur.fetchone()
-        
-        if profile:
-            # Update existing profile
-            cur.execute("""
-            UPDATE user_profiles 
-            SET weight = %s, height = %s, age = %s, gender = %s, goal = %s, activity_level = %s, updated_at = CURRENT_TIMESTAMP
-            WHERE user_id = %s
-            """, (weight, height, age, gender, goal, activity_level, user_id))
-        else:
-            # Insert new profile
-            cur.execute("""
-            INSERT INTO user_profiles (user_id, weight, height, age, gender, goal, activity_level)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (user_id, weight, height, age, gender, goal, activity_level))
-        
-        conn.commit()
-        return True
+        gender, goal, activity_level = Gender.parse(gender), Goal.parse(goal), ActivityLevel.parse(activity_level)
+        profile = get_repository().save_user_profile(user_id, weight, height, age, gender, goal, activity_level)
+        _cache_set(_profile_cache, user_id, profile)
+        return profile
     except Exception as e:
-        conn.rollback()
+        _profile_cache.invalidate(user_id)
         st.error(f"Error saving user profile: {e}")
-        return False
-    finally:
-        cur.close()
-        conn.close()
+        return None
 
 def get_user_profile(user_id):
     """Retrieve user profile information."""
-    conn = get_connection()
-    cur = conn.cursor()
-    
+    found, profile = _cache_get(_profile_cache, user_id)
+    if found:
+        return profile
+
     try:
-        cur.execute("""
-        SELECT weight, height, age, gender, goal, activity_level
-        FROM user_profiles
-        WHERE user_id = %s
-        """, (user_id,))
-        profile = cur.fetchone()
-        conn.close()
-        
-        if profile:
-            return {
-                'weight': profile[0],
-                'height': profile[1],
-                'age': profile[2],
-                'gender': profile[3],
-                'goal': profile[4],
-                'activity_level': profile[5]
-            }
-        return None
+        profile = get_repository().get_user_profile(user_id)
+        _cache_set(_profile_cache, user_id, profile)
+        return profile
     except Exception as e:
         st.error(f"Error retrieving user profile: {e}")
         return None
 
+def get_user_context(user_id):
+    """Retrieve profile and health metrics, concurrently where the backend allows."""
+    profile_found, profile = _cache_get(_profile_cache, user_id)
+    metrics_found, metrics = _cache_get(_metrics_cache, user_id)
+    if profile_found and metrics_found:
+        return {'profile': profile, 'health_metrics': metrics}
+    if profile_found:
+        return {'profile': profile, 'health_metrics': get_health_metrics(user_id)}
+    if metrics_found:
+        return {'profile': get_user_profile(user_id), 'health_metrics': metrics}
+
+    try:
+        context = get_repository().get_user_context(user_id)
+        _cache_set(_profile_cache, user_id, context['profile'])
+        _cache_set(_metrics_cache, user_id, context['health_metrics'])
+        return context
+    except Exception as e:
+        st.error(f"Error retrieving user data: {e}")
+        return {'profile': None, 'health_metrics': None}
+
 def save_health_metrics(user_id, bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target):
-    """Save or update user health metrics."""
-    conn = get_connection()
-    cur = conn.cursor()
-    
+    """Save or update user health metrics and return the stored metrics."""
     try:
-        # Check if metrics already exist
-        cur.execute("SELECT id FROM health_metrics WHERE user_id = %s", (user_id,))
-        metrics = cur.fetchone()
-        
-        if metrics:
-            # Update existing metrics
-            cur.execute("""
-            UPDATE health_metrics 
-            SET bmi = %s, bmr = %s, tdee = %s, target_calories = %s, 
-                protein_target = %s, fat_target = %s, carbs_target = %s,
-                calculated_at = CURRENT_TIMESTAMP
-            WHERE user_id = %s
-            """, (bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target, user_id))
-        else:
-            # Insert new metrics
-            cur.execute("""
-            INSERT INTO health_metrics 
-            (user_id, bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """, (user_id, bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target))
-        
-        conn.commit()
-        return True
+        metrics = get_repository().save_health_metrics(user_id, bmi, bmr, tdee, target_calories,
+                                                       protein_target, fat_target, carbs_target)
+        _cache_set(_metrics_cache, user_id, metrics)
+        return metrics
     except Exception as e:
-        conn.rollback()
+        _metrics_cache.invalidate(user_id)
         st.error(f"Error saving health metrics: {e}")
-        return False
-    finally:
-        cur.close()
-        conn.close()
+        return None
 
 def get_health_metrics(user_id):
     """Retrieve user health metrics."""
-    conn = get_connection()
-    cur = conn.cursor()
-    
+    found, metrics = _cache_get(_metrics_cache, user_id)
+    if found:
+        return metrics
+
     try:
-        cur.execute("""
-        SELECT bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target
-        FROM health_metrics
-        WHERE user_id = %s
-        """, (user_id,))
-        metrics = cur.fetchone()
-        conn.close()
-        
-        if metrics:
-            return {
-                'bmi': metrics[0],
-                'bmr': metrics[1],
-                'tdee': metrics[2],
-                'target_calories': metrics[3],
-                'protein_target': metrics[4],
-                'fat_target': metrics[5],
-                'carbs_target': metrics[6]
-            }
-        return None
+        metrics = get_repository().get_health_metrics(user_id)
+        _cache_set(_metrics_cache, user_id, metrics)
+        return metrics
     except Exception as e:
         st.error(f"Error retrieving health metrics: {e}")
         return None
 
 def log_food(user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type):
     """Log food consumption."""
-    conn = get_connection()
-    cur = conn.cursor()
-    
     try:
-        cur.execute("""
-        INSERT INTO food_logs 
-        (user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """, (user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type))
-        
-        conn.commit()
-        return True
+        meal_type = MealType.parse(meal_type)
+        buffer = get_write_buffer()
+        if buffer is not None:
+            buffer.add_food(user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type)
+            return True
+        logged = get_repository().log_food(user_id, food_name, calories, protein, fat, carbs,
+                                           portion_size, meal_type)
+        _evict_logs((user_id,))
+        return logged
+    except Exception as e:
+        st.error(f"Error logging food: {e}")
+        return False
+
+def log_foods_bulk(user_id, items, meal_type):
+    """Log several food items from one analysis in a single transaction."""
+    try:
+        rows = food_rows_from_items(user_id, items, meal_type)
+        if not rows:
+            return False
+
+        buffer = get_write_buffer()
+        if buffer is not None:
+            buffer.add_foods(rows)
+            return True
+        logged = get_repository().log_foods_bulk(user_id, rows)
+        _evict_logs((user_id,))
+        return logged
     except Exception as e:
-        conn.rollback()
         st.error(f"Error logging food: {e}")
         return False
-    finally:
-        cur.close()
-        conn.close()
 
 def log_exercise(user_id, exercise_name, duration, calories_burned):
     """Log exercise activity."""
-    conn = get_connection()
-    cur = conn.cursor()
-    
     try:
-        cur.execute("""
-        INSERT INTO exercise_logs 
-        (user_id, exercise_name, duration, calories_burned)
-        VALUES (%s, %s, %s, %s)
-        """, (user_id, exercise_name, duration, calories_burned))
-        
-        conn.commit()
-        return True
+        buffer = get_write_buffer()
+        if buffer is not None:
+            buffer.add_exercise(user_id, exercise_name, duration, calories_burned)
+            return True
+        logged = get_repository().log_exercise(user_id, exercise_name, duration, calories_burned)
+        _evict_logs((user_id,))
+        return logged
     except Exception as e:
-        conn.rollback()
         st.error(f"Error logging exercise: {e}")
         return False
-    finally:
-        cur.close()
-        conn.close()
 
 def get_daily_food_logs(user_id, date=None):
     """Get food logs for a specific day."""
     if date is None:
         date = datetime.now().date()
-        
-    conn = get_connection()
-    cur = conn.cursor()
-    
+
     try:
-        cur.execute("""
-        SELECT food_name, calories, protein, fat, carbs, portion_size, meal_type
-        FROM food_logs
-        WHERE user_id = %s AND consumed_at = %s
-        ORDER BY id DESC
-        """, (user_id, date))
-        logs = cur.fetchall()
-        conn.close()
-        
-        result = []
-        for log in logs:
-            result.append({
-                'food_name': log[0],
-                'calories': log[1],
-                'protein': log[2],
-                'fat': log[3],
-                'carbs': log[4],
-                'portion_size': log[5],
-                'meal_type': log[6]
-            })
+        with _buffered_read() as buffer:
+            result = get_repository().get_daily_food_logs(user_id, date)
+            if buffer is not None:
+                result = buffer.merge_food_logs(result, user_id, date)
         return result
     except Exception as e:
         st.error(f"Error retrieving food logs: {e}")
@@ -312,27 +394,12 @@ def get_daily_exercise_logs(user_id, date=None):
     """Get exercise logs for a specific day."""
     if date is None:
         date = datetime.now().date()
-        
-    conn = get_connection()
-    cur = conn.cursor()
-    
+
     try:
-        cur.execute("""
-        SELECT exercise_name, duration, calories_burned
-        FROM exercise_logs
-        WHERE user_id = %s AND performed_at = %s
-        ORDER BY id DESC
-        """, (user_id, date))
-        logs = cur.fetchall()
-        conn.close()
-        
-        result = []
-        for log in logs:
-            result.append({
-                'exercise_name': log[0],
-                'duration': log[1],
-                'calories_burned': log[2]
-            })
+        with _buffered_read() as buffer:
+            result = get_repository().get_daily_exercise_logs(user_id, date)
+            if buffer is not None:
+                result = buffer.merge_exercise_logs(result, user_id, date)
         return result
     except Exception as e:
         st.error(f"Error retrieving exercise logs: {e}")
@@ -342,42 +409,200 @@ def get_daily_summary(user_id, date=None):
     """Get nutritional summary for a specific day."""
     if date is None:
         date = datetime.now().date()
-        
-    conn = get_connection()
-    cur = conn.cursor()
-    
+
     try:
-        # Get total nutritional values
-        cur.execute("""
-        SELECT SUM(calories), SUM(protein), SUM(fat), SUM(carbs)
-        FROM food_logs
-        WHERE user_id = %s AND consumed_at = %s
-        """, (user_id, date))
-        food_totals = cur.fetchone()
-        
-        # Get total calories burned
-        cur.execute("""
-        SELECT SUM(calories_burned)
-        FROM exercise_logs
-        WHERE user_id = %s AND performed_at = %s
-        """, (user_id, date))
-        exercise_total = cur.fetchone()
-        
-        conn.close()
-        
-        return {
-            'total_calories': food_totals[0] if food_totals[0] else 0,
-            'total_protein': food_totals[1] if food_totals[1] else 0,
-            'total_fat': food_totals[2] if food_totals[2] else 0,
-            'total_carbs': food_totals[3] if food_totals[3] else 0,
-            'total_calories_burned': exercise_total[0] if exercise_total and exercise_total[0] else 0
-        }
+        with _buffered_read() as buffer:
+            result = _summary_cache.get((user_id, date))
+            if result is None:
+                result = get_repository().get_daily_summary(user_id, date)
+                _summary_cache.set((user_id, date), result)
+            result = dict(result)
+            if buffer is not None:
+                result = buffer.merge_summary(result, user_id, date)
+        return result
     except Exception as e:
         st.error(f"Error retrieving daily summary: {e}")
-        return {
-            'total_calories': 0,
-            'total_protein': 0,
-            'total_fat': 0,
-            'total_carbs': 0,
-            'total_calories_burned': 0
-        }
+        return empty_summary()
+
+def rebuild_daily_rollup(user_id=None):
+    """Recompute the daily rollup from the log tables, for one user or everyone."""
+    try:
+        # Queued rows would be counted twice once they flush
+        _flush_write_buffer()
+        rebuilt = get_repository().rebuild_daily_rollup(user_id)
+        if user_id is None:
+            _summary_cache.clear()
+        else:
+            _evict_logs((user_id,))
+        return rebuilt
+    except Exception as e:
+        st.error(f"Error rebuilding daily rollup: {e}")
+        return False
+
+def archive_log_month(table, year, month, drop=False):
+    """
+    Detach a month of food_logs or exercise_logs from the live table.
+
+    The month is kept as a standalone table unless drop is True. This is a
+    catalog change and costs nothing compared with deleting the rows.
+    Months from before partitioning go together, with the last of them.
+    Only the Postgres backend partitions its log tables; the others have
+    nothing to archive and return None.
+    """
+    try:
+        archived = get_repository().archive_log_month(table, year, month, drop=drop)
+        if archived is None:
+            st.info(f"No {table} partition for {year}-{month:02d} to archive")
+        return archived
+    except Exception as e:
+        st.error(f"Error archiving {table} for {year}-{month:02d}: {e}")
+        return None
+
+def import_logs(user_id, table, stream, fmt, column_map=None, progress=None):
+    """
+    Import a user's food_logs or exercise_logs history from a CSV or JSON stream.
+
+    Parameters:
+    stream: Binary or text stream
+    fmt (str): 'csv' or 'json' (array or JSON Lines)
+    column_map (dict): Optional {source column: target column} overrides
+    progress: Optional callable receiving the number of rows loaded so far
+
+    Returns:
+    dict: rows, skipped and errors [(line, message)], or None on failure
+    """
+    try:
+        chunks, report = prepare_import(
+            user_id, table, stream, fmt, column_map=column_map,
+            chunk_size=int(os.getenv("IMPORT_CHUNK_SIZE", "50000")),
+            max_errors=int(os.getenv("IMPORT_MAX_ERRORS", "100"))
+        )
+        get_repository().copy_log_rows(table, chunks, progress=progress)
+        _evict_logs((user_id,))
+        return report.as_dict()
+    except Exception as e:
+        st.error(f"Error importing {table}: {e}")
+        return None
+
+def compact_old_logs(retention_days=None):
+    """
+    Fold food and exercise rows older than the retention horizon into
+    per-day aggregates and move the raw rows to the archive.
+
+    retention_days defaults to LOG_RETENTION_DAYS. Returns rows moved per
+    table, or None on error.
+    """
+    try:
+        return get_repository().compact_logs(retention_cutoff(retention_days))
+    except Exception as e:
+        st.error(f"Error compacting old logs: {e}")
+        return None
+
+def get_archived_logs(user_id, table, start, end):
+    """Get a user's archived raw food_logs or exercise_logs rows between two dates."""
+    try:
+        return get_repository().get_archived_logs(user_id, table, start, end)
+    except Exception as e:
+        st.error(f"Error retrieving archived {table}: {e}")
+        return []
+
+def export_user_data(user_id, table, fmt, out, batch_size=5000):
+    """
+    Stream a user's food_logs, exercise_logs or health_metrics to `out`.
+
+    Log exports include the raw rows of compacted days from log_archive.
+    """
+    try:
+        _flush_write_buffer()
+        return get_repository().export_user_data(user_id, table, fmt, out, batch_size=batch_size)
+    except Exception as e:
+        st.error(f"Error exporting {table}: {e}")
+        return None
+
+def export_user_data_to_file(user_id, table, fmt, batch_size=5000):
+    """
+    Stream an export to a named temporary file.
+
+    Returns:
+    tuple: (path, row count), or None on error; the caller removes the file
+    """
+    fd, path = tempfile.mkstemp(prefix=f"kcap-{table}-", suffix=f".{fmt}")
+    with os.fdopen(fd, 'wb') as out:
+        row_count = export_user_data(user_id, table, fmt, out, batch_size=batch_size)
+    if row_count is None:
+        os.unlink(path)
+        return None
+    return path, row_count
+
+def get_day_snapshot(user_id, date=None):
+    """
+    Get everything the daily tracker shows for one day in a single query.
+
+    Returns food and exercise rows, per-meal totals, day totals and the
+    user's health metrics.
+    """
+    if date is None:
+        date = datetime.now().date()
+
+    try:
+        with _buffered_read() as buffer:
+            result = get_repository().get_day_snapshot(user_id, date)
+            if buffer is not None:
+                result = buffer.merge_snapshot(result, user_id, date)
+        return result
+    except Exception as e:
+        st.error(f"Error retrieving daily data: {e}")
+        return empty_snapshot()
+
+SERIES_GRANULARITIES = ('day', 'week', 'month')
+
+def _series_params(start, end, granularity):
+    if granularity not in SERIES_GRANULARITIES:
+        raise ValueError(f"granularity must be one of {SERIES_GRANULARITIES}, got {granularity!r}")
+    if end is None:
+        end = datetime.now().date()
+    if start is None:
+        start = end - timedelta(days=29)
+    return start, end, granularity
+
+def get_nutrition_series(user_id, start=None, end=None, granularity='day'):
+    """
+    Get nutrition and exercise totals per day, week or month.
+
+    Aggregation happens in the database over the daily rollup. Every
+    period in the range gets a row, with zeros where nothing was logged.
+
+    Returns:
+    DataFrame: period, calories, protein, fat, carbs, calories_burned,
+    food_count, exercise_count
+    """
+    start, end, granularity = _series_params(start, end, granularity)
+
+    try:
+        with _buffered_read() as buffer:
+            frame = get_repository().get_nutrition_series(user_id, start, end, granularity)
+            if buffer is not None:
+                frame = buffer.merge_nutrition_series(frame, user_id, start, end, granularity)
+        return frame
+    except Exception as e:
+        st.error(f"Error retrieving nutrition trends: {e}")
+        return pd.DataFrame(columns=NUTRITION_SERIES_COLUMNS)
+
+def get_meal_series(user_id, start=None, end=None, granularity='day'):
+    """
+    Get food totals per period and meal type.
+
+    Returns:
+    DataFrame: period, meal_type, calories, protein, fat, carbs, items
+    """
+    start, end, granularity = _series_params(start, end, granularity)
+
+    try:
+        with _buffered_read() as buffer:
+            frame = get_repository().get_meal_series(user_id, start, end, granularity)
+            if buffer is not None:
+                frame = buffer.merge_meal_series(frame, user_id, start, end, granularity)
+        return frame
+    except Exception as e:
+        st.error(f"Error retrieving meal trends: {e}")
+        return pd.DataFrame(columns=MEAL_SERIES_COLUMNS)
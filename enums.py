@@ -0,0 +1,114 @@
+"""
+Enumerated values shared by the pages, calculators and storage code.
+
+The members are strings, so they compare equal to and format like the
+values stored in the database. On Postgres the columns use the enum
+types created in migration 8 (ENUM_TYPES), which take 4 bytes per row
+and group and sort by their declared order. parse() accepts any letter
+case, the member name or a display label, for values coming from forms
+and imports.
+"""
+from enum import StrEnum
+from functools import cache
+
+
+class _Choice(StrEnum):
+
+    @classmethod
+    def parse(cls, value, default=None, strict=True):
+        """
+        Return the member matching value, or default if it is empty.
+
+        Unknown values raise ValueError, or give default when strict is False.
+        """
+        if value is None or value == '':
+            return default
+        if isinstance(value, cls):
+            return value
+        member = _members(cls).get(normalize(value))
+        if member is None:
+            if not strict:
+                return default
+            raise ValueError(f"{value!r} is not a valid {cls.__name__}; expected one of {cls.values()}")
+        return member
+
+    @classmethod
+    def values(cls):
+        return [member.value for member in cls]
+
+    @classmethod
+    def spellings(cls):
+        """{normalized spelling: member} accepted by parse()."""
+        return dict(_members(cls))
+
+
+def normalize(value):
+    return str(value).strip().lower().replace(' ', '_').replace('-', '_')
+
+
+@cache
+def _members(cls):
+    members = {}
+    for member in cls:
+        members[normalize(member.value)] = member
+        members[member.name.lower()] = member
+    for alias, member in getattr(cls, '_aliases', lambda: {})().items():
+        members[alias] = member
+    return members
+
+
+class Gender(_Choice):
+    MALE = 'Male'
+    FEMALE = 'Female'
+
+
+class Goal(_Choice):
+    MAINTAINING = 'Maintaining'
+    BULKING = 'Bulking'
+    CUTTING = 'Cutting'
+
+
+class ActivityLevel(_Choice):
+    SEDENTARY = 'sedentary'
+    LIGHTLY_ACTIVE = 'lightly_active'
+    MODERATELY_ACTIVE = 'moderately_active'
+    VERY_ACTIVE = 'very_active'
+    EXTRA_ACTIVE = 'extra_active'
+
+    @classmethod
+    def _aliases(cls):
+        return {'extremely_active': cls.EXTRA_ACTIVE}
+
+    @property
+    def label(self):
+        return ACTIVITY_LABELS[self]
+
+
+ACTIVITY_LABELS = {
+    ActivityLevel.SEDENTARY: "Sedentary (little or no exercise)",
+    ActivityLevel.LIGHTLY_ACTIVE: "Lightly active (light exercise/sports 1-3 days/week)",
+    ActivityLevel.MODERATELY_ACTIVE: "Moderately active (moderate exercise/sports 3-5 days/week)",
+    ActivityLevel.VERY_ACTIVE: "Very active (hard exercise/sports 6-7 days/week)",
+    ActivityLevel.EXTRA_ACTIVE: "Extra active (very hard exercise & physical job or training twice a day)"
+}
+
+
+class MealType(_Choice):
+    BREAKFAST = 'Breakfast'
+    LUNCH = 'Lunch'
+    DINNER = 'Dinner'
+    SNACK = 'Snack'
+    # Food logged without a meal, once compacted
+    OTHER = 'Other'
+
+
+# Meal types offered when logging food
+LOGGABLE_MEAL_TYPES = [MealType.BREAKFAST, MealType.LUNCH, MealType.DINNER, MealType.SNACK]
+
+# (Postgres type, enum, [(table, column)]) for migration 8
+ENUM_TYPES = (
+    ('meal_type_enum', MealType, [('food_logs', 'meal_type'), ('food_log_compacted', 'meal_type')]),
+    ('gender_enum', Gender, [('user_profiles', 'gender')]),
+    ('goal_enum', Goal, [('user_profiles', 'goal')]),
+    ('activity_level_enum', ActivityLevel, [('user_profiles', 'activity_level')])
+)
@@ -0,0 +1,200 @@
+"""
+Streaming export of a user's logged history.
+
+Rows are read through a named (server-side) cursor in fixed-size batches
+and each batch is written to the output stream before the next one is
+fetched, so memory use depends on the batch size and not on how many
+rows the user has.
+
+Days folded away by compaction keep their raw rows in log_archive. The
+food_logs and exercise_logs exports decode those entries first, since
+they are older than any live row, so the export covers the user's full
+history.
+"""
+import io
+import csv
+import json
+import uuid
+import pyarrow as pa
+import pyarrow.parquet as pq
+from utils.compaction import ARCHIVE_COLUMNS, unpack_rows
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+
+EXPORT_TABLES = {
+    'food_logs': {
+        'query': """
+        SELECT id, food_name, calories, protein, fat, carbs, portion_size, meal_type, consumed_at
+        FROM food_logs
+        WHERE user_id = %s
+        ORDER BY consumed_at, id
+        """,
+        'schema': pa.schema([
+            ('id', pa.int64()),
+            ('food_name', pa.string()),
+            ('calories', pa.float64()),
+            ('protein', pa.float64()),
+            ('fat', pa.float64()),
+            ('carbs', pa.float64()),
+            ('portion_size', pa.string()),
+            ('meal_type', pa.string()),
+            ('consumed_at', pa.date32())
+        ])
+    },
+    'exercise_logs': {
+        'query': """
+        SELECT id, exercise_name, duration, calories_burned, performed_at
+        FROM exercise_logs
+        WHERE user_id = %s
+        ORDER BY performed_at, id
+        """,
+        'schema': pa.schema([
+            ('id', pa.int64()),
+            ('exercise_name', pa.string()),
+            ('duration', pa.int64()),
+            ('calories_burned', pa.float64()),
+            ('performed_at', pa.date32())
+        ])
+    },
+    'health_metrics': {
+        'query': """
+        SELECT bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target, calculated_at
+        FROM health_metrics
+        WHERE user_id = %s
+        ORDER BY calculated_at
+        """,
+        'schema': pa.schema([
+            ('bmi', pa.float64()),
+            ('bmr', pa.float64()),
+            ('tdee', pa.float64()),
+            ('target_calories', pa.float64()),
+            ('protein_target', pa.float64()),
+            ('fat_target', pa.float64()),
+            ('carbs_target', pa.float64()),
+            ('calculated_at', pa.timestamp('us'))
+        ])
+    }
+}
+
+# Archived rows of one export table; each entry holds a user's rows for one day
+ARCHIVE_EXPORT_QUERY = """
+SELECT day, rows FROM log_archive
+WHERE source = %s AND user_id = %s
+ORDER BY day, id
+"""
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+
+def archived_batches(batches, table):
+    """Turn batches of (day, blob) log_archive rows into rows in EXPORT_TABLES column order."""
+    columns = ARCHIVE_COLUMNS[table]
+    for entries in batches:
+        rows = [
+            tuple(row[column] for column in columns) + (day,)
+            for day, blob in entries for row in unpack_rows(table, blob)
+        ]
+        if rows:
+            yield rows
+
+
+def _fetch_batches(conn, name, query, params, batch_size):
+    # Named cursors keep the result set on the server and need a transaction,
+    # which the caller's non-autocommit connection provides
+    with conn.cursor(name=f"export_{name}_{uuid.uuid4().hex}") as cur:
+        cur.itersize = batch_size
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+def iter_batches(conn, user_id, table, batch_size=5000):
+    """Yield lists of rows for one user's table through server-side cursors, archived rows first."""
+    if table in ARCHIVE_COLUMNS:
+        yield from archived_batches(
+            _fetch_batches(conn, f"{table}_archive", ARCHIVE_EXPORT_QUERY, (table, user_id), batch_size), table
+        )
+    yield from _fetch_batches(conn, table, EXPORT_TABLES[table]['query'], (user_id,), batch_size)
+
+
+def _write_csv(batches, columns, out):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    count = 0
+    for rows in batches:
+        writer.writerows(rows)
+        out.write(buffer.getvalue().encode('utf-8'))
+        buffer.seek(0)
+        buffer.truncate()
+        count += len(rows)
+    if count == 0:
+        out.write(buffer.getvalue().encode('utf-8'))
+    return count
+
+
+def _write_jsonl(batches, columns, out):
+    count = 0
+    for rows in batches:
+        out.write(''.join(
+            json.dumps(dict(zip(columns, row)), default=str) + '\n' for row in rows
+        ).encode('utf-8'))
+        count += len(rows)
+    return count
+
+
+def _write_parquet(batches, schema, out):
+    count = 0
+    # One row group per fetched batch keeps the writer's buffer bounded
+    with pq.ParquetWriter(out, schema) as writer:
+        for rows in batches:
+            columns = list(zip(*rows))
+            arrays = [pa.array(column, type=field.type) for column, field in zip(columns, schema)]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            count += len(rows)
+    return count
+
+
+def write_batches(batches, table, fmt, out):
+    """
+    Write batches of rows from one export table to a binary stream.
+
+    Parameters:
+    batches: Iterable of row lists, in EXPORT_TABLES column order
+    table (str): One of EXPORT_TABLES
+    fmt (str): 'csv', 'jsonl' or 'parquet'
+    out: Writable binary stream
+
+    Returns:
+    int: Number of rows written
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown export table {table!r}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}")
+
+    schema = EXPORT_TABLES[table]['schema']
+    if fmt == 'csv':
+        return _write_csv(batches, schema.names, out)
+    if fmt == 'jsonl':
+        return _write_jsonl(batches, schema.names, out)
+    return _write_parquet(batches, schema, out)
+
+
+def write_export(conn, user_id, table, fmt, out, batch_size=5000):
+    """
+    Stream one table of a user's data from Postgres to a binary stream.
+
+    conn must be a psycopg2 connection not in autocommit mode, since the
+    named cursor lives inside its transaction.
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown export table {table!r}")
+    return write_batches(iter_batches(conn, user_id, table, batch_size), table, fmt, out)
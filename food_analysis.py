@@ -2,64 +2,156 @@ from dotenv import load_dotenv
 import streamlit as st
 from PIL import Image
 import os
-import google.generativeai as genai
 import re
+from utils.enums import Goal
+from utils.analysis_cache import AnalysisCache, cache_key, dhash
+from utils.image_preprocessing import prepare_image
+from utils.gemini_client import GEMINI_MODEL, generate_content
 
 # Load environment variables
 load_dotenv()
 
-# Configure the Google Gemini API with the API key
-# Note that the API key is set directly in the code for demonstration purposes
-# In production, you should use environment variables: os.getenv("GEMINI_API_KEY")
-genai.configure(api_key="add your api key")#be with good amountf tokens to get faster ans accurate result
+# Bump when the nutrition prompt changes so earlier cached analyses are not reused
+NUTRITION_PROMPT_VERSION = 1
+
+NUTRITION_PROMPT = """
+    You are a nutrition expert analyzing food in images. Provide detailed, structured output in three sections separated by "---".
+    
+    SECTION 1: NUTRITIONAL INFORMATION
+    List each identified food item with its nutritional content in this format:
+    1. Food Name - Calories: X kcal, Protein: Xg, Fat: Xg, Carbs: Xg, Portion: X grams/cups/etc
+    ...
+    Total - Calories: X kcal, Protein: Xg, Fat: Xg, Carbs: Xg
+    
+    SECTION 2: PORTION SIZE ESTIMATION
+    Estimate portion sizes using reference objects if visible (hand, spoon, plate):
+    * Look for hands, utensils, or standard dishes in the image
+    * Use these as references to estimate sizes
+    * Provide measurements in grams or standard units (cups, tablespoons)
+    
+    Format each item as:
+    Food Name: Estimated X grams (about the size of Y)
+    
+    SECTION 3: HEALTH TIPS
+    Provide 3-5 specific, actionable health tips based on the meal:
+    * Comment on nutritional balance
+    * Suggest improvements or compliment healthy choices
+    * Offer meal timing advice
+    * Note any potential allergens or sensitivities
+    
+    Be precise and specific in your analysis.
+
+    dont give other text except the three sections .   """
+
+_analysis_cache = AnalysisCache()
 
 
 # Function to load Google Gemini Pro Vision API and get response
+# The model and its connection are shared by all sessions (see gemini_client.py)
 def get_gemini_response(input_prompt, image_data, nutrition_prompt):
-    # The newest Anthropic model is "claude-3-5-sonnet-20241022" which was released October 22, 2024
-    model = genai.GenerativeModel('gemini-1.5-pro-latest')
-    response = model.generate_content(
+    response = generate_content(
         [input_prompt, image_data[0], nutrition_prompt])
     return response.text
 
 
+# Yields the response text as Gemini generates it
+def stream_gemini_response(input_prompt, image_data, nutrition_prompt):
+    response = generate_content(
+        [input_prompt, image_data[0], nutrition_prompt], stream=True)
+    for chunk in response:
+        # Chunks without text (e.g. only a finish reason) have no parts
+        if chunk.parts:
+            yield chunk.text
+
+
+# Hit/miss counters of the analysis cache
+def get_analysis_cache_stats():
+    return _analysis_cache.stats()
+
+
 # Function to handle the image and prepare it for the API
+# Returns the parts to send and the report from prepare_image
 def input_image_setup(image_file):
     if image_file is not None:
-        bytes_data = image_file.getvalue()
-        image_parts = [{"mime_type": image_file.type, "data": bytes_data}]
-        return image_parts
+        bytes_data, mime_type, report = prepare_image(image_file.getvalue(), image_file.type)
+        image_parts = [{"mime_type": mime_type, "data": bytes_data}]
+        return image_parts, report
     else:
         raise FileNotFoundError("No image provided")
 
 
-# Function to parse nutritional information from Gemini response
-def parse_nutrition_info(response_text):
-    food_items = []
-    health_tips = []
-    portion_info = {}
-
-    # Split response into sections
-    sections = response_text.split("---")
-
-    # First section should be the nutritional info
-    if len(sections) >= 1:
-        nutrition_section = sections[0].strip()
-        lines = nutrition_section.split('\n')
-
-        # Enhanced pattern to include portion size
-        food_pattern = r'^\d+\.\s+(.*?)\s+-\s+Calories:\s+(\d+)\s+kcal,\s+Protein:\s+(\d+)g,\s+Fat:\s+(\d+)g,\s+Carbs:\s+(\d+)g(?:,\s+Portion:\s+(.*?))?$'
-
-        # Pattern to match total
-        total_pattern = r'^Total\s+-\s+Calories:\s+(\d+)\s+kcal,\s+Protein:\s+(\d+)g,\s+Fat:\s+(\d+)g,\s+Carbs:\s+(\d+)g'
+# Food item line, with an optional portion size
+FOOD_PATTERN = re.compile(r'^\d+\.\s+(.*?)\s+-\s+Calories:\s+(\d+)\s+kcal,\s+Protein:\s+(\d+)g,\s+Fat:\s+(\d+)g,\s+Carbs:\s+(\d+)g(?:,\s+Portion:\s+(.*?))?$')
+
+# Total line
+TOTAL_PATTERN = re.compile(r'^Total\s+-\s+Calories:\s+(\d+)\s+kcal,\s+Protein:\s+(\d+)g,\s+Fat:\s+(\d+)g,\s+Carbs:\s+(\d+)g')
+
+
+class NutritionStreamParser:
+    """
+    Incremental parser for the three sections of a Gemini response.
+
+    feed() takes text as it arrives and returns the events for the lines
+    it completed: ('item', food item), ('total', totals item),
+    ('portion', (food name, portion)) and ('tip', text). A line is parsed
+    as soon as its newline or the following "---" has arrived, and
+    close() parses whatever is left. result() gives the parsed data so
+    far in the shape parse_nutrition_info returns.
+    """
+
+    def __init__(self):
+        self.food_items = []
+        self.portion_info = {}
+        self.health_tips = []
+        self._section = 0
+        self._section_start = True
+        self._pending = ''
+
+    def feed(self, text):
+        self._pending += text
+        events = []
+        while True:
+            newline = self._pending.find('\n')
+            separator = self._pending.find('---')
+            if separator != -1 and (newline == -1 or separator < newline):
+                events += self._parse_line(self._pending[:separator])
+                self._pending = self._pending[separator + 3:]
+                self._section += 1
+                self._section_start = True
+            elif newline != -1:
+                events += self._parse_line(self._pending[:newline])
+                self._pending = self._pending[newline + 1:]
+            else:
+                return events
+
+    def close(self):
+        events = self._parse_line(self._pending)
+        self._pending = ''
+        return events
+
+    def result(self):
+        return {
+            'food_items': self.food_items,
+            'portion_info': self.portion_info,
+            'health_tips': self.health_tips
+        }
 
-        for line in lines:
-            # Try to match food item pattern
-            food_match = re.match(food_pattern, line)
+    def _parse_line(self, line):
+        line = line.rstrip()
+        if self._section_start:
+            # Blank lines and indentation before a section's first line are skipped
+            line = line.lstrip()
+            if not line:
+                return []
+            self._section_start = False
+
+        # First section should be the nutritional info
+        if self._section == 0:
+            food_match = FOOD_PATTERN.match(line)
             if food_match:
                 portion_size = food_match.group(6) if food_match.group(
                     6) else 'Standard serving'
-                food_items.append({
+                item = {
                     'name': food_match.group(1).strip(),
                     'calories': int(food_match.group(2)),
                     'protein': int(food_match.group(3)),
@@ -69,49 +161,53 @@ def parse_nutrition_info(response_text):
                     'sugars': 0,  # Default values for extended nutrition
                     'fiber': 0,
                     'sodium': 0
-                })
-                continue
+                }
+                self.food_items.append(item)
+                return [('item', item)]
 
-            # Try to match total pattern
-            total_match = re.match(total_pattern, line)
+            total_match = TOTAL_PATTERN.match(line)
             if total_match:
-                food_items.append({
+                item = {
                     'name': 'Total',
                     'calories': int(total_match.group(1)),
                     'protein': int(total_match.group(2)),
                     'fat': int(total_match.group(3)),
                     'carbs': int(total_match.group(4)),
                     'portion_size': 'Combined total'
-                })
+                }
+                self.food_items.append(item)
+                return [('total', item)]
 
-    # Second section should be the portion estimation
-    if len(sections) >= 2:
-        portion_section = sections[1].strip()
-        for line in portion_section.split('\n'):
+        # Second section should be the portion estimation
+        elif self._section == 1:
             if ':' in line and not line.startswith('#'):
                 food, portion = line.split(':', 1)
                 food = food.strip()
                 portion = portion.strip()
-                portion_info[food] = portion
+                self.portion_info[food] = portion
 
                 # Update food items with portion info
-                for item in food_items:
+                for item in self.food_items:
                     if item['name'].lower() == food.lower():
                         item['portion_size'] = portion
+                return [('portion', (food, portion))]
 
-    # Third section should be health tips
-    if len(sections) >= 3:
-        health_section = sections[2].strip()
-        for line in health_section.split('\n'):
+        # Third section should be health tips
+        elif self._section == 2:
             if line.strip() and not line.startswith('#'):
-                health_tips.append(line.strip())
+                self.health_tips.append(line.strip())
+                return [('tip', line.strip())]
+        return []
+
+
+# Function to parse nutritional information from Gemini response
+def parse_nutrition_info(response_text):
+    parser = NutritionStreamParser()
+    parser.feed(response_text)
+    parser.close()
 
     # Return structured data
-    return {
-        'food_items': food_items,
-        'portion_info': portion_info,
-        'health_tips': health_tips
-    }
+    return parser.result()
 
 
 # Function to get personalized health warnings based on user profile
@@ -146,14 +242,14 @@ def get_health_warnings(food_data, user_profile=None, health_metrics=None):
         )
 
     # Check for high-fat content for users with cutting goals
-    if user_profile.get('goal') == 'Cutting' and total_item['fat'] > (
+    if user_profile.get('goal') == Goal.CUTTING and total_item['fat'] > (
             health_metrics.get('fat_target', 65) * 0.4):
         warnings.append(
             "⚠️ This meal is high in fat, which may affect your cutting goals. Consider lower-fat alternatives."
         )
 
     # Check for low-carb content for users with bulking goals
-    if user_profile.get('goal') == 'Bulking' and total_item['carbs'] < (
+    if user_profile.get('goal') == Goal.BULKING and total_item['carbs'] < (
             health_metrics.get('carbs_target', 300) * 0.2):
         warnings.append(
             "⚠️ This meal is relatively low in carbohydrates, which may not support your bulking goals effectively."
@@ -163,61 +259,73 @@ def get_health_warnings(food_data, user_profile=None, health_metrics=None):
 
 
 # Function to analyze food image with portion size estimation and health tips
+# With stream=True it returns an iterator of parser events instead, ending
+# with ('result', the dict returned without streaming)
 def analyze_food_image(image_source,
                        description="Food items in the image",
                        user_profile=None,
-                       health_metrics=None):
-    nutrition_prompt = """
-    You are a nutrition expert analyzing food in images. Provide detailed, structured output in three sections separated by "---".
-    
-    SECTION 1: NUTRITIONAL INFORMATION
-    List each identified food item with its nutritional content in this format:
-    1. Food Name - Calories: X kcal, Protein: Xg, Fat: Xg, Carbs: Xg, Portion: X grams/cups/etc
-    ...
-    Total - Calories: X kcal, Protein: Xg, Fat: Xg, Carbs: Xg
-    
-    SECTION 2: PORTION SIZE ESTIMATION
-    Estimate portion sizes using reference objects if visible (hand, spoon, plate):
-    * Look for hands, utensils, or standard dishes in the image
-    * Use these as references to estimate sizes
-    * Provide measurements in grams or standard units (cups, tablespoons)
-    
-    Format each item as:
-    Food Name: Estimated X grams (about the size of Y)
-    
-    SECTION 3: HEALTH TIPS
-    Provide 3-5 specific, actionable health tips based on the meal:
-    * Comment on nutritional balance
-    * Suggest improvements or compliment healthy choices
-    * Offer meal timing advice
-    * Note any potential allergens or sensitivities
-    
-    Be precise and specific in your analysis.
+                       health_metrics=None,
+                       stream=False):
+    events = _analysis_events(image_source, description, user_profile,
+                              health_metrics, stream)
+    if stream:
+        return events
 
-    dont give other text except the three sections .   """
+    result = None
+    for kind, value in events:
+        if kind == 'result':
+            result = value
+    return result
 
+
+def _analysis_events(image_source, description, user_profile, health_metrics, stream):
     try:
         # Prepare the image for the API call
-        image_data = input_image_setup(image_source)
-
-        # Call the Gemini API with the prompts and image data
-        response = get_gemini_response(description, image_data,
-                                       nutrition_prompt)
-
-        # Parse the nutritional information
-        parsed_data = parse_nutrition_info(response)
+        image_data, image_report = input_image_setup(image_source)
+
+        # Reuse an earlier analysis of the same (or a near-identical) photo
+        key = cache_key(description, f"{GEMINI_MODEL}/{NUTRITION_PROMPT_VERSION}")
+        image_hash = dhash(image_data[0]['data'])
+        response = _analysis_cache.get(key, image_hash) if image_hash is not None else None
+        cached = response is not None
+
+        if cached:
+            chunks = [response]
+        elif stream:
+            chunks = stream_gemini_response(description, image_data,
+                                            NUTRITION_PROMPT)
+        else:
+            # Call the Gemini API with the prompts and image data
+            chunks = [get_gemini_response(description, image_data,
+                                          NUTRITION_PROMPT)]
+
+        # Parse the nutritional information as it arrives
+        parser = NutritionStreamParser()
+        received = []
+        for chunk in chunks:
+            received.append(chunk)
+            yield from parser.feed(chunk)
+        yield from parser.close()
+        response = ''.join(received)
+        parsed_data = parser.result()
+
+        # Responses that yielded no food items are not worth keeping
+        if not cached and image_hash is not None and parsed_data['food_items']:
+            _analysis_cache.put(key, image_hash, response)
 
         # Get personalized warnings based on user profile if available
         warnings = get_health_warnings(parsed_data, user_profile,
                                        health_metrics)
 
-        return {
+        yield 'result', {
             'success': True,
             'raw_response': response,
             'food_items': parsed_data['food_items'],
             'portion_info': parsed_data['portion_info'],
             'health_tips': parsed_data['health_tips'],
-            'warnings': warnings
+            'warnings': warnings,
+            'cached': cached,
+            'image': image_report
         }
     except Exception as e:
-        return {'success': False, 'error': str(e)}
+        yield 'result', {'success': False, 'error': str(e)}
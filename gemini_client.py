@@ -0,0 +1,60 @@
+"""
+Process-wide Gemini client.
+
+The SDK is configured and the GenerativeModel built once per server
+process, on first use, from the environment:
+- GEMINI_API_KEY (or GOOGLE_API_KEY) and GEMINI_MODEL select the account and model.
+- GEMINI_TEMPERATURE and GEMINI_MAX_OUTPUT_TOKENS set the generation config.
+- GEMINI_TIMEOUT bounds each request.
+- GEMINI_TRANSPORT picks grpc or rest.
+
+The SDK keeps one generative service client per process. It is created
+under the same lock, so every session's requests share its channel and
+connections instead of opening their own. Both the model and the channel
+are safe to use from concurrent Streamlit sessions.
+"""
+import os
+import threading
+from dotenv import load_dotenv
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+
+load_dotenv()
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-pro-latest")
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))
+GEMINI_TRANSPORT = os.getenv("GEMINI_TRANSPORT", "grpc")
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_generation_config():
+    """Generation settings from the environment; unset ones keep the model defaults."""
+    config = {}
+    if os.getenv("GEMINI_TEMPERATURE"):
+        config['temperature'] = float(os.getenv("GEMINI_TEMPERATURE"))
+    if os.getenv("GEMINI_MAX_OUTPUT_TOKENS"):
+        config['max_output_tokens'] = int(os.getenv("GEMINI_MAX_OUTPUT_TOKENS"))
+    return config
+
+
+def get_model():
+    """Return the process-wide GenerativeModel, configuring the SDK on first use."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+                if not api_key:
+                    raise ValueError("Set GEMINI_API_KEY to analyse food images")
+                genai.configure(api_key=api_key, transport=GEMINI_TRANSPORT)
+                # Create the shared service client now rather than racing on the first requests
+                genai_client.get_default_generative_client()
+                _model = genai.GenerativeModel(GEMINI_MODEL, generation_config=get_generation_config())
+    return _model
+
+
+def generate_content(contents, stream=False):
+    """Send one request through the shared model with the configured timeout."""
+    return get_model().generate_content(contents, stream=stream, request_options={'timeout': GEMINI_TIMEOUT})
@@ -1,3 +1,5 @@
+from utils.enums import Gender, Goal, ActivityLevel
+
 def calculate_bmi(weight, height):
     """
     Calculate Body Mass Index (BMI)
@@ -36,38 +38,42 @@ def calculate_bmr(weight, height, age, gender):
     weight (float): Weight in kilograms
     height (float): Height in centimeters
     age (int): Age in years
-    gender (str): 'Male' or 'Female'
+    gender (Gender or str): Gender.MALE or Gender.FEMALE, in any spelling Gender.parse accepts; required
     
     Returns:
     float: BMR value in calories per day
     """
-    if gender.lower() == 'male':
+    gender = Gender.parse(gender)
+    if gender is None:
+        raise ValueError("gender is required to calculate BMR")
+    if gender == Gender.MALE:
         bmr = (10 * weight) + (6.25 * height) - (5 * age) + 5
     else:  # female
         bmr = (10 * weight) + (6.25 * height) - (5 * age) - 161
     
     return round(bmr)
 
+ACTIVITY_MULTIPLIERS = {
+    ActivityLevel.SEDENTARY: 1.2,
+    ActivityLevel.LIGHTLY_ACTIVE: 1.375,
+    ActivityLevel.MODERATELY_ACTIVE: 1.55,
+    ActivityLevel.VERY_ACTIVE: 1.725,
+    ActivityLevel.EXTRA_ACTIVE: 1.9
+}
+
 def calculate_tdee(bmr, activity_level):
     """
     Calculate Total Daily Energy Expenditure (TDEE)
     
     Parameters:
     bmr (float): Basal Metabolic Rate
-    activity_level (str): Activity level of the user
+    activity_level (ActivityLevel or str): Activity level of the user; unknown levels count as sedentary
     
     Returns:
     float: TDEE value in calories per day
     """
-    activity_multipliers = {
-        'sedentary': 1.2,
-        'lightly_active': 1.375,
-        'moderately_active': 1.55,
-        'very_active': 1.725,
-        'extra_active': 1.9
-    }
-    
-    multiplier = activity_multipliers.get(activity_level, 1.2)
+    activity_level = ActivityLevel.parse(activity_level, strict=False)
+    multiplier = ACTIVITY_MULTIPLIERS.get(activity_level, 1.2)
     tdee = bmr * multiplier
     
     return round(tdee)
@@ -78,15 +84,18 @@ def calculate_target_calories(tdee, goal):
     
     Parameters:
     tdee (float): Total Daily Energy Expenditure
-    goal (str): 'bulking', 'cutting', or 'maintaining'
+    goal (Goal or str): Goal.BULKING, Goal.CUTTING or Goal.MAINTAINING
     
     Returns:
     float: Target calories per day
     """
-    if goal.lower() == 'bulking':
+    goal = Goal.parse(goal)
+    if goal is None:
+        raise ValueError("goal is required to calculate calorie and macronutrient targets")
+    if goal == Goal.BULKING:
         # For bulking, add 15% to TDEE
         target = tdee * 1.15
-    elif goal.lower() == 'cutting':
+    elif goal == Goal.CUTTING:
         # For cutting, subtract 20% from TDEE
         target = tdee * 0.8
     else:  # maintaining
@@ -100,17 +109,20 @@ def calculate_macronutrients(target_calories, goal):
     
     Parameters:
     target_calories (float): Target daily calorie intake
-    goal (str): 'bulking', 'cutting', or 'maintaining'
+    goal (Goal or str): Goal.BULKING, Goal.CUTTING or Goal.MAINTAINING
     
     Returns:
     dict: Contains protein, fat, and carbs targets in grams
     """
-    if goal.lower() == 'bulking':
+    goal = Goal.parse(goal)
+    if goal is None:
+        raise ValueError("goal is required to calculate calorie and macronutrient targets")
+    if goal == Goal.BULKING:
         # Higher carbs for bulking
         protein_pct = 0.25  # 25% of calories from protein
         fat_pct = 0.25      # 25% of calories from fat
         carbs_pct = 0.5     # 50% of calories from carbs
-    elif goal.lower() == 'cutting':
+    elif goal == Goal.CUTTING:
         # Higher protein for cutting
         protein_pct = 0.35  # 35% of calories from protein
         fat_pct = 0.3       # 30% of calories from fat
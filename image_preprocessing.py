@@ -0,0 +1,170 @@
+"""
+Shrinking food photos before they are sent to the vision model.
+
+Phone photos are often 4-12 MB, and uploading them dominates the time an
+analysis takes. prepare_image decodes the upload once and then:
+- applies the EXIF orientation;
+- caps the longest edge at IMAGE_MAX_EDGE pixels;
+- re-encodes to IMAGE_FORMAT (JPEG or WEBP) at IMAGE_QUALITY.
+Nothing else from the original file is kept, so EXIF data (GPS
+position, camera details) and embedded thumbnails never leave the
+server. Images that cannot be decoded are passed through unchanged.
+
+Compare analysis latency and output across sizes with
+`python -m utils.image_preprocessing photo.jpg [...] [--edges 512,1024,0]`,
+where 0 sends the original file.
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import mimetypes
+from PIL import Image, ImageOps
+
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1024"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+
+
+def prepare_image(data, mime_type=None, max_edge=IMAGE_MAX_EDGE, fmt=IMAGE_FORMAT, quality=IMAGE_QUALITY):
+    """
+    Downscale and re-encode an uploaded image.
+
+    Parameters:
+    data (bytes): The uploaded file
+    mime_type (str): Its MIME type, returned as-is if the image is passed through
+    max_edge (int): Longest edge in pixels; 0 sends the original file
+
+    Returns:
+    tuple: (bytes, MIME type, report) where report holds the byte counts
+    and dimensions before and after
+    """
+    if fmt not in MIME_TYPES:
+        raise ValueError(f"Image format must be one of {sorted(MIME_TYPES)}, got {fmt!r}")
+    start = time.perf_counter()
+    report = {'bytes_before': len(data), 'bytes_after': len(data), 'size_before': None, 'size_after': None,
+              'prepared': False, 'ms': 0.0}
+    if not max_edge:
+        return data, mime_type, report
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            report['size_before'] = image.size
+            # JPEGs decode at the smallest DCT scale still covering max_edge
+            image.draft('RGB', (max_edge, max_edge))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+            out = io.BytesIO()
+            image.save(out, fmt, quality=quality, optimize=fmt == 'JPEG')
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return data, mime_type, report
+
+    prepared = out.getvalue()
+    report.update(bytes_after=len(prepared), size_after=image.size, prepared=True,
+                  ms=(time.perf_counter() - start) * 1000)
+    return prepared, MIME_TYPES[fmt], report
+
+
+def format_bytes(count):
+    if count < 1024:
+        return f"{count} B"
+    if count < 1024 * 1024:
+        return f"{count / 1024:.1f} KB"
+    return f"{count / (1024 * 1024):.1f} MB"
+
+
+def _totals(parsed):
+    for item in parsed['food_items']:
+        if item['name'] == 'Total':
+            return item
+    return None
+
+
+def agreement(parsed, baseline):
+    """
+    Compare a parsed analysis with the baseline one.
+
+    Returns:
+    dict: Relative difference of each total and the overlap (Jaccard
+    index) of the food names, or None where the baseline lacks totals
+    """
+    names = {item['name'].lower() for item in parsed['food_items'] if item['name'] != 'Total'}
+    baseline_names = {item['name'].lower() for item in baseline['food_items'] if item['name'] != 'Total'}
+    union = names | baseline_names
+    result = {'items': len(names & baseline_names) / len(union) if union else 1.0}
+    totals, baseline_totals = _totals(parsed), _totals(baseline)
+    for field in ('calories', 'protein', 'fat', 'carbs'):
+        if not baseline_totals or not totals:
+            result[field] = None
+        elif baseline_totals[field]:
+            result[field] = abs(totals[field] - baseline_totals[field]) / baseline_totals[field]
+        else:
+            result[field] = 0.0 if totals[field] == 0 else 1.0
+    return result
+
+
+def _mean(values):
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) if values else None
+
+
+def _benchmark(paths, edges, fmt, quality, repeats, description):
+    from utils.food_analysis import get_gemini_response, parse_nutrition_info, NUTRITION_PROMPT
+
+    print(f"{'edge':>6} {'bytes':>10} {'prep ms':>8} {'model s':>8} {'items':>6} {'kcal diff':>9} {'macro diff':>10}")
+    for path in paths:
+        with open(path, 'rb') as f:
+            original = f.read()
+        print(path)
+        baseline = None
+        # The original goes first so every setting is compared with it
+        for edge in sorted(edges, key=lambda edge: edge != 0):
+            data, mime_type, report = prepare_image(original, mimetypes.guess_type(path)[0], max_edge=edge, fmt=fmt, quality=quality)
+            latencies, scores = [], []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                response = get_gemini_response(description, [{'mime_type': mime_type, 'data': data}], NUTRITION_PROMPT)
+                latencies.append(time.perf_counter() - start)
+                parsed = parse_nutrition_info(response)
+                if baseline is None:
+                    # Later baseline runs measure the model's own variation
+                    baseline = parsed
+                    continue
+                scores.append(agreement(parsed, baseline))
+            macro = _mean([_mean([score[field] for field in ('protein', 'fat', 'carbs')]) for score in scores])
+            kcal = _mean([score['calories'] for score in scores])
+            items = _mean([score['items'] for score in scores])
+            print(
+                f"{edge or 'orig':>6} {format_bytes(report['bytes_after']):>10} {report['ms']:>8.1f} "
+                f"{_mean(latencies):>8.2f} "
+                + (f"{items:>6.2f} {kcal:>9.1%} {macro:>10.1%}" if scores and kcal is not None else f"{'-':>6} {'-':>9} {'-':>10}")
+            )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='python -m utils.image_preprocessing',
+        description="Compare analysis latency and nutrition output across image size settings."
+    )
+    parser.add_argument('paths', nargs='+', help="photos to analyse")
+    parser.add_argument('--edges', default='512,768,1024,1536,0', help="longest edges to try; 0 sends the original")
+    parser.add_argument('--format', default=IMAGE_FORMAT, choices=sorted(MIME_TYPES))
+    parser.add_argument('--quality', type=int, default=IMAGE_QUALITY)
+    parser.add_argument('--repeats', type=int, default=3, help="model calls per setting")
+    parser.add_argument('--description', default="Food items in the image")
+    args = parser.parse_args()
+
+    edges = [int(edge) for edge in args.edges.split(',')]
+    if 0 not in edges:
+        sys.exit("--edges must include 0, the original image every setting is compared with")
+    _benchmark(args.paths, edges, args.format, args.quality, args.repeats, args.description)
@@ -0,0 +1,568 @@
+"""
+Versioned schema migrations.
+
+Each migration is a function taking a cursor, registered in MIGRATIONS
+with its version number. Applied versions are recorded in the
+schema_version table so every migration runs exactly once per database.
+
+Migrations marked as non-transactional run in autocommit mode so they
+can use CREATE INDEX CONCURRENTLY and not block writes on large tables.
+They must be idempotent because a failure can leave them half applied.
+
+Run pending migrations at deploy time with `python -m utils.migrations`,
+or check the schema with `python -m utils.migrations status`. The server
+then only compares the latest applied version (SCHEMA_VERSION_SELECT)
+once per process.
+"""
+import sys
+from utils.partitions import LOG_TABLES, is_partitioned, partition_log_table, with_lock_timeout
+from utils.compaction import create_compaction_tables
+from utils.sharding import create_shard_tables
+from utils.enums import ENUM_TYPES, MealType
+
+# Arbitrary key for the advisory lock serializing concurrent runners
+MIGRATION_LOCK_ID = 827301
+
+
+def _create_base_tables(cur):
+    # Create users table
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username VARCHAR(50) UNIQUE NOT NULL,
+        password VARCHAR(256) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # Create user_profiles table
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS user_profiles (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id),
+        weight FLOAT,
+        height FLOAT,
+        age INTEGER,
+        gender VARCHAR(10),
+        goal VARCHAR(20),
+        activity_level VARCHAR(20),
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # Create health_metrics table
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS health_metrics (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id),
+        bmi FLOAT,
+        bmr FLOAT,
+        tdee FLOAT,
+        target_calories FLOAT,
+        protein_target FLOAT,
+        fat_target FLOAT,
+        carbs_target FLOAT,
+        calculated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # Create food_logs table
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS food_logs (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id),
+        food_name VARCHAR(100),
+        calories FLOAT,
+        protein FLOAT,
+        fat FLOAT,
+        carbs FLOAT,
+        portion_size VARCHAR(50),
+        meal_type VARCHAR(20),
+        consumed_at DATE DEFAULT CURRENT_DATE
+    )
+    """)
+
+    # Create exercise_logs table
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS exercise_logs (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id),
+        exercise_name VARCHAR(100),
+        duration INTEGER,
+        calories_burned FLOAT,
+        performed_at DATE DEFAULT CURRENT_DATE
+    )
+    """)
+
+
+def _drop_invalid_index(cur, index_name):
+    """Drop an index left INVALID by an interrupted concurrent build."""
+    cur.execute("""
+    SELECT 1 FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE c.relname = %s AND NOT i.indisvalid
+    """, (index_name,))
+    if cur.fetchone():
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+
+
+def _create_index_concurrently(cur, index_name, definition, unique=False):
+    """Build an index without taking a write lock on the table."""
+    _drop_invalid_index(cur, index_name)
+    cur.execute(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY IF NOT EXISTS "
+        f"{index_name} ON {definition}"
+    )
+
+
+def _add_log_indexes(cur):
+    # Daily lookups filter on (user_id, date); the INCLUDE columns let the
+    # summary sums be answered with an index-only scan
+    _create_index_concurrently(
+        cur, "food_logs_user_consumed_idx",
+        "food_logs (user_id, consumed_at) INCLUDE (calories, protein, fat, carbs, meal_type)"
+    )
+    _create_index_concurrently(
+        cur, "exercise_logs_user_performed_idx",
+        "exercise_logs (user_id, performed_at) INCLUDE (calories_burned, duration)"
+    )
+
+
+def _add_unique_user_constraint(cur, table, timestamp_column):
+    """Keep the newest row per user and make user_id unique."""
+    index_name = f"{table}_user_id_idx"
+    constraint_name = f"{table}_user_id_key"
+
+    cur.execute(
+        "SELECT 1 FROM pg_constraint WHERE conname = %s", (constraint_name,)
+    )
+    if cur.fetchone():
+        return
+
+    # Remove duplicates produced by the old select-then-insert saves,
+    # keeping the most recently written row for each user
+    cur.execute(f"""
+    DELETE FROM {table} t
+    USING (
+        SELECT id, ROW_NUMBER() OVER (
+            PARTITION BY user_id ORDER BY {timestamp_column} DESC NULLS LAST, id DESC
+        ) AS rn
+        FROM {table}
+        WHERE user_id IS NOT NULL
+    ) d
+    WHERE t.id = d.id AND d.rn > 1
+    """)
+
+    _create_index_concurrently(cur, index_name, f"{table} (user_id)", unique=True)
+    # Promoting an existing unique index to a constraint is a catalog-only change
+    cur.execute(
+        f"ALTER TABLE {table} ADD CONSTRAINT {constraint_name} "
+        f"UNIQUE USING INDEX {index_name}"
+    )
+
+
+def _add_unique_user_constraints(cur):
+    _add_unique_user_constraint(cur, "user_profiles", "updated_at")
+    _add_unique_user_constraint(cur, "health_metrics", "calculated_at")
+
+
+def backfill_daily_rollup(cur, user_id=None, include_compacted=True):
+    """
+    Recompute daily_rollup from the log tables.
+
+    Runs inside the caller's transaction. The table lock makes concurrent
+    log writes wait, so their increments land on top of the rebuilt rows
+    instead of being lost. Days already compacted are counted from the
+    compacted tables; include_compacted is False only for migrations that
+    run before those tables exist.
+    """
+    cur.execute("LOCK TABLE daily_rollup IN SHARE ROW EXCLUSIVE MODE")
+    user_filter = "" if user_id is None else "WHERE user_id = %(user_id)s"
+    cur.execute(f"DELETE FROM daily_rollup {user_filter}", {'user_id': user_id})
+    compacted_food = compacted_exercise = ""
+    if include_compacted:
+        compacted_food = f"""
+            UNION ALL
+            SELECT user_id, day, calories, protein, fat, carbs, items
+            FROM food_log_compacted
+            {user_filter}"""
+        compacted_exercise = f"""
+            UNION ALL
+            SELECT user_id, day, calories_burned, sessions
+            FROM exercise_log_compacted
+            {user_filter}"""
+    cur.execute(f"""
+    INSERT INTO daily_rollup
+    (user_id, day, calories, protein, fat, carbs, food_count, calories_burned, exercise_count)
+    SELECT
+        COALESCE(f.user_id, e.user_id),
+        COALESCE(f.day, e.day),
+        COALESCE(f.calories, 0), COALESCE(f.protein, 0), COALESCE(f.fat, 0),
+        COALESCE(f.carbs, 0), COALESCE(f.food_count, 0),
+        COALESCE(e.calories_burned, 0), COALESCE(e.exercise_count, 0)
+    FROM (
+        SELECT user_id, day,
+               SUM(calories) AS calories, SUM(protein) AS protein,
+               SUM(fat) AS fat, SUM(carbs) AS carbs, SUM(items) AS food_count
+        FROM (
+            SELECT user_id, consumed_at AS day, calories, protein, fat, carbs, 1 AS items
+            FROM food_logs
+            {user_filter}
+            {compacted_food}
+        ) food
+        GROUP BY user_id, day
+    ) f
+    FULL OUTER JOIN (
+        SELECT user_id, day,
+               SUM(calories_burned) AS calories_burned, SUM(sessions) AS exercise_count
+        FROM (
+            SELECT user_id, performed_at AS day, calories_burned, 1 AS sessions
+            FROM exercise_logs
+            {user_filter}
+            {compacted_exercise}
+        ) exercise
+        GROUP BY user_id, day
+    ) e ON e.user_id = f.user_id AND e.day = f.day
+    WHERE COALESCE(f.user_id, e.user_id) IS NOT NULL
+      AND COALESCE(f.day, e.day) IS NOT NULL
+    """, {'user_id': user_id})
+
+
+def _create_daily_rollup(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS daily_rollup (
+        user_id INTEGER REFERENCES users(id),
+        day DATE,
+        calories FLOAT NOT NULL DEFAULT 0,
+        protein FLOAT NOT NULL DEFAULT 0,
+        fat FLOAT NOT NULL DEFAULT 0,
+        carbs FLOAT NOT NULL DEFAULT 0,
+        food_count INTEGER NOT NULL DEFAULT 0,
+        calories_burned FLOAT NOT NULL DEFAULT 0,
+        exercise_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day)
+    )
+    """)
+    backfill_daily_rollup(cur, include_compacted=False)
+
+
+def _partition_log_tables(cur):
+    for table in LOG_TABLES:
+        partition_log_table(cur, table)
+
+
+def _enum_case(column, enum, fallback):
+    """SQL mapping the text in `column` onto enum values in any letter case."""
+    normalized = f"replace(replace(lower(trim({column})), ' ', '_'), '-', '_')"
+    whens = "\n        ".join(
+        f"WHEN {normalized} = '{spelling}' THEN '{member.value}'"
+        for spelling, member in enum.spellings().items()
+    )
+    return f"""CASE
+        WHEN {column} IS NULL THEN NULL
+        {whens}
+        ELSE {fallback}
+    END"""
+
+
+# How each converted column is backfilled (in `batch` wide ranges of
+# `key`) and the indexes covering it, rebuilt on the new column before
+# the swap. {column} stands for the column in index definitions. Rows
+# whose spellings map to the same primary key have their `totals` summed
+# into one row.
+ENUM_COLUMNS = {
+    ('food_logs', 'meal_type'): {
+        'key': 'id', 'batch': 10000,
+        'indexes': {
+            'food_logs_user_consumed_idx': "(user_id, consumed_at) INCLUDE (calories, protein, fat, carbs, {column})"
+        }
+    },
+    ('food_log_compacted', 'meal_type'): {
+        'key': 'user_id', 'batch': 100,
+        'primary_key': ('food_log_compacted_pkey', "(user_id, day, {column})"),
+        'totals': ('calories', 'protein', 'fat', 'carbs', 'items')
+    },
+    ('user_profiles', 'gender'): {'key': 'id', 'batch': 10000},
+    ('user_profiles', 'goal'): {'key': 'id', 'batch': 10000},
+    ('user_profiles', 'activity_level'): {'key': 'id', 'batch': 10000}
+}
+
+
+def _partitions(cur, table):
+    cur.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass",
+        (table,)
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def _partition_index_name(table, index_name, partition):
+    return f"{partition}_{index_name[len(table) + 1:]}"
+
+
+def _build_index_online(cur, table, index_name, columns, unique=False):
+    """
+    Build an index without blocking writes. A partitioned table gets the
+    index on each partition concurrently, attached to an index created
+    ON ONLY the parent.
+    """
+    if not is_partitioned(cur, table):
+        _create_index_concurrently(cur, index_name, f"{table} {columns}", unique=unique)
+        return
+    cur.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {index_name} ON ONLY {table} {columns}")
+    for partition in _partitions(cur, table):
+        partition_index = _partition_index_name(table, index_name, partition)
+        _create_index_concurrently(cur, partition_index, f"{partition} {columns}", unique=unique)
+        cur.execute("SELECT 1 FROM pg_inherits WHERE inhrelid = %s::regclass", (partition_index,))
+        if not cur.fetchone():
+            cur.execute(f"ALTER INDEX {index_name} ATTACH PARTITION {partition_index}")
+
+
+def _convert_to_enum(cur, table, column, type_name, enum, fallback):
+    """
+    Change a text column to an enum type without rewriting the table
+    under an exclusive lock.
+
+    A new column is added and kept in step by a trigger, backfilled in
+    committed batches, and indexed concurrently. Values that map onto no
+    member stop the migration before the swap, listing them so they can
+    be corrected first. The swap (dropping the old column and renaming
+    the new one) is catalog-only and runs in one short transaction under
+    a lock timeout. Every step can be rerun.
+    """
+    spec = ENUM_COLUMNS[(table, column)]
+    new_column = f"{column}_new"
+    sync = f"{table}_{column}_enum_sync"
+
+    with_lock_timeout(cur, lambda: cur.execute(
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {new_column} {type_name}"
+    ))
+    cur.execute(f"""
+    CREATE OR REPLACE FUNCTION {sync}() RETURNS trigger AS $$
+    BEGIN
+        NEW.{new_column} := ({_enum_case(f"NEW.{column}", enum, fallback)})::{type_name};
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+
+    def create_trigger():
+        cur.execute(f"DROP TRIGGER IF EXISTS {sync} ON {table}")
+        cur.execute(f"CREATE TRIGGER {sync} BEFORE INSERT OR UPDATE ON {table} FOR EACH ROW EXECUTE FUNCTION {sync}()")
+
+    with_lock_timeout(cur, create_trigger)
+
+    # Rows written from here on are converted by the trigger
+    key, batch = spec['key'], spec['batch']
+    cur.execute(f"SELECT MIN({key}), MAX({key}) FROM {table}")
+    low, high = cur.fetchone()
+    if low is not None:
+        for start in range(low - 1, high, batch):
+            cur.execute(
+                f"UPDATE {table} SET {new_column} = ({_enum_case(column, enum, fallback)})::{type_name} "
+                f"WHERE {key} > %s AND {key} <= %s AND {new_column} IS NULL AND {column} IS NOT NULL",
+                (start, start + batch)
+            )
+
+    cur.execute(
+        f"SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL AND {new_column} IS NULL ORDER BY 1"
+    )
+    unmapped = [row[0] for row in cur.fetchall()]
+    if unmapped:
+        raise RuntimeError(
+            f"{table}.{column} has values that are not a valid {enum.__name__}: "
+            f"{', '.join(repr(value) for value in unmapped)}; correct or clear them "
+            f"and rerun the migration"
+        )
+
+    for index_name, columns in spec.get('indexes', {}).items():
+        _build_index_online(cur, table, f"{index_name}_new", columns.format(column=new_column))
+    primary_key = spec.get('primary_key')
+    if primary_key is not None:
+        not_null = f"{table}_{new_column}_not_null"
+        cur.execute("SELECT 1 FROM pg_constraint WHERE conname = %s", (not_null,))
+        if not cur.fetchone():
+            cur.execute(f"ALTER TABLE {table} ADD CONSTRAINT {not_null} CHECK ({new_column} IS NOT NULL) NOT VALID")
+        cur.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {not_null}")
+        if 'totals' in spec:
+            _merge_collisions(cur, table, column, new_column, primary_key[1], spec['totals'])
+        _build_index_online(cur, table, f"{primary_key[0]}_new", primary_key[1].format(column=new_column), unique=True)
+
+    def swap():
+        cur.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+        cur.execute(f"DROP TRIGGER {sync} ON {table}")
+        if primary_key is not None:
+            cur.execute(f"ALTER TABLE {table} DROP CONSTRAINT {primary_key[0]}")
+        for index_name in spec.get('indexes', {}):
+            cur.execute(f"DROP INDEX IF EXISTS {index_name}")
+        cur.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+        cur.execute(f"ALTER TABLE {table} RENAME COLUMN {new_column} TO {column}")
+        for index_name in spec.get('indexes', {}):
+            cur.execute(f"ALTER INDEX {index_name}_new RENAME TO {index_name}")
+            for partition in _partitions(cur, table):
+                cur.execute(
+                    f"ALTER INDEX IF EXISTS {_partition_index_name(table, f'{index_name}_new', partition)} "
+                    f"RENAME TO {_partition_index_name(table, index_name, partition)}"
+                )
+        if primary_key is not None:
+            # The validated CHECK lets SET NOT NULL skip its table scan
+            cur.execute(f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL")
+            cur.execute(f"ALTER TABLE {table} DROP CONSTRAINT {table}_{new_column}_not_null")
+            cur.execute(
+                f"ALTER TABLE {table} ADD CONSTRAINT {primary_key[0]} PRIMARY KEY USING INDEX {primary_key[0]}_new"
+            )
+
+    with_lock_timeout(cur, swap)
+    cur.execute(f"DROP FUNCTION IF EXISTS {sync}()")
+
+
+def _merge_collisions(cur, table, column, new_column, key, totals):
+    """
+    Sum rows whose key collides once `column` is replaced by its enum
+    value into one of them, so the new unique index can be built.
+    """
+    new_key = [name.strip() for name in key.strip("()").format(column=new_column).split(",")]
+    old_key = [column if name == new_column else name for name in new_key]
+    picked = [f"MIN({column})" if name == new_column else name for name in new_key]
+    # The trigger fills in the new column of each merged row
+    cur.execute(f"""
+    WITH merged AS (
+        DELETE FROM {table} t
+        USING (
+            SELECT {", ".join(new_key)} FROM {table} GROUP BY {", ".join(new_key)} HAVING COUNT(*) > 1
+        ) d
+        WHERE ({", ".join(f"t.{name}" for name in new_key)}) = ({", ".join(f"d.{name}" for name in new_key)})
+        RETURNING t.*
+    )
+    INSERT INTO {table} ({", ".join(old_key + list(totals))})
+    SELECT {", ".join(picked + [f"SUM({total})" for total in totals])}
+    FROM merged
+    GROUP BY {", ".join(new_key)}
+    """)
+
+
+def _use_enum_types(cur):
+    # Unknown meal types become Other; unknown profile values stop the migration
+    for type_name, enum, columns in ENUM_TYPES:
+        cur.execute("SELECT 1 FROM pg_type WHERE typname = %s", (type_name,))
+        if not cur.fetchone():
+            labels = ", ".join(f"'{value}'" for value in enum.values())
+            cur.execute(f"CREATE TYPE {type_name} AS ENUM ({labels})")
+
+        fallback = f"'{MealType.OTHER.value}'" if enum is MealType else "NULL"
+        for table, column in columns:
+            cur.execute(
+                "SELECT udt_name FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+                (table, column)
+            )
+            row = cur.fetchone()
+            if row is None or row[0] == type_name:
+                continue
+            _convert_to_enum(cur, table, column, type_name, enum, fallback)
+
+
+# (version, description, function, transactional)
+MIGRATIONS = [
+    (1, "Create base tables", _create_base_tables, True),
+    (2, "Composite indexes on food_logs and exercise_logs", _add_log_indexes, False),
+    (3, "Unique user_id on user_profiles and health_metrics", _add_unique_user_constraints, False),
+    (4, "Daily nutrition rollup table", _create_daily_rollup, True),
+    (5, "Monthly partitioning of food_logs and exercise_logs", _partition_log_tables, False),
+    (6, "Compacted log tables and raw log archive", create_compaction_tables, True),
+    (7, "Moved-user tombstones for shard rebalancing", create_shard_tables, True),
+    (8, "Enum types for meal type, gender, goal and activity level", _use_enum_types, False),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# A backwards scan of the primary key, so a single index lookup
+SCHEMA_VERSION_SELECT = "SELECT MAX(version) FROM schema_version"
+
+
+def get_applied_versions(cur):
+    """Return the set of migration versions already applied."""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description VARCHAR(200),
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cur.execute("SELECT version FROM schema_version")
+    return {row[0] for row in cur.fetchall()}
+
+
+def run_migrations(conn, target_version=None):
+    """
+    Apply all pending migrations up to target_version.
+
+    Parameters:
+    conn: psycopg2 connection, left in its original autocommit mode
+    target_version (int): Last version to apply, defaults to the latest
+
+    Returns:
+    list: Versions applied by this call
+    """
+    if target_version is None:
+        target_version = LATEST_VERSION
+
+    applied_now = []
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    try:
+        # Only one process migrates at a time; the others wait and then
+        # find nothing left to do
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            applied = get_applied_versions(cur)
+
+            for version, description, migrate, transactional in MIGRATIONS:
+                if version in applied or version > target_version:
+                    continue
+
+                if transactional:
+                    cur.execute("BEGIN")
+                    try:
+                        migrate(cur)
+                        cur.execute(
+                            "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                            (version, description)
+                        )
+                        cur.execute("COMMIT")
+                    except Exception:
+                        cur.execute("ROLLBACK")
+                        raise
+                else:
+                    migrate(cur)
+                    cur.execute(
+                        "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                        (version, description)
+                    )
+                applied_now.append(version)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+    finally:
+        cur.close()
+        conn.autocommit = autocommit
+
+    return applied_now
+
+
+if __name__ == '__main__':
+    from utils.database import get_repository
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'migrate'
+    if command not in ('migrate', 'status'):
+        sys.exit("Usage: python -m utils.migrations [migrate | status]")
+
+    repository = get_repository()
+    before = repository.schema_version()
+    if command == 'migrate':
+        repository.initialize()
+    after = repository.schema_version()
+    print(f"{repository.name} schema at version {after} of {repository.latest_schema_version}"
+          + (f" (was {before})" if after != before else ""))
+    if after < repository.latest_schema_version:
+        sys.exit(1)
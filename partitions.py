@@ -0,0 +1,316 @@
+"""
+Monthly range partitioning for the append-only log tables.
+
+food_logs and exercise_logs are partitioned by their date column into one
+partition per month (food_logs_y2026m10, ...). Rows that existed before
+partitioning stay in a single <table>_legacy partition, attached without
+copying; archiving its last month detaches it as a whole. A
+<table>_default partition catches anything outside the created months.
+
+Postgres refuses DETACH ... CONCURRENTLY while a default partition exists,
+so partitions are attached and detached with plain statements. These
+take a brief ACCESS EXCLUSIVE lock on the parent table, so they wait at
+most PARTITION_LOCK_TIMEOUT for it and retry, rather than queueing every
+query on the table behind them.
+"""
+import re
+import time
+from datetime import date
+from psycopg2 import errors
+
+LOG_TABLES = {
+    'food_logs': {
+        'column': 'consumed_at',
+        'columns': """
+            id INTEGER NOT NULL DEFAULT nextval('food_logs_id_seq'),
+            user_id INTEGER REFERENCES users(id),
+            food_name VARCHAR(100),
+            calories FLOAT,
+            protein FLOAT,
+            fat FLOAT,
+            carbs FLOAT,
+            portion_size VARCHAR(50),
+            meal_type VARCHAR(20),
+            consumed_at DATE NOT NULL DEFAULT CURRENT_DATE
+        """,
+        'indexes': {
+            'food_logs_user_consumed_idx':
+                "(user_id, consumed_at) INCLUDE (calories, protein, fat, carbs, meal_type)"
+        }
+    },
+    'exercise_logs': {
+        'column': 'performed_at',
+        'columns': """
+            id INTEGER NOT NULL DEFAULT nextval('exercise_logs_id_seq'),
+            user_id INTEGER REFERENCES users(id),
+            exercise_name VARCHAR(100),
+            duration INTEGER,
+            calories_burned FLOAT,
+            performed_at DATE NOT NULL DEFAULT CURRENT_DATE
+        """,
+        'indexes': {
+            'exercise_logs_user_performed_idx':
+                "(user_id, performed_at) INCLUDE (calories_burned, duration)"
+        }
+    }
+}
+
+# Rows with no date cannot be routed to a range partition
+MISSING_DATE = date(1970, 1, 1)
+
+PARTITION_LOCK_TIMEOUT = '2s'
+PARTITION_LOCK_ATTEMPTS = 5
+
+
+def add_months(day, months):
+    """Return the first day of the month `months` after the month of `day`."""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month_start):
+    return f"{table}_y{month_start.year}m{month_start.month:02d}"
+
+
+def is_partitioned(cur, table):
+    cur.execute("SELECT relkind FROM pg_class WHERE relname = %s", (table,))
+    row = cur.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def _table_exists(cur, table):
+    cur.execute("SELECT to_regclass(%s)", (table,))
+    return cur.fetchone()[0] is not None
+
+
+def _is_attached(cur, table):
+    cur.execute("SELECT relispartition FROM pg_class WHERE relname = %s", (table,))
+    row = cur.fetchone()
+    return bool(row) and row[0]
+
+
+def with_lock_timeout(cur, work):
+    """
+    Run work() in a transaction that gives up on locks after
+    PARTITION_LOCK_TIMEOUT, retrying with backoff. Expects an autocommit
+    cursor.
+    """
+    for attempt in range(PARTITION_LOCK_ATTEMPTS):
+        cur.execute("BEGIN")
+        try:
+            cur.execute(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'")
+            result = work()
+            cur.execute("COMMIT")
+            return result
+        except errors.LockNotAvailable:
+            cur.execute("ROLLBACK")
+            if attempt == PARTITION_LOCK_ATTEMPTS - 1:
+                raise
+            time.sleep(2 ** attempt)
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+
+
+def _retry_in_savepoint(cur, work):
+    """
+    with_lock_timeout for a step inside the caller's transaction: each
+    attempt runs in a savepoint that is rolled back if the lock times out.
+    """
+    cur.execute("SELECT current_setting('lock_timeout')")
+    previous = cur.fetchone()[0]
+    for attempt in range(PARTITION_LOCK_ATTEMPTS):
+        cur.execute("SAVEPOINT partition_lock")
+        try:
+            cur.execute(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'")
+            result = work()
+            cur.execute("SELECT set_config('lock_timeout', %s, true)", (previous,))
+            cur.execute("RELEASE SAVEPOINT partition_lock")
+            return result
+        except errors.LockNotAvailable:
+            cur.execute("ROLLBACK TO SAVEPOINT partition_lock")
+            if attempt == PARTITION_LOCK_ATTEMPTS - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def _legacy_upper_bound(cur, table):
+    """Return the exclusive upper bound of the legacy partition, if any."""
+    cur.execute("""
+    SELECT pg_get_expr(c.relpartbound, c.oid)
+    FROM pg_class c
+    WHERE c.relname = %s AND c.relispartition
+    """, (f"{table}_legacy",))
+    row = cur.fetchone()
+    if not row:
+        return None
+    match = re.search(r"TO \('(\d{4})-(\d{2})-(\d{2})'\)", row[0])
+    return date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+
+
+def create_month_partition(cur, table, month_start):
+    """
+    Create and attach the partition for one month.
+
+    Rows already sitting in the default partition for that month are
+    moved into the new table before it is attached, so the attach never
+    fails on them. The attach runs in a savepoint of the caller's
+    transaction and is retried if the parent's lock is not granted
+    within PARTITION_LOCK_TIMEOUT.
+    """
+    column = LOG_TABLES[table]['column']
+    name = partition_name(table, month_start)
+    month_end = add_months(month_start, 1)
+
+    cur.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)")
+    cur.execute(f"ALTER TABLE {name} ADD PRIMARY KEY (id)")
+    cur.execute(f"""
+    WITH moved AS (
+        DELETE FROM {table}_default
+        WHERE {column} >= %s AND {column} < %s
+        RETURNING *
+    )
+    INSERT INTO {name} SELECT * FROM moved
+    """, (month_start, month_end))
+    _retry_in_savepoint(cur, lambda: cur.execute(
+        f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+        (month_start, month_end)
+    ))
+    return name
+
+
+def ensure_log_partitions(cur, months_ahead=3, today=None):
+    """
+    Make sure every partitioned log table has partitions from the current
+    month through `months_ahead` months into the future.
+
+    Returns:
+    list: Names of the partitions created
+    """
+    if today is None:
+        today = date.today()
+
+    created = []
+    for table in LOG_TABLES:
+        if not is_partitioned(cur, table):
+            continue
+        legacy_bound = _legacy_upper_bound(cur, table)
+        for offset in range(months_ahead + 1):
+            month_start = add_months(today, offset)
+            if legacy_bound and month_start < legacy_bound:
+                continue
+            if _table_exists(cur, partition_name(table, month_start)):
+                continue
+            created.append(create_month_partition(cur, table, month_start))
+    return created
+
+
+def missing_log_partitions(cur, months_ahead=3, today=None):
+    """
+    Names of the partitions ensure_log_partitions would look for that do
+    not exist, found with a single catalog query and no locks.
+    """
+    if today is None:
+        today = date.today()
+    names = [
+        partition_name(table, add_months(today, offset))
+        for table in LOG_TABLES for offset in range(months_ahead + 1)
+    ]
+    cur.execute("SELECT name FROM unnest(%s::text[]) AS name WHERE to_regclass(name) IS NULL", (names,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def partition_log_table(cur, table):
+    """
+    Convert an existing log table into a partitioned table without copying.
+
+    Expects an autocommit cursor. A CHECK constraint covering all current
+    rows is validated first without blocking writes; the existing table is
+    then renamed to <table>_legacy and attached as the partition for every
+    date before the bound, which the validated constraint lets Postgres
+    do without scanning it. Only the short rename/attach step runs under
+    an exclusive lock, waiting at most PARTITION_LOCK_TIMEOUT for it and
+    retried if it cannot get it.
+    """
+    if is_partitioned(cur, table):
+        return
+
+    spec = LOG_TABLES[table]
+    column = spec['column']
+    legacy = f"{table}_legacy"
+    check_name = f"{table}_legacy_range"
+    # Leave a month of headroom so rows written during the swap still fit
+    bound = add_months(date.today(), 2)
+
+    cur.execute(
+        f"UPDATE {table} SET {column} = %s WHERE {column} IS NULL", (MISSING_DATE,)
+    )
+    cur.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {check_name}")
+    cur.execute(
+        f"ALTER TABLE {table} ADD CONSTRAINT {check_name} "
+        f"CHECK ({column} IS NOT NULL AND {column} < %s) NOT VALID", (bound,)
+    )
+    cur.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {check_name}")
+
+    def swap():
+        cur.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+        cur.execute(f"ALTER INDEX IF EXISTS {table}_pkey RENAME TO {legacy}_pkey")
+        for index_name in spec['indexes']:
+            cur.execute(
+                f"ALTER INDEX IF EXISTS {index_name} RENAME TO {legacy}_{index_name[len(table) + 1:]}"
+            )
+        # The validated CHECK lets SET NOT NULL skip its table scan
+        cur.execute(f"ALTER TABLE {legacy} ALTER COLUMN {column} SET NOT NULL")
+
+        cur.execute(f"CREATE TABLE {table} ({spec['columns']}) PARTITION BY RANGE ({column})")
+        cur.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+        cur.execute(
+            f"ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO (%s)",
+            (bound,)
+        )
+        # Matching indexes already on the legacy partition are attached, not rebuilt
+        for index_name, definition in spec['indexes'].items():
+            cur.execute(f"CREATE INDEX {index_name} ON {table} {definition}")
+        cur.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+        cur.execute(f"ALTER TABLE {table}_default ADD PRIMARY KEY (id)")
+
+        ensure_log_partitions(cur)
+
+    # Every statement is catalog-only, so a lock timeout costs nothing to retry
+    with_lock_timeout(cur, swap)
+
+
+def detach_month_partition(cur, table, year, month, drop=False):
+    """
+    Detach one month from a log table, keeping it as a standalone table.
+
+    Expects an autocommit cursor. The DETACH waits at most
+    PARTITION_LOCK_TIMEOUT for the parent's lock and is retried. With
+    drop=True the detached table is dropped afterwards. Daily rollup
+    totals for the month are kept.
+
+    Months from before partitioning share <table>_legacy, which is
+    detached as a whole once its last month is archived; asking for an
+    earlier one raises ValueError.
+
+    Returns:
+    str: Name of the detached table, or None if the month had no partition
+    """
+    month_start = date(year, month, 1)
+    name = partition_name(table, month_start)
+    legacy_bound = _legacy_upper_bound(cur, table)
+    if legacy_bound is not None and month_start < legacy_bound:
+        last_month = add_months(legacy_bound, -1)
+        if month_start != last_month:
+            raise ValueError(
+                f"{table}_legacy holds every month before {legacy_bound:%Y-%m}; "
+                f"archive {last_month:%Y-%m} to detach it as a whole"
+            )
+        name = f"{table}_legacy"
+    if not _table_exists(cur, name):
+        return None
+    if _is_attached(cur, name):
+        with_lock_timeout(cur, lambda: cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+    if drop:
+        cur.execute(f"DROP TABLE {name}")
+    return name
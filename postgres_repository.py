@@ -0,0 +1,466 @@
+import os
+import logging
+import threading
+import pandas as pd
+from psycopg2 import errors, extensions
+from psycopg2.extras import execute_values
+from contextlib import contextmanager
+from time import perf_counter
+from utils import async_database, query_stats, cache_events
+from utils.repository import Repository
+from utils.replica import ReplicaRouter, parse_lsn, CURRENT_LSN_SELECT, REPLAY_LSN_SELECT
+from utils.connection_pool import ConnectionPool, get_connection_params, get_pool_sizes
+from utils.bulk_import import table_columns, rows_to_csv
+from utils.compaction import compact_logs, read_archive
+from utils.export import write_export
+from utils.migrations import run_migrations, backfill_daily_rollup, LATEST_VERSION, SCHEMA_VERSION_SELECT
+from utils.partitions import ensure_log_partitions, missing_log_partitions, detach_month_partition
+from utils.queries import (
+    USER_BY_USERNAME_SELECT, USER_INSERT,
+    USER_PROFILE_SELECT, USER_PROFILE_UPSERT, HEALTH_METRICS_SELECT, HEALTH_METRICS_UPSERT,
+    FOOD_LOG_INSERT, FOOD_LOG_BULK_INSERT, EXERCISE_LOG_INSERT, DAILY_ROLLUP_ADD,
+    FOOD_LOG_BATCH_INSERT, EXERCISE_LOG_BATCH_INSERT, DAILY_ROLLUP_BATCH_ADD,
+    DAILY_FOOD_LOGS_SELECT, DAILY_EXERCISE_LOGS_SELECT, DAILY_SUMMARY_SELECT, DAY_SNAPSHOT_SELECT,
+    NUTRITION_SERIES_SELECT, MEAL_SERIES_SELECT,
+    daily_rollup_params, food_rows_rollup_params, log_batch_rollup_rows, accumulate_rollup, rollup_rows,
+    profile_from_row, metrics_from_row, food_log_from_row, exercise_log_from_row,
+    summary_from_row, snapshot_from_row
+)
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_frame(cur, query, params):
+    """Run a query and build a DataFrame straight from the cursor rows."""
+    cur.execute(query, params)
+    columns = [column[0] for column in cur.description]
+    return pd.DataFrame.from_records(cur.fetchall(), columns=columns)
+
+
+class InstrumentedCursor(extensions.cursor):
+    """psycopg2 cursor that reports each statement and fetch to query_stats."""
+
+    _record = None
+
+    def execute(self, query, vars=None):
+        start = perf_counter()
+        result = super().execute(query, vars)
+        elapsed = perf_counter() - start
+
+        explain = None
+        if self.name is None and query_stats.is_explainable(query):
+            explain = lambda statement=self.query: self._explain(statement)
+        rows = self.rowcount if self.description is None and self.rowcount > 0 else 0
+        self._record = query_stats.record_execute(query, elapsed, rows=rows, explain=explain)
+        return result
+
+    def _explain(self, statement):
+        # A plain cursor, so the EXPLAIN itself is not recorded; the savepoint
+        # keeps a failed EXPLAIN from aborting the caller's transaction
+        savepoint = not self.connection.autocommit
+        with extensions.cursor(self.connection) as cur:
+            if savepoint:
+                cur.execute("SAVEPOINT query_stats_explain")
+            try:
+                cur.execute(b"EXPLAIN " + statement)
+                plan = "\n".join(row[0] for row in cur.fetchall())
+            except Exception:
+                if savepoint:
+                    cur.execute("ROLLBACK TO SAVEPOINT query_stats_explain")
+                raise
+            if savepoint:
+                cur.execute("RELEASE SAVEPOINT query_stats_explain")
+            return plan
+
+    def fetchone(self):
+        start = perf_counter()
+        row = super().fetchone()
+        query_stats.record_fetch(self._record, perf_counter() - start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        start = perf_counter()
+        rows = super().fetchmany() if size is None else super().fetchmany(size)
+        query_stats.record_fetch(self._record, perf_counter() - start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = perf_counter()
+        rows = super().fetchall()
+        query_stats.record_fetch(self._record, perf_counter() - start, len(rows))
+        return rows
+
+
+class PostgresRepository(Repository):
+    """
+    PostgreSQL storage through a process-wide psycopg2 connection pool.
+
+    With a replica_dsn, per-user reads go to a second pool on the replica,
+    except for users whose latest write it has not replayed yet (see
+    replica.py).
+    """
+
+    name = 'postgres'
+    latest_schema_version = LATEST_VERSION
+
+    # Called first in each user write transaction with (cursor, user_ids);
+    # ShardedRepository uses it to fence users moving between shards
+    write_fence = None
+
+    # Called first in each shard-wide maintenance transaction with the
+    # cursor; ShardedRepository uses it to keep moves out
+    maintenance_fence = None
+
+    # LISTEN/NOTIFY channel announcing writes, set by enable_cache_events
+    notify_channel = None
+
+    def __init__(self, replica_dsn=None, **connect_kwargs):
+        self.connect_kwargs = connect_kwargs or get_connection_params()
+        self.replica_dsn = replica_dsn
+        self.router = ReplicaRouter() if replica_dsn else None
+        self._pool = None
+        self._replica_pool = None
+        self._async_pool = None
+        self._pool_lock = threading.Lock()
+
+    def _new_pool(self, **connect_kwargs):
+        return ConnectionPool(
+            minconn=int(os.getenv("PGPOOL_MINCONN", "1")),
+            maxconn=get_pool_sizes()[0],
+            timeout=float(os.getenv("PGPOOL_TIMEOUT", "10")),
+            ping_after=float(os.getenv("PGPOOL_PING_AFTER", "30")),
+            cursor_factory=InstrumentedCursor,
+            **connect_kwargs
+        )
+
+    @property
+    def pool(self):
+        """The connection pool, created on first use."""
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = self._new_pool(**self.connect_kwargs)
+        return self._pool
+
+    @property
+    def replica_pool(self):
+        """The replica's connection pool, created on first use."""
+        if self._replica_pool is None:
+            with self._pool_lock:
+                if self._replica_pool is None:
+                    self._replica_pool = self._new_pool(dsn=self.replica_dsn)
+        return self._replica_pool
+
+    @property
+    def async_pool(self):
+        """The asyncio connection pool, opened on the background loop on first use."""
+        if self._async_pool is None:
+            with self._pool_lock:
+                if self._async_pool is None:
+                    self._async_pool = async_database.run(async_database.open_pool(**self.connect_kwargs))
+        return self._async_pool
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection; it is always returned to the pool."""
+        start = perf_counter()
+        with self.pool.connection() as conn:
+            query_stats.record_connect(perf_counter() - start)
+            yield conn
+
+    @contextmanager
+    def read_connection(self, user_id):
+        """
+        Borrow a connection for one of a user's reads.
+
+        It comes from the replica unless there is none, the user's last
+        write has not been replayed there yet, or the replica is failing.
+        """
+        if self.router is None or not self.router.use_replica(user_id, self._replay_lsn):
+            with self.connection() as conn:
+                yield conn
+            return
+
+        start = perf_counter()
+        try:
+            replica_pool = self.replica_pool
+            conn = replica_pool.getconn()
+        except Exception as e:
+            logger.warning("Replica unavailable, reading from the primary: %s", e)
+            self.router.replica_failed()
+            with self.connection() as conn:
+                yield conn
+            return
+        query_stats.record_connect(perf_counter() - start)
+        try:
+            yield conn
+        finally:
+            replica_pool.putconn(conn)
+
+    def _replay_lsn(self):
+        try:
+            with self.replica_pool.connection() as conn, conn.cursor() as cur:
+                cur.execute(REPLAY_LSN_SELECT)
+                return parse_lsn(cur.fetchone()[0])
+        except Exception as e:
+            logger.warning("Unable to read the replica's replay position: %s", e)
+            self.router.replica_failed()
+            return 0
+
+    def _pin(self, conn, user_ids):
+        """After a commit, keep the users' reads on the primary until the replica has it."""
+        if self.router is None or not user_ids:
+            return
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute(CURRENT_LSN_SELECT)
+                lsn = parse_lsn(cur.fetchone()[0])
+        finally:
+            conn.autocommit = False
+        self.router.record_write(user_ids, lsn)
+
+    def stats(self):
+        if self._pool is None:
+            return None
+        stats = self._pool.stats()
+        if self.router is not None:
+            stats['replica'] = dict(
+                self.router.stats(),
+                pool=None if self._replica_pool is None else self._replica_pool.stats()
+            )
+        return stats
+
+    def initialize(self):
+        with self.connection() as conn:
+            run_migrations(conn)
+
+            # Keep a few months of log partitions ready ahead of time
+            with conn.cursor() as cur:
+                ensure_log_partitions(cur, months_ahead=int(os.getenv("LOG_PARTITIONS_AHEAD", "3")))
+            conn.commit()
+
+    def check_log_partitions(self):
+        months_ahead = int(os.getenv("LOG_PARTITIONS_AHEAD", "3"))
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                return missing_log_partitions(cur, months_ahead=months_ahead)
+
+    def schema_version(self):
+        try:
+            row = self._fetchone(SCHEMA_VERSION_SELECT, None)
+        except errors.UndefinedTable:
+            return 0
+        return row[0] or 0
+
+    def _fetchone(self, query, params, user_id=None):
+        """Run a query and return one row; passing user_id allows the replica."""
+        with self._reader(user_id) as conn, conn.cursor() as cur:
+            cur.execute(query, params)
+            return cur.fetchone()
+
+    def _fetchall(self, query, params, user_id=None):
+        with self._reader(user_id) as conn, conn.cursor() as cur:
+            cur.execute(query, params)
+            return cur.fetchall()
+
+    def _reader(self, user_id):
+        return self.connection() if user_id is None else self.read_connection(user_id)
+
+    @contextmanager
+    def _transaction(self, user_ids=(), entity=None):
+        """
+        Cursor for one write transaction, committed when the block exits.
+
+        entity names what changed for user_ids in cache notifications.
+        """
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                self._fence(cur, user_ids)
+                yield cur
+                self._notify(cur, entity, user_ids)
+            conn.commit()
+            self._pin(conn, user_ids)
+
+    def _notify(self, cur, entity, user_ids):
+        if self.notify_channel is not None and entity is not None and user_ids:
+            cache_events.notify(cur, self.notify_channel, entity, user_ids)
+
+    def _fence(self, cur, user_ids):
+        if self.write_fence is not None and user_ids:
+            self.write_fence(cur, user_ids)
+
+    def _write(self, *statements, user_id=None, entity=None):
+        """Run (query, params) pairs in one transaction and return the first row."""
+        with self._transaction(() if user_id is None else (user_id,), entity) as cur:
+            row = None
+            for query, params in statements:
+                cur.execute(query, params)
+                if row is None and cur.description is not None:
+                    row = cur.fetchone()
+            return row
+
+    def enable_cache_events(self, channel):
+        self.notify_channel = channel
+        return [self.connect_kwargs]
+
+    def get_user_by_username(self, username):
+        return self._fetchone(USER_BY_USERNAME_SELECT, (username,))
+
+    def create_user(self, username, password_hash):
+        row = self._write((USER_INSERT, (username, password_hash)))
+        return row[0] if row else None
+
+    def get_user_profile(self, user_id):
+        return profile_from_row(self._fetchone(USER_PROFILE_SELECT, (user_id,), user_id=user_id))
+
+    def save_user_profile(self, user_id, weight, height, age, gender, goal, activity_level):
+        # Single atomic upsert keyed on the unique user_id constraint
+        return profile_from_row(self._write(
+            (USER_PROFILE_UPSERT, (user_id, weight, height, age, gender, goal, activity_level)),
+            user_id=user_id, entity='profile'
+        ))
+
+    def get_health_metrics(self, user_id):
+        return metrics_from_row(self._fetchone(HEALTH_METRICS_SELECT, (user_id,), user_id=user_id))
+
+    def save_health_metrics(self, user_id, bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target):
+        return metrics_from_row(self._write(
+            (HEALTH_METRICS_UPSERT, (user_id, bmi, bmr, tdee, target_calories,
+                                     protein_target, fat_target, carbs_target)),
+            user_id=user_id, entity='health_metrics'
+        ))
+
+    def get_user_context(self, user_id):
+        if self.router is not None:
+            # The async pool only knows the primary
+            return super().get_user_context(user_id)
+        # Both reads go out concurrently on the async pool, timed here as one
+        start = perf_counter()
+        context = async_database.run(async_database.get_user_context(self.async_pool, user_id))
+        query_stats.record_execute(
+            USER_PROFILE_SELECT + ";" + HEALTH_METRICS_SELECT, perf_counter() - start,
+            rows=sum(value is not None for value in context.values())
+        )
+        return context
+
+    def log_food(self, user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type):
+        # Keep the daily rollup in step within the same transaction
+        self._write(
+            (FOOD_LOG_INSERT, (user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type)),
+            (DAILY_ROLLUP_ADD, daily_rollup_params(user_id, calories, protein, fat, carbs, food_count=1)),
+            user_id=user_id, entity='logs'
+        )
+        return True
+
+    def log_foods_bulk(self, user_id, rows):
+        with self._transaction((user_id,), 'logs') as cur:
+            # One multi-row INSERT instead of one statement per item
+            execute_values(cur, FOOD_LOG_BULK_INSERT, rows)
+            cur.execute(DAILY_ROLLUP_ADD, food_rows_rollup_params(user_id, rows))
+        return True
+
+    def log_exercise(self, user_id, exercise_name, duration, calories_burned):
+        self._write(
+            (EXERCISE_LOG_INSERT, (user_id, exercise_name, duration, calories_burned)),
+            (DAILY_ROLLUP_ADD, daily_rollup_params(user_id, calories_burned=calories_burned, exercise_count=1)),
+            user_id=user_id, entity='logs'
+        )
+        return True
+
+    def log_batch(self, food_rows, exercise_rows):
+        user_ids = {row[0] for row in food_rows} | {row[0] for row in exercise_rows}
+        with self._transaction(user_ids, 'logs') as cur:
+            if food_rows:
+                execute_values(cur, FOOD_LOG_BATCH_INSERT, food_rows)
+            if exercise_rows:
+                execute_values(cur, EXERCISE_LOG_BATCH_INSERT, exercise_rows)
+            execute_values(cur, DAILY_ROLLUP_BATCH_ADD, log_batch_rollup_rows(food_rows, exercise_rows))
+        return True
+
+    def copy_log_rows(self, table, chunks, progress=None):
+        copy_sql = f"COPY {table} ({', '.join(table_columns(table))}) FROM STDIN WITH (FORMAT csv)"
+        totals = {}
+        loaded = 0
+        user_ids = set()
+        with self.connection() as conn, conn.cursor() as cur:
+            for chunk in chunks:
+                chunk_users = {row[0] for row in chunk}
+                self._fence(cur, chunk_users)
+                user_ids |= chunk_users
+                start = perf_counter()
+                cur.copy_expert(copy_sql, rows_to_csv(chunk))
+                query_stats.record_execute(copy_sql, perf_counter() - start, rows=len(chunk))
+                if table == 'food_logs':
+                    accumulate_rollup(totals, food_rows=chunk)
+                else:
+                    accumulate_rollup(totals, exercise_rows=chunk)
+                loaded += len(chunk)
+                if progress is not None:
+                    progress(loaded)
+            if totals:
+                execute_values(cur, DAILY_ROLLUP_BATCH_ADD, rollup_rows(totals))
+            self._notify(cur, 'logs', user_ids)
+            conn.commit()
+            self._pin(conn, user_ids)
+        return loaded
+
+    def get_daily_food_logs(self, user_id, date):
+        rows = self._fetchall(DAILY_FOOD_LOGS_SELECT, {'user_id': user_id, 'date': date}, user_id=user_id)
+        return [food_log_from_row(log) for log in rows]
+
+    def get_daily_exercise_logs(self, user_id, date):
+        rows = self._fetchall(DAILY_EXERCISE_LOGS_SELECT, {'user_id': user_id, 'date': date}, user_id=user_id)
+        return [exercise_log_from_row(log) for log in rows]
+
+    def get_daily_summary(self, user_id, date):
+        # Totals are kept up to date by the log writes
+        return summary_from_row(self._fetchone(DAILY_SUMMARY_SELECT, (user_id, date), user_id=user_id))
+
+    def get_day_snapshot(self, user_id, date):
+        return snapshot_from_row(self._fetchone(
+            DAY_SNAPSHOT_SELECT, {'user_id': user_id, 'date': date}, user_id=user_id
+        ))
+
+    def rebuild_daily_rollup(self, user_id=None):
+        with self._transaction(() if user_id is None else (user_id,), 'logs') as cur:
+            if user_id is None and self.maintenance_fence is not None:
+                self.maintenance_fence(cur)
+            backfill_daily_rollup(cur, user_id)
+        return True
+
+    def get_nutrition_series(self, user_id, start, end, granularity):
+        with self.read_connection(user_id) as conn, conn.cursor() as cur:
+            return fetch_frame(cur, NUTRITION_SERIES_SELECT, {
+                'user_id': user_id, 'start': start, 'end': end, 'granularity': granularity
+            })
+
+    def get_meal_series(self, user_id, start, end, granularity):
+        with self.read_connection(user_id) as conn, conn.cursor() as cur:
+            return fetch_frame(cur, MEAL_SERIES_SELECT, {
+                'user_id': user_id, 'start': start, 'end': end, 'granularity': granularity
+            })
+
+    def export_user_data(self, user_id, table, fmt, out, batch_size=5000):
+        with self.read_connection(user_id) as conn:
+            count = write_export(conn, user_id, table, fmt, out, batch_size=batch_size)
+            conn.commit()
+            return count
+
+    def compact_logs(self, cutoff):
+        with self.connection() as conn:
+            return compact_logs(conn, cutoff, fence=self.maintenance_fence)
+
+    def get_archived_logs(self, user_id, table, start, end):
+        with self.read_connection(user_id) as conn, conn.cursor() as cur:
+            return read_archive(cur, user_id, table, start, end)
+
+    def archive_log_month(self, table, year, month, drop=False):
+        with self.connection() as conn:
+            autocommit = conn.autocommit
+            conn.autocommit = True
+            try:
+                with conn.cursor() as cur:
+                    return detach_month_partition(cur, table, year, month, drop=drop)
+            finally:
+                conn.autocommit = autocommit
@@ -0,0 +1,392 @@
+"""
+SQL statements and row mappers shared by the sync (database.py) and
+async (async_database.py) data layers.
+
+psycopg2 and psycopg 3 use the same %s / %(name)s placeholder style, so
+both layers execute these statements unchanged and only differ in how
+they borrow connections.
+"""
+from utils.enums import Gender, Goal, ActivityLevel, MealType
+
+USER_BY_USERNAME_SELECT = """
+SELECT id, username, password FROM users WHERE username = %s
+"""
+
+USER_INSERT = """
+INSERT INTO users (username, password) VALUES (%s, %s)
+ON CONFLICT (username) DO NOTHING
+RETURNING id
+"""
+
+USER_PROFILE_SELECT = """
+SELECT weight, height, age, gender, goal, activity_level
+FROM user_profiles
+WHERE user_id = %s
+"""
+
+USER_PROFILE_UPSERT = """
+INSERT INTO user_profiles (user_id, weight, height, age, gender, goal, activity_level)
+VALUES (%s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (user_id) DO UPDATE
+SET weight = EXCLUDED.weight, height = EXCLUDED.height, age = EXCLUDED.age,
+    gender = EXCLUDED.gender, goal = EXCLUDED.goal,
+    activity_level = EXCLUDED.activity_level, updated_at = CURRENT_TIMESTAMP
+RETURNING weight, height, age, gender, goal, activity_level
+"""
+
+HEALTH_METRICS_SELECT = """
+SELECT bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target
+FROM health_metrics
+WHERE user_id = %s
+"""
+
+HEALTH_METRICS_UPSERT = """
+INSERT INTO health_metrics
+(user_id, bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (user_id) DO UPDATE
+SET bmi = EXCLUDED.bmi, bmr = EXCLUDED.bmr, tdee = EXCLUDED.tdee,
+    target_calories = EXCLUDED.target_calories,
+    protein_target = EXCLUDED.protein_target, fat_target = EXCLUDED.fat_target,
+    carbs_target = EXCLUDED.carbs_target, calculated_at = CURRENT_TIMESTAMP
+RETURNING bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target
+"""
+
+FOOD_LOG_INSERT = """
+INSERT INTO food_logs
+(user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+FOOD_LOG_BULK_INSERT = """
+INSERT INTO food_logs
+(user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type)
+VALUES %s
+"""
+
+EXERCISE_LOG_INSERT = """
+INSERT INTO exercise_logs
+(user_id, exercise_name, duration, calories_burned)
+VALUES (%s, %s, %s, %s)
+"""
+
+DAILY_ROLLUP_ADD = """
+INSERT INTO daily_rollup
+(user_id, day, calories, protein, fat, carbs, food_count, calories_burned, exercise_count)
+VALUES (%s, CURRENT_DATE, %s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (user_id, day) DO UPDATE
+SET calories = daily_rollup.calories + EXCLUDED.calories,
+    protein = daily_rollup.protein + EXCLUDED.protein,
+    fat = daily_rollup.fat + EXCLUDED.fat,
+    carbs = daily_rollup.carbs + EXCLUDED.carbs,
+    food_count = daily_rollup.food_count + EXCLUDED.food_count,
+    calories_burned = daily_rollup.calories_burned + EXCLUDED.calories_burned,
+    exercise_count = daily_rollup.exercise_count + EXCLUDED.exercise_count
+"""
+
+FOOD_LOG_BATCH_INSERT = """
+INSERT INTO food_logs
+(user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type, consumed_at)
+VALUES %s
+"""
+
+EXERCISE_LOG_BATCH_INSERT = """
+INSERT INTO exercise_logs
+(user_id, exercise_name, duration, calories_burned, performed_at)
+VALUES %s
+"""
+
+DAILY_ROLLUP_BATCH_ADD = """
+INSERT INTO daily_rollup
+(user_id, day, calories, protein, fat, carbs, food_count, calories_burned, exercise_count)
+VALUES %s
+ON CONFLICT (user_id, day) DO UPDATE
+SET calories = daily_rollup.calories + EXCLUDED.calories,
+    protein = daily_rollup.protein + EXCLUDED.protein,
+    fat = daily_rollup.fat + EXCLUDED.fat,
+    carbs = daily_rollup.carbs + EXCLUDED.carbs,
+    food_count = daily_rollup.food_count + EXCLUDED.food_count,
+    calories_burned = daily_rollup.calories_burned + EXCLUDED.calories_burned,
+    exercise_count = daily_rollup.exercise_count + EXCLUDED.exercise_count
+"""
+
+# Days past the retention horizon only have compacted rows (see compaction.py);
+# each compacted meal or day reads as one entry after the raw rows
+FOOD_LOG_ROWS = """
+SELECT id, food_name, calories, protein, fat, carbs, portion_size, meal_type
+FROM food_logs
+WHERE user_id = %(user_id)s AND consumed_at = %(date)s
+UNION ALL
+SELECT NULL, items || ' items (compacted)', calories, protein, fat, carbs, NULL, meal_type
+FROM food_log_compacted
+WHERE user_id = %(user_id)s AND day = %(date)s
+"""
+
+EXERCISE_LOG_ROWS = """
+SELECT id, exercise_name, duration, calories_burned
+FROM exercise_logs
+WHERE user_id = %(user_id)s AND performed_at = %(date)s
+UNION ALL
+SELECT NULL, sessions || ' sessions (compacted)', duration, calories_burned
+FROM exercise_log_compacted
+WHERE user_id = %(user_id)s AND day = %(date)s
+"""
+
+DAILY_FOOD_LOGS_SELECT = f"""
+SELECT food_name, calories, protein, fat, carbs, portion_size, meal_type
+FROM ({FOOD_LOG_ROWS}) logs
+ORDER BY id DESC NULLS LAST
+"""
+
+DAILY_EXERCISE_LOGS_SELECT = f"""
+SELECT exercise_name, duration, calories_burned
+FROM ({EXERCISE_LOG_ROWS}) logs
+ORDER BY id DESC NULLS LAST
+"""
+
+DAILY_SUMMARY_SELECT = """
+SELECT calories, protein, fat, carbs, calories_burned
+FROM daily_rollup
+WHERE user_id = %s AND day = %s
+"""
+
+DAY_SNAPSHOT_SELECT = f"""
+SELECT
+    (SELECT COALESCE(json_agg(json_build_array(
+            food_name, calories, protein, fat, carbs, portion_size, meal_type
+        ) ORDER BY id DESC NULLS LAST), '[]'::json)
+     FROM ({FOOD_LOG_ROWS}) logs),
+    (SELECT COALESCE(json_agg(json_build_array(
+            exercise_name, duration, calories_burned
+        ) ORDER BY id DESC NULLS LAST), '[]'::json)
+     FROM ({EXERCISE_LOG_ROWS}) logs),
+    (SELECT json_build_array(
+            bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target
+        )
+     FROM health_metrics
+     WHERE user_id = %(user_id)s
+     LIMIT 1)
+"""
+
+NUTRITION_SERIES_SELECT = """
+WITH periods AS (
+    SELECT generate_series(
+        date_trunc(%(granularity)s, %(start)s::date),
+        %(end)s::date,
+        ('1 ' || %(granularity)s)::interval
+    )::date AS period
+), totals AS (
+    SELECT date_trunc(%(granularity)s, day)::date AS period,
+           SUM(calories) AS calories, SUM(protein) AS protein,
+           SUM(fat) AS fat, SUM(carbs) AS carbs,
+           SUM(calories_burned) AS calories_burned,
+           SUM(food_count) AS food_count, SUM(exercise_count) AS exercise_count
+    FROM daily_rollup
+    WHERE user_id = %(user_id)s AND day BETWEEN %(start)s AND %(end)s
+    GROUP BY 1
+)
+SELECT p.period,
+       COALESCE(t.calories, 0) AS calories,
+       COALESCE(t.protein, 0) AS protein,
+       COALESCE(t.fat, 0) AS fat,
+       COALESCE(t.carbs, 0) AS carbs,
+       COALESCE(t.calories_burned, 0) AS calories_burned,
+       COALESCE(t.food_count, 0) AS food_count,
+       COALESCE(t.exercise_count, 0) AS exercise_count
+FROM periods p
+LEFT JOIN totals t ON t.period = p.period
+ORDER BY p.period
+"""
+
+MEAL_SERIES_SELECT = """
+SELECT date_trunc(%(granularity)s, day)::date AS period,
+       meal_type,
+       SUM(calories) AS calories, SUM(protein) AS protein,
+       SUM(fat) AS fat, SUM(carbs) AS carbs, SUM(items) AS items
+FROM (
+    SELECT consumed_at AS day, meal_type, calories, protein, fat, carbs, 1 AS items
+    FROM food_logs
+    WHERE user_id = %(user_id)s AND consumed_at BETWEEN %(start)s AND %(end)s
+    UNION ALL
+    SELECT day, meal_type, calories, protein, fat, carbs, items
+    FROM food_log_compacted
+    WHERE user_id = %(user_id)s AND day BETWEEN %(start)s AND %(end)s
+) logs
+GROUP BY 1, 2
+ORDER BY 1, 2
+"""
+
+NUTRITION_SERIES_COLUMNS = ['period', 'calories', 'protein', 'fat', 'carbs',
+                            'calories_burned', 'food_count', 'exercise_count']
+
+MEAL_SERIES_COLUMNS = ['period', 'meal_type', 'calories', 'protein', 'fat', 'carbs', 'items']
+
+
+def daily_rollup_params(user_id, calories=0, protein=0, fat=0, carbs=0, food_count=0,
+                        calories_burned=0, exercise_count=0):
+    """Parameters for DAILY_ROLLUP_ADD."""
+    return (user_id, calories or 0, protein or 0, fat or 0, carbs or 0, food_count,
+            calories_burned or 0, exercise_count)
+
+
+def food_rows_from_items(user_id, items, meal_type):
+    """Turn analysed food items into food_logs rows, skipping the Total line."""
+    meal_type = MealType.parse(meal_type)
+    return [
+        (user_id, item['name'], item['calories'], item['protein'], item['fat'],
+         item['carbs'], item.get('portion_size', 'Standard serving'), meal_type)
+        for item in items
+        if item['name'] != 'Total'
+    ]
+
+
+def food_rows_rollup_params(user_id, rows):
+    """DAILY_ROLLUP_ADD parameters covering a batch of food_logs rows."""
+    return daily_rollup_params(
+        user_id,
+        calories=sum(row[2] or 0 for row in rows),
+        protein=sum(row[3] or 0 for row in rows),
+        fat=sum(row[4] or 0 for row in rows),
+        carbs=sum(row[5] or 0 for row in rows),
+        food_count=len(rows)
+    )
+
+
+def accumulate_rollup(totals, food_rows=(), exercise_rows=()):
+    """Add dated food and exercise rows to per-(user_id, day) rollup totals."""
+    for row in food_rows:
+        total = totals.setdefault((row[0], row[8]), [0, 0, 0, 0, 0, 0, 0])
+        for index in range(4):
+            total[index] += row[2 + index] or 0
+        total[4] += 1
+    for row in exercise_rows:
+        total = totals.setdefault((row[0], row[4]), [0, 0, 0, 0, 0, 0, 0])
+        total[5] += row[3] or 0
+        total[6] += 1
+    return totals
+
+
+def rollup_rows(totals):
+    """DAILY_ROLLUP_BATCH_ADD rows from accumulate_rollup() totals."""
+    return [key + tuple(total) for key, total in totals.items()]
+
+
+def log_batch_rollup_rows(food_rows, exercise_rows):
+    """
+    DAILY_ROLLUP_BATCH_ADD rows for dated food and exercise rows.
+
+    Rows are summed per (user_id, day) first, since one INSERT ... ON
+    CONFLICT cannot update the same rollup row twice.
+    """
+    return rollup_rows(accumulate_rollup({}, food_rows, exercise_rows))
+
+
+def profile_from_row(profile):
+    if not profile:
+        return None
+    return {
+        'weight': profile[0],
+        'height': profile[1],
+        'age': profile[2],
+        'gender': Gender.parse(profile[3], strict=False),
+        'goal': Goal.parse(profile[4], strict=False),
+        'activity_level': ActivityLevel.parse(profile[5], strict=False)
+    }
+
+
+def metrics_from_row(metrics):
+    if not metrics:
+        return None
+    return {
+        'bmi': metrics[0],
+        'bmr': metrics[1],
+        'tdee': metrics[2],
+        'target_calories': metrics[3],
+        'protein_target': metrics[4],
+        'fat_target': metrics[5],
+        'carbs_target': metrics[6]
+    }
+
+
+def food_log_from_row(log):
+    return {
+        'food_name': log[0],
+        'calories': log[1],
+        'protein': log[2],
+        'fat': log[3],
+        'carbs': log[4],
+        'portion_size': log[5],
+        'meal_type': log[6]
+    }
+
+
+def exercise_log_from_row(log):
+    return {
+        'exercise_name': log[0],
+        'duration': log[1],
+        'calories_burned': log[2]
+    }
+
+
+def empty_summary():
+    return {
+        'total_calories': 0,
+        'total_protein': 0,
+        'total_fat': 0,
+        'total_carbs': 0,
+        'total_calories_burned': 0
+    }
+
+
+def summary_from_row(totals):
+    if not totals:
+        return empty_summary()
+    return {
+        'total_calories': totals[0],
+        'total_protein': totals[1],
+        'total_fat': totals[2],
+        'total_carbs': totals[3],
+        'total_calories_burned': totals[4]
+    }
+
+
+def empty_snapshot():
+    return {
+        'food_logs': [],
+        'exercise_logs': [],
+        'meal_totals': {},
+        'summary': empty_summary(),
+        'health_metrics': None
+    }
+
+
+def snapshot_from_row(row):
+    """
+    Build the day snapshot from the DAY_SNAPSHOT_SELECT result.
+
+    Per-meal and day totals are summed from the fetched rows rather than
+    with separate aggregate queries.
+    """
+    food_rows, exercise_rows, metrics = row
+    snapshot = empty_snapshot()
+    summary = snapshot['summary']
+    meal_totals = snapshot['meal_totals']
+
+    for log in food_rows:
+        snapshot['food_logs'].append(food_log_from_row(log))
+        meal = meal_totals.setdefault(log[6], {'calories': 0, 'protein': 0, 'fat': 0, 'carbs': 0})
+        meal['calories'] += log[1] or 0
+        meal['protein'] += log[2] or 0
+        meal['fat'] += log[3] or 0
+        meal['carbs'] += log[4] or 0
+        summary['total_calories'] += log[1] or 0
+        summary['total_protein'] += log[2] or 0
+        summary['total_fat'] += log[3] or 0
+        summary['total_carbs'] += log[4] or 0
+
+    for log in exercise_rows:
+        snapshot['exercise_logs'].append(exercise_log_from_row(log))
+        summary['total_calories_burned'] += log[2] or 0
+
+    snapshot['health_metrics'] = metrics_from_row(metrics)
+    return snapshot
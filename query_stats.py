@@ -0,0 +1,250 @@
+"""
+Per-query instrumentation for the storage backends.
+
+Repositories report every statement they run: the time taken to borrow a
+connection, execute time, fetch time and row count. Each statement is
+attributed to the database.py or authentication.py function that issued
+it and to a fingerprint of its SQL (literals and placeholders replaced,
+VALUES lists collapsed), and is added to an in-memory latency histogram.
+
+Totals are also kept per thread. Streamlit runs each rerun of a script
+in its own thread, so rerun_totals() reports what the current render
+cost, e.g. 5 queries taking 38 ms.
+
+Statements slower than SLOW_QUERY_MS are logged, and the most recent ones
+are kept for display. EXPLAIN runs synchronously, so a statement's plan
+is fetched at most once per SLOW_QUERY_EXPLAIN_INTERVAL seconds and the
+other slow calls are logged without one.
+"""
+import os
+import re
+import sys
+import time
+import logging
+import threading
+from collections import deque
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "300"))
+
+# Upper bounds of the histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+# Statements worth asking the planner about; DDL and utility commands are not
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+CALL_SITE_FILES = {'database.py': 'database', 'authentication.py': 'authentication'}
+
+_lock = threading.Lock()
+_queries = {}
+_connects = {}
+_slow_queries = deque(maxlen=50)
+# Fingerprint -> monotonic time its plan was last fetched
+_explained = {}
+_rerun = threading.local()
+
+_COMMENTS_AND_LITERALS = re.compile(r"(--[^\n]*)|'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+# execute_values expands one VALUES tuple per row
+_VALUES_LIST = re.compile(r'(VALUES\s*\([^()]*\))(?:\s*,\s*\([^()]*\))+', re.IGNORECASE)
+
+
+def fingerprint(sql):
+    """Normalise a statement so calls that differ only in values group together."""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    # Inlined values are stripped before the cache lookup, so statements
+    # built by execute_values share one entry
+    sql = _COMMENTS_AND_LITERALS.sub(lambda match: ' ' if match.group(1) else '?', sql)
+    return _normalise(_VALUES_LIST.sub(r'\1', sql))
+
+
+@lru_cache(maxsize=512)
+def _normalise(template):
+    sql = re.sub(r'%\(\w+\)s|%s', '?', template)
+    sql = re.sub(r'\s+', ' ', sql).strip()
+    return _VALUES_LIST.sub(r'\1', sql)
+
+
+def is_explainable(sql):
+    return fingerprint(sql).split(' ', 1)[0].upper() in EXPLAINABLE
+
+
+def call_site():
+    """Name of the nearest database.py / authentication.py function on the stack."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = CALL_SITE_FILES.get(os.path.basename(frame.f_code.co_filename))
+        if module is not None:
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return threading.current_thread().name
+
+
+def _bucket(ms):
+    for index, bound in enumerate(LATENCY_BUCKETS_MS):
+        if ms <= bound:
+            return index
+    return len(LATENCY_BUCKETS_MS)
+
+
+def _rerun_totals():
+    totals = getattr(_rerun, 'totals', None)
+    if totals is None:
+        totals = _rerun.totals = {
+            'queries': 0, 'rows': 0, 'connects': 0,
+            'connect_ms': 0.0, 'execute_ms': 0.0, 'fetch_ms': 0.0
+        }
+    return totals
+
+
+def record_connect(seconds):
+    """Record the time spent borrowing a connection."""
+    ms = seconds * 1000
+    site = call_site()
+    with _lock:
+        entry = _connects.setdefault(site, {'count': 0, 'connect_ms': 0.0, 'max_ms': 0.0})
+        entry['count'] += 1
+        entry['connect_ms'] += ms
+        entry['max_ms'] = max(entry['max_ms'], ms)
+    totals = _rerun_totals()
+    totals['connects'] += 1
+    totals['connect_ms'] += ms
+
+
+class QueryRecord:
+    """Timings for one executed statement; fetches add to it."""
+
+    __slots__ = ('site', 'fingerprint', 'execute_ms', 'fetch_ms', 'rows', 'explain', 'logged')
+
+    def __init__(self, site, sql, execute_ms, rows, explain):
+        self.site = site
+        self.fingerprint = fingerprint(sql)
+        self.execute_ms = execute_ms
+        self.fetch_ms = 0.0
+        self.rows = rows
+        self.explain = explain
+        self.logged = False
+
+    @property
+    def total_ms(self):
+        return self.execute_ms + self.fetch_ms
+
+
+def record_execute(sql, seconds, rows=0, explain=None):
+    """
+    Record one executed statement and return its QueryRecord.
+
+    explain is a callable returning the statement's plan as text; it is
+    only called if the statement turns out to be slow.
+    """
+    ms = seconds * 1000
+    record = QueryRecord(call_site(), sql, ms, rows, explain)
+    with _lock:
+        entry = _queries.get((record.site, record.fingerprint))
+        if entry is None:
+            entry = _queries[(record.site, record.fingerprint)] = {
+                'calls': 0, 'rows': 0, 'execute_ms': 0.0, 'fetch_ms': 0.0, 'max_ms': 0.0,
+                'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1)
+            }
+        entry['calls'] += 1
+        entry['rows'] += rows
+        entry['execute_ms'] += ms
+        entry['max_ms'] = max(entry['max_ms'], ms)
+        entry['buckets'][_bucket(ms)] += 1
+    totals = _rerun_totals()
+    totals['queries'] += 1
+    totals['rows'] += rows
+    totals['execute_ms'] += ms
+    _check_slow(record)
+    return record
+
+
+def record_fetch(record, seconds, rows):
+    """Add a fetch on a previously executed statement."""
+    if record is None:
+        return
+    ms = seconds * 1000
+    record.fetch_ms += ms
+    record.rows += rows
+    with _lock:
+        entry = _queries.get((record.site, record.fingerprint))
+        if entry is not None:
+            entry['rows'] += rows
+            entry['fetch_ms'] += ms
+    totals = _rerun_totals()
+    totals['rows'] += rows
+    totals['fetch_ms'] += ms
+    _check_slow(record)
+
+
+def _check_slow(record):
+    if record.logged or record.total_ms < SLOW_QUERY_MS:
+        return
+    record.logged = True
+    plan = None
+    if record.explain is not None and _should_explain(record.fingerprint):
+        try:
+            plan = record.explain()
+        except Exception as e:
+            plan = f"(plan unavailable: {e})"
+    with _lock:
+        _slow_queries.append({
+            'site': record.site,
+            'fingerprint': record.fingerprint,
+            'total_ms': round(record.total_ms, 2),
+            'plan': plan
+        })
+    logger.warning("Slow query (%.1f ms) from %s: %s\n%s",
+                   record.total_ms, record.site, record.fingerprint, plan or "")
+
+
+def _should_explain(fp):
+    now = time.monotonic()
+    with _lock:
+        last = _explained.get(fp)
+        if last is not None and now - last < SLOW_QUERY_EXPLAIN_INTERVAL:
+            return False
+        _explained[fp] = now
+        return True
+
+
+def rerun_totals():
+    """Query totals for the current thread, i.e. the current Streamlit rerun."""
+    totals = dict(_rerun_totals())
+    totals['total_ms'] = totals['connect_ms'] + totals['execute_ms'] + totals['fetch_ms']
+    return totals
+
+
+def reset_rerun():
+    _rerun.totals = None
+
+
+def snapshot():
+    """Copy of the histogram, per-site connect times and recent slow queries."""
+    with _lock:
+        return {
+            'buckets_ms': LATENCY_BUCKETS_MS,
+            'queries': [
+                dict(entry, site=site, fingerprint=fp, buckets=list(entry['buckets']))
+                for (site, fp), entry in sorted(
+                    _queries.items(),
+                    key=lambda item: item[1]['execute_ms'] + item[1]['fetch_ms'],
+                    reverse=True
+                )
+            ],
+            'connects': {site: dict(entry) for site, entry in _connects.items()},
+            'slow': list(_slow_queries)
+        }
+
+
+def reset():
+    """Clear the histogram and slow-query list."""
+    with _lock:
+        _queries.clear()
+        _connects.clear()
+        _slow_queries.clear()
+        _explained.clear()
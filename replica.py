@@ -0,0 +1,110 @@
+"""
+Read-your-writes routing between a primary and a streaming replica.
+
+Reads go to the replica unless the user wrote recently. After each
+committed write the primary's WAL position (LSN) is recorded for the
+users written, and their reads stay on the primary until the replica
+reports that it has replayed past that position. The replica's position
+is polled at most every REPLICA_LSN_CHECK_MS, and only while some user
+is pinned.
+
+Pins are kept in process memory, which matches Streamlit's single
+server process; they are per user, so all of a user's sessions see
+their own writes.
+"""
+import os
+import time
+import threading
+
+REPLICA_LSN_CHECK_MS = float(os.getenv("REPLICA_LSN_CHECK_MS", "50"))
+
+# Seconds reads stay on the primary after the replica could not be reached
+REPLICA_RETRY_SECONDS = 5
+
+CURRENT_LSN_SELECT = "SELECT pg_current_wal_lsn()::text"
+
+REPLAY_LSN_SELECT = "SELECT pg_last_wal_replay_lsn()::text"
+
+
+def parse_lsn(text):
+    """Turn an LSN such as '16/B374D848' into a comparable integer."""
+    if text is None:
+        return 0
+    high, low = text.split('/')
+    return (int(high, 16) << 32) | int(low, 16)
+
+
+class ReplicaRouter:
+    """Per-user write positions and the replica's replay position."""
+
+    def __init__(self, check_interval=REPLICA_LSN_CHECK_MS / 1000):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._pinned = {}
+        self._replica_lsn = 0
+        self._checked_at = 0.0
+        self._down_until = 0.0
+        self._stats = {'replica_reads': 0, 'pinned_reads': 0, 'fallback_reads': 0, 'replica_errors': 0, 'lsn_checks': 0}
+
+    def record_write(self, user_ids, lsn):
+        """Pin users to the primary until the replica replays `lsn`."""
+        with self._lock:
+            for user_id in user_ids:
+                if lsn > self._pinned.get(user_id, 0):
+                    self._pinned[user_id] = lsn
+
+    def use_replica(self, user_id, replay_lsn):
+        """
+        Decide where a user's read goes.
+
+        replay_lsn is a callable returning the replica's current replay
+        LSN; it is called only when the cached value is too old to clear
+        the user's pin.
+        """
+        with self._lock:
+            if time.monotonic() < self._down_until:
+                self._stats['fallback_reads'] += 1
+                return False
+            pinned = self._pinned.get(user_id)
+            if pinned is None:
+                self._stats['replica_reads'] += 1
+                return True
+            if pinned <= self._replica_lsn:
+                del self._pinned[user_id]
+                self._stats['replica_reads'] += 1
+                return True
+            stale = time.monotonic() - self._checked_at >= self.check_interval
+
+        if stale:
+            self.update_replica_lsn(replay_lsn())
+            with self._lock:
+                if self._pinned.get(user_id, 0) <= self._replica_lsn:
+                    self._pinned.pop(user_id, None)
+                    self._stats['replica_reads'] += 1
+                    return True
+
+        with self._lock:
+            self._stats['pinned_reads'] += 1
+        return False
+
+    def update_replica_lsn(self, lsn):
+        """Record a newly polled replay position and release the pins it covers."""
+        with self._lock:
+            self._stats['lsn_checks'] += 1
+            self._checked_at = time.monotonic()
+            if lsn > self._replica_lsn:
+                self._replica_lsn = lsn
+                self._pinned = {user_id: pinned for user_id, pinned in self._pinned.items() if pinned > lsn}
+
+    def replica_failed(self):
+        """Send reads to the primary for a while after a replica error."""
+        with self._lock:
+            self._stats['replica_errors'] += 1
+            self._down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pinned_users'] = len(self._pinned)
+            stats['replica_lsn'] = self._replica_lsn
+        return stats
@@ -0,0 +1,184 @@
+"""
+Backend-agnostic storage interface.
+
+database.py talks to storage only through a Repository, chosen with the
+DB_BACKEND environment variable. Implementations raise on errors; the
+functions in database.py add caching and report errors in the UI.
+
+Backends:
+    postgres  PostgresRepository (postgres_repository.py), the default
+    sqlite    SqliteRepository (sqlite_repository.py), embedded WAL database
+    sharded   ShardedRepository (sharded_repository.py), Postgres sharded by user
+"""
+from abc import ABC, abstractmethod
+
+
+class Repository(ABC):
+    """
+    Operations every storage backend provides. Abstract methods are
+    required; the others have defaults for backends without the feature.
+    """
+
+    name = None
+
+    # Schema version this code expects
+    latest_schema_version = None
+
+    @abstractmethod
+    def connection(self):
+        """Context manager yielding a backend connection."""
+
+    @abstractmethod
+    def initialize(self):
+        """Create or migrate the schema."""
+
+    @abstractmethod
+    def schema_version(self):
+        """Return the highest applied schema version, or 0 for an empty database."""
+
+    @abstractmethod
+    def stats(self):
+        """Return connection statistics."""
+
+    def enable_cache_events(self, channel):
+        """
+        Announce profile, metrics and log writes on a LISTEN/NOTIFY channel
+        (see cache_events.py).
+
+        Returns the connect keyword arguments of each database to listen
+        on; backends without notifications return none.
+        """
+        return []
+
+    # Users
+
+    @abstractmethod
+    def get_user_by_username(self, username):
+        """Return (id, username, password) or None."""
+
+    @abstractmethod
+    def create_user(self, username, password_hash):
+        """Insert a user and return its id, or None if the username is taken."""
+
+    # Profiles and metrics
+
+    @abstractmethod
+    def get_user_profile(self, user_id):
+        """Return the profile as a dict, or None."""
+
+    @abstractmethod
+    def save_user_profile(self, user_id, weight, height, age, gender, goal, activity_level):
+        """Upsert the profile and return the stored row."""
+
+    @abstractmethod
+    def get_health_metrics(self, user_id):
+        """Return the health metrics as a dict, or None."""
+
+    @abstractmethod
+    def save_health_metrics(self, user_id, bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target):
+        """Upsert the metrics and return the stored row."""
+
+    def get_user_context(self, user_id):
+        """Return profile and health metrics together."""
+        return {
+            'profile': self.get_user_profile(user_id),
+            'health_metrics': self.get_health_metrics(user_id)
+        }
+
+    # Logs
+
+    @abstractmethod
+    def log_food(self, user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type):
+        """Insert one food_logs row dated today."""
+
+    @abstractmethod
+    def log_foods_bulk(self, user_id, rows):
+        """Insert prepared food_logs rows (see queries.food_rows_from_items)."""
+
+    @abstractmethod
+    def log_exercise(self, user_id, exercise_name, duration, calories_burned):
+        """Insert one exercise_logs row dated today."""
+
+    @abstractmethod
+    def log_batch(self, food_rows, exercise_rows):
+        """
+        Insert dated rows for any number of users in one transaction.
+
+        food_rows end with consumed_at and exercise_rows with performed_at
+        (see queries.log_batch_rollup_rows); the rollup is updated to match.
+        """
+
+    @abstractmethod
+    def copy_log_rows(self, table, chunks, progress=None):
+        """
+        Bulk-load validated rows into food_logs or exercise_logs.
+
+        chunks yields lists of tuples in bulk_import.table_columns(table)
+        order. Everything loads in one transaction, with daily_rollup
+        updated to match; progress(rows_loaded) is called after each chunk.
+        Returns the number of rows loaded.
+        """
+
+    @abstractmethod
+    def get_daily_food_logs(self, user_id, date):
+        """Return the day's food entries as dicts."""
+
+    @abstractmethod
+    def get_daily_exercise_logs(self, user_id, date):
+        """Return the day's exercise entries as dicts."""
+
+    @abstractmethod
+    def get_daily_summary(self, user_id, date):
+        """Return the day's nutrition totals."""
+
+    @abstractmethod
+    def get_day_snapshot(self, user_id, date):
+        """Return the day's summary and logs together."""
+
+    @abstractmethod
+    def rebuild_daily_rollup(self, user_id=None):
+        """Recompute daily_rollup from the logs, for one user or everyone."""
+
+    # Ranges and exports
+
+    @abstractmethod
+    def get_nutrition_series(self, user_id, start, end, granularity):
+        """Return a DataFrame of totals per period, zero-filled."""
+
+    @abstractmethod
+    def get_meal_series(self, user_id, start, end, granularity):
+        """Return a DataFrame of food totals per period and meal type."""
+
+    @abstractmethod
+    def export_user_data(self, user_id, table, fmt, out, batch_size=5000):
+        """Stream one table of a user's rows to `out`; return the row count."""
+
+    @abstractmethod
+    def compact_logs(self, cutoff):
+        """
+        Fold food and exercise rows dated before cutoff into the compacted
+        tables and move the raw rows to the archive (see compaction.py).
+
+        Returns rows moved per table.
+        """
+
+    @abstractmethod
+    def get_archived_logs(self, user_id, table, start, end):
+        """Return archived raw rows for a user between two dates, as dicts."""
+
+    def archive_log_month(self, table, year, month, drop=False):
+        """
+        Detach a month of food_logs or exercise_logs (see
+        partitions.detach_month_partition) and return the partition's
+        name, or None if there is none. Backends that do not partition
+        their log tables have nothing to detach.
+        """
+        return None
+
+    def check_log_partitions(self):
+        """
+        Return the names of log partitions missing for the current month
+        and the next LOG_PARTITIONS_AHEAD, without creating them. Backends
+        that do not partition their log tables have nothing to check.
+        """
+        return []
@@ -0,0 +1,279 @@
+import time
+import threading
+from itertools import chain
+from contextlib import contextmanager
+from utils.cache import TTLCache
+from utils.repository import Repository
+from utils.postgres_repository import PostgresRepository
+from utils.migrations import LATEST_VERSION
+from utils.connection_pool import get_connection_params
+from utils.sharding import (
+    SHARD_CACHE_TTL, HashRing, UserMoved, get_shard_dsns, create_directory_tables, fence_user_writes,
+    fence_shard_maintenance, copy_users, delete_moved_rows, USER_SHARD_SELECT, USER_SHARD_UPDATE, USER_SHARDS_SELECT, SHARD_USER_INSERT
+)
+from utils.queries import USER_BY_USERNAME_SELECT, USER_INSERT
+
+# Attempts for a write that keeps landing on a shard the user just left
+MOVED_RETRIES = 3
+
+
+class ShardedRepository(Repository):
+    """
+    PostgreSQL storage sharded by user_id (see sharding.py).
+
+    Users and logins live in the directory database; everything else is
+    routed to the user's shard, each with its own connection pool.
+    """
+
+    name = 'sharded'
+    latest_schema_version = LATEST_VERSION
+
+    def __init__(self, shard_dsns=None, directory_dsn=None):
+        shard_dsns = shard_dsns or get_shard_dsns()
+        self.directory = PostgresRepository(dsn=directory_dsn) if directory_dsn else PostgresRepository(
+            **get_connection_params()
+        )
+        self.shards = {name: PostgresRepository(dsn=dsn) for name, dsn in shard_dsns.items()}
+        for shard in self.shards.values():
+            shard.write_fence = fence_user_writes
+            shard.maintenance_fence = fence_shard_maintenance
+        self.ring = HashRing(self.shards)
+        self._routes = TTLCache(maxsize=100000, ttl=SHARD_CACHE_TTL)
+        self._move_lock = threading.Lock()
+
+    # Routing
+
+    def shard_of(self, user_id):
+        """Name of the shard holding a user's rows."""
+        shard = self._routes.get(user_id)
+        if shard is None:
+            row = self.directory._fetchone(USER_SHARD_SELECT, (user_id,))
+            shard = row[0] if row and row[0] in self.shards else self.ring.shard_for(user_id)
+            self._routes.set(user_id, shard)
+        return shard
+
+    def _shard(self, user_id):
+        return self.shards[self.shard_of(user_id)]
+
+    def _read(self, method, user_id, *args, **kwargs):
+        return getattr(self._shard(user_id), method)(user_id, *args, **kwargs)
+
+    def _routed_write(self, user_ids, write):
+        """Call write(shard) on the shard of user_ids, rerouting users that moved."""
+        for attempt in range(MOVED_RETRIES):
+            shards = {self.shard_of(user_id) for user_id in user_ids}
+            if len(shards) > 1:
+                raise ValueError(f"Write spans shards {sorted(shards)}")
+            try:
+                return write(self.shards[shards.pop()])
+            except UserMoved as e:
+                self._routes.set(e.user_id, e.shard)
+                if attempt == MOVED_RETRIES - 1:
+                    raise
+
+    def _write(self, method, user_id, *args):
+        return self._routed_write((user_id,), lambda shard: getattr(shard, method)(user_id, *args))
+
+    @contextmanager
+    def connection(self):
+        """A connection to the directory database."""
+        with self.directory.connection() as conn:
+            yield conn
+
+    def initialize(self):
+        with self.directory.connection() as conn:
+            with conn.cursor() as cur:
+                create_directory_tables(cur)
+            conn.commit()
+        for shard in self.shards.values():
+            shard.initialize()
+
+    def schema_version(self):
+        # The directory tables are created alongside the shards' migrations
+        return min(shard.schema_version() for shard in self.shards.values())
+
+    def enable_cache_events(self, channel):
+        return [params for shard in self.shards.values() for params in shard.enable_cache_events(channel)]
+
+    def stats(self):
+        return {
+            'directory': self.directory.stats(),
+            'shards': {name: shard.stats() for name, shard in self.shards.items()},
+            'routes': self._routes.stats()
+        }
+
+    # Users
+
+    def get_user_by_username(self, username):
+        return self.directory._fetchone(USER_BY_USERNAME_SELECT, (username,))
+
+    def create_user(self, username, password_hash):
+        with self.directory.connection() as conn, conn.cursor() as cur:
+            cur.execute(USER_INSERT, (username, password_hash))
+            row = cur.fetchone()
+            if row is None:
+                return None
+            user_id = row[0]
+            shard = self.ring.shard_for(user_id)
+            # The shard copy backs its foreign keys; a leftover from a failed
+            # directory commit is harmless
+            self.shards[shard]._write((SHARD_USER_INSERT, (user_id, username, password_hash)))
+            cur.execute(USER_SHARD_UPDATE, (shard, user_id))
+            conn.commit()
+        self._routes.set(user_id, shard)
+        return user_id
+
+    # Profiles and metrics
+
+    def get_user_profile(self, user_id):
+        return self._read('get_user_profile', user_id)
+
+    def save_user_profile(self, user_id, weight, height, age, gender, goal, activity_level):
+        return self._write('save_user_profile', user_id, weight, height, age, gender, goal, activity_level)
+
+    def get_health_metrics(self, user_id):
+        return self._read('get_health_metrics', user_id)
+
+    def save_health_metrics(self, user_id, bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target):
+        return self._write('save_health_metrics', user_id, bmi, bmr, tdee, target_calories,
+                           protein_target, fat_target, carbs_target)
+
+    def get_user_context(self, user_id):
+        # The async pool only knows the default database
+        return Repository.get_user_context(self, user_id)
+
+    # Logs
+
+    def log_food(self, user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type):
+        return self._write('log_food', user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type)
+
+    def log_foods_bulk(self, user_id, rows):
+        return self._write('log_foods_bulk', user_id, rows)
+
+    def log_exercise(self, user_id, exercise_name, duration, calories_burned):
+        return self._write('log_exercise', user_id, exercise_name, duration, calories_burned)
+
+    def log_batch(self, food_rows, exercise_rows):
+        # One transaction per shard; a batch is never split within a shard
+        by_shard = {}
+        for kind, rows in ((0, food_rows), (1, exercise_rows)):
+            for row in rows:
+                by_shard.setdefault(self.shard_of(row[0]), ([], []))[kind].append(row)
+        for food, exercise in by_shard.values():
+            user_ids = {row[0] for row in chain(food, exercise)}
+            self._routed_write(user_ids, lambda shard: shard.log_batch(food, exercise))
+        return True
+
+    def copy_log_rows(self, table, chunks, progress=None):
+        chunks = iter(chunks)
+        first = next(chunks, None)
+        if first is None:
+            return 0
+        shard = self._shard(first[0][0])
+
+        def same_shard(chunk):
+            for user_id in {row[0] for row in chunk}:
+                if self.shards[self.shard_of(user_id)] is not shard:
+                    raise ValueError("An import must stay within one shard")
+            return chunk
+
+        # Not retried on UserMoved: the chunks can only be read once
+        return shard.copy_log_rows(table, map(same_shard, chain([first], chunks)), progress=progress)
+
+    def get_daily_food_logs(self, user_id, date):
+        return self._read('get_daily_food_logs', user_id, date)
+
+    def get_daily_exercise_logs(self, user_id, date):
+        return self._read('get_daily_exercise_logs', user_id, date)
+
+    def get_daily_summary(self, user_id, date):
+        return self._read('get_daily_summary', user_id, date)
+
+    def get_day_snapshot(self, user_id, date):
+        return self._read('get_day_snapshot', user_id, date)
+
+    def rebuild_daily_rollup(self, user_id=None):
+        if user_id is not None:
+            return self._write('rebuild_daily_rollup', user_id)
+        for shard in self.shards.values():
+            shard.rebuild_daily_rollup()
+        return True
+
+    # Ranges and exports
+
+    def get_nutrition_series(self, user_id, start, end, granularity):
+        return self._read('get_nutrition_series', user_id, start, end, granularity)
+
+    def get_meal_series(self, user_id, start, end, granularity):
+        return self._read('get_meal_series', user_id, start, end, granularity)
+
+    def export_user_data(self, user_id, table, fmt, out, batch_size=5000):
+        return self._read('export_user_data', user_id, table, fmt, out, batch_size=batch_size)
+
+    def compact_logs(self, cutoff):
+        moved = {}
+        for shard in self.shards.values():
+            for table, count in shard.compact_logs(cutoff).items():
+                moved[table] = moved.get(table, 0) + count
+        return moved
+
+    def get_archived_logs(self, user_id, table, start, end):
+        return self._read('get_archived_logs', user_id, table, start, end)
+
+    def archive_log_month(self, table, year, month, drop=False):
+        return {name: shard.archive_log_month(table, year, month, drop=drop) for name, shard in self.shards.items()}
+
+    def check_log_partitions(self):
+        return [name for shard in self.shards.values() for name in shard.check_log_partitions()]
+
+    # Rebalancing
+
+    def plan_rebalance(self):
+        """Return (user_id, current shard, ring shard) for users placed off the ring."""
+        moves = []
+        for user_id, shard in self.directory._fetchall(USER_SHARDS_SELECT, None):
+            # Users without a recorded shard are already routed by the ring
+            if shard in self.shards and shard != self.ring.shard_for(user_id):
+                moves.append((user_id, shard, self.ring.shard_for(user_id)))
+        return moves
+
+    def move_users(self, user_ids, target):
+        """
+        Move users' rows to the target shard online; return rows copied per table.
+
+        Users are fenced and copied in one batch per source shard. The
+        sources are cleaned up together after a single SHARD_CACHE_TTL
+        wait, once every router has dropped its cached routes.
+        """
+        if target not in self.shards:
+            raise ValueError(f"Unknown shard {target!r}; known shards are {sorted(self.shards)}")
+        with self._move_lock:
+            by_source = {}
+            for user_id in user_ids:
+                self._routes.invalidate(user_id)
+                source = self.shard_of(user_id)
+                if source != target:
+                    by_source.setdefault(source, []).append(user_id)
+
+            copied = {}
+            moved = {}
+            try:
+                for source, moving in by_source.items():
+                    counts = copy_users(self.directory, self.shards[source], self.shards[target], target, moving)
+                    for table, count in counts.items():
+                        copied[table] = copied.get(table, 0) + count
+                    moved[source] = moving
+                    for user_id in moving:
+                        self._routes.set(user_id, target)
+            finally:
+                # Copied users already route to the target, so their source
+                # rows must go even if a later batch failed
+                if moved:
+                    time.sleep(SHARD_CACHE_TTL)
+                    for source, moving in moved.items():
+                        delete_moved_rows(self.shards[source], moving)
+            return copied
+
+    def move_user(self, user_id, target):
+        """Move one user's rows to the target shard online; return rows copied per table."""
+        return self.move_users([user_id], target)
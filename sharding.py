@@ -0,0 +1,294 @@
+"""
+User-hash sharding of the per-user tables across PostgreSQL nodes.
+
+Every table except users is keyed by user_id and no query spans users,
+so each user's rows live together on one shard. Shards are listed in
+PGSHARDS as a JSON object of {name: DSN}. New users are placed with a
+consistent-hash ring, so adding a shard only moves the users whose ring
+position now falls to it.
+
+A global directory database (PGDIRECTORY_DSN, or the usual PG* settings)
+holds the users table used for login, with each user's shard recorded in
+users.shard. Shards keep a copy of the users row for their foreign keys.
+
+Users are moved online in batches with copy_users. While their rows are
+copied, the users' writes wait on per-user advisory locks on the source
+shard. Once the copy commits, the directory points at the new shard and
+the source records tombstones in moved_users. Writers that routed with a
+stale directory entry hit a tombstone (UserMoved) and retry on the new
+shard. The source rows stay readable for SHARD_CACHE_TTL seconds so
+cached routes still see the users' data; the caller waits once per batch
+and then deletes them with delete_moved_rows.
+
+Shard-wide maintenance (full rollup rebuilds, compaction) takes the
+shard's maintenance lock with fence_shard_maintenance. A move holds it
+shared on both shards while copying, so the two never interleave.
+
+Rebalance after changing PGSHARDS with
+`python -m utils.sharding plan | rebalance | move <user_id> <shard>`.
+"""
+import os
+import sys
+import json
+import bisect
+import hashlib
+from psycopg2.extras import execute_values
+
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "128"))
+SHARD_CACHE_TTL = float(os.getenv("SHARD_CACHE_TTL", "30"))
+
+SHARD_MOVE_BATCH = int(os.getenv("SHARD_MOVE_BATCH", "100"))
+
+# First key of the per-user advisory locks fencing writes during a move
+SHARD_LOCK_NAMESPACE = 827302
+
+# Second key of the shard-wide maintenance lock; user ids start at 1
+SHARD_MAINTENANCE_KEY = 0
+
+# (table, user column) in foreign-key order; users comes first
+USER_TABLES = (
+    ('users', 'id'),
+    ('user_profiles', 'user_id'),
+    ('health_metrics', 'user_id'),
+    ('food_logs', 'user_id'),
+    ('exercise_logs', 'user_id'),
+    ('daily_rollup', 'user_id'),
+    ('food_log_compacted', 'user_id'),
+    ('exercise_log_compacted', 'user_id'),
+    ('log_archive', 'user_id')
+)
+
+MOVE_BATCH_SIZE = 5000
+
+DIRECTORY_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username VARCHAR(50) UNIQUE NOT NULL,
+        password VARCHAR(256) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS shard VARCHAR(50)"
+)
+
+MOVED_USERS_DDL = """
+CREATE TABLE IF NOT EXISTS moved_users (
+    user_id INTEGER PRIMARY KEY,
+    shard VARCHAR(50) NOT NULL,
+    moved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+USER_SHARD_SELECT = """
+SELECT shard FROM users WHERE id = %s
+"""
+
+USER_SHARD_UPDATE = """
+UPDATE users SET shard = %s WHERE id = %s
+"""
+
+USERS_SHARD_UPDATE = """
+UPDATE users SET shard = %s WHERE id = ANY(%s)
+"""
+
+USER_SHARDS_SELECT = """
+SELECT id, shard FROM users ORDER BY id
+"""
+
+SHARD_USER_INSERT = """
+INSERT INTO users (id, username, password) VALUES (%s, %s, %s)
+ON CONFLICT DO NOTHING
+"""
+
+# Waits for a move in progress, then reports users that already left
+WRITE_FENCE = """
+SELECT pg_advisory_xact_lock_shared(%(namespace)s, user_id) FROM unnest(%(user_ids)s::int[]) AS user_id;
+SELECT user_id, shard FROM moved_users WHERE user_id = ANY(%(user_ids)s)
+"""
+
+MOVED_USER_UPSERT = """
+INSERT INTO moved_users (user_id, shard) VALUES (%s, %s)
+ON CONFLICT (user_id) DO UPDATE SET shard = EXCLUDED.shard, moved_at = CURRENT_TIMESTAMP
+"""
+
+
+class UserMoved(Exception):
+    """A write reached a shard the user has been moved away from."""
+
+    def __init__(self, user_id, shard):
+        super().__init__(f"User {user_id} has moved to shard {shard}")
+        self.user_id = user_id
+        self.shard = shard
+
+
+def get_shard_dsns():
+    """Return {shard name: DSN} from PGSHARDS."""
+    shards = json.loads(os.getenv("PGSHARDS", "{}"))
+    if not isinstance(shards, dict) or not shards:
+        raise ValueError('PGSHARDS must be a JSON object of {"name": "dsn"} with at least one shard')
+    return shards
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent-hash ring with `vnodes` points per shard."""
+
+    def __init__(self, shards, vnodes=SHARD_VNODES):
+        self.shards = sorted(shards)
+        points = sorted((_hash(f"{shard}#{index}"), shard) for shard in self.shards for index in range(vnodes))
+        self._keys = [key for key, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, user_id):
+        index = bisect.bisect(self._keys, _hash(str(user_id))) % len(self._keys)
+        return self._shards[index]
+
+
+def create_directory_tables(cur):
+    for statement in DIRECTORY_DDL:
+        cur.execute(statement)
+
+
+def create_shard_tables(cur):
+    cur.execute(MOVED_USERS_DDL)
+
+
+def fence_user_writes(cur, user_ids):
+    """
+    Run first in a shard write transaction.
+
+    Holds a shared per-user lock until the transaction ends, so a move
+    cannot start underneath the write, and raises UserMoved for users no
+    longer on this shard.
+    """
+    cur.execute(WRITE_FENCE, {'namespace': SHARD_LOCK_NAMESPACE, 'user_ids': sorted(set(user_ids))})
+    moved = cur.fetchone()
+    if moved is not None:
+        raise UserMoved(*moved)
+
+
+def fence_shard_maintenance(cur):
+    """
+    Run first in a shard-wide maintenance transaction.
+
+    Waits for moves copying to or from this shard and holds new ones off
+    until the transaction ends.
+    """
+    cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (SHARD_LOCK_NAMESPACE, SHARD_MAINTENANCE_KEY))
+
+
+def _copy_table(source_conn, target_cur, table, column, user_ids):
+    """Copy one table's rows for some users; surrogate ids are reassigned by the target."""
+    copied = 0
+    with source_conn.cursor(name=f"move_{table}") as cur:
+        cur.itersize = MOVE_BATCH_SIZE
+        cur.execute(f"SELECT * FROM {table} WHERE {column} = ANY(%s)", (user_ids,))
+        while True:
+            rows = cur.fetchmany(MOVE_BATCH_SIZE)
+            if not rows:
+                break
+            columns = [description[0] for description in cur.description]
+            keep = [index for index, name in enumerate(columns) if table == 'users' or name != 'id']
+            conflict = " ON CONFLICT DO NOTHING" if table == 'users' else ""
+            execute_values(
+                target_cur,
+                f"INSERT INTO {table} ({', '.join(columns[index] for index in keep)}) VALUES %s{conflict}",
+                [tuple(row[index] for index in keep) for row in rows],
+                page_size=1000
+            )
+            copied += len(rows)
+    return copied
+
+
+def delete_user_rows(cur, user_ids):
+    """Delete users' rows from every per-user table except users."""
+    for table, column in reversed(USER_TABLES[1:]):
+        cur.execute(f"DELETE FROM {table} WHERE {column} = ANY(%s)", (user_ids,))
+
+
+def copy_users(directory, source, target, target_name, user_ids):
+    """
+    Copy a batch of users from the source shard to the target shard online
+    and switch the directory to the target.
+
+    directory, source and target are PostgresRepository instances. Writes
+    for the users wait while the rows are copied; reads keep being served
+    from the source. Their rows are left there, frozen by tombstones, for
+    delete_moved_rows once the switch has reached every router.
+
+    Returns:
+    dict: Rows copied per table
+    """
+    user_ids = sorted(set(user_ids))
+    copied = {}
+    with source.connection() as source_conn:
+        with source_conn.cursor() as cur:
+            cur.execute(
+                "SELECT pg_advisory_xact_lock_shared(%s, %s)", (SHARD_LOCK_NAMESPACE, SHARD_MAINTENANCE_KEY)
+            )
+            # Waits for in-flight writes, then holds new ones off until commit
+            cur.execute(
+                "SELECT pg_advisory_xact_lock(%s, user_id) FROM unnest(%s::int[]) AS user_id",
+                (SHARD_LOCK_NAMESPACE, user_ids)
+            )
+
+        # Clearing the target first makes a retried move start from scratch
+        with target.connection() as target_conn, target_conn.cursor() as target_cur:
+            target_cur.execute(
+                "SELECT pg_advisory_xact_lock_shared(%s, %s)", (SHARD_LOCK_NAMESPACE, SHARD_MAINTENANCE_KEY)
+            )
+            delete_user_rows(target_cur, user_ids)
+            target_cur.execute("DELETE FROM moved_users WHERE user_id = ANY(%s)", (user_ids,))
+            for table, column in USER_TABLES:
+                copied[table] = _copy_table(source_conn, target_cur, table, column, user_ids)
+            target_conn.commit()
+
+        with directory.connection() as directory_conn, directory_conn.cursor() as cur:
+            cur.execute(USERS_SHARD_UPDATE, (target_name, user_ids))
+            directory_conn.commit()
+
+        with source_conn.cursor() as cur:
+            cur.executemany(MOVED_USER_UPSERT, [(user_id, target_name) for user_id in user_ids])
+        source_conn.commit()
+    return copied
+
+
+def delete_moved_rows(source, user_ids):
+    """Delete moved users' frozen rows from their old shard."""
+    with source.connection() as source_conn, source_conn.cursor() as cur:
+        delete_user_rows(cur, sorted(set(user_ids)))
+        source_conn.commit()
+
+
+if __name__ == '__main__':
+    from utils.database import get_repository
+
+    repository = get_repository()
+    if repository.name != 'sharded':
+        sys.exit("Set DB_BACKEND=sharded to manage shards")
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'plan'
+    if command == 'move' and len(sys.argv) == 4:
+        moves = [(int(sys.argv[2]), repository.shard_of(int(sys.argv[2])), sys.argv[3])]
+    elif command in ('plan', 'rebalance'):
+        moves = repository.plan_rebalance()
+    else:
+        sys.exit("Usage: python -m utils.sharding plan | rebalance | move <user_id> <shard>")
+
+    if command == 'plan':
+        for user_id, current, target in moves:
+            print(f"user {user_id}: {current} -> {target}")
+    else:
+        by_target = {}
+        for user_id, current, target in moves:
+            by_target.setdefault(target, []).append(user_id)
+        for target, user_ids in by_target.items():
+            for start in range(0, len(user_ids), SHARD_MOVE_BATCH):
+                batch = user_ids[start:start + SHARD_MOVE_BATCH]
+                copied = repository.move_users(batch, target)
+                print(f"Moved {len(batch)} user(s) to {target}: {sum(copied.values())} rows")
+    print(f"{len(moves)} user(s) {'to move' if command == 'plan' else 'moved'}")
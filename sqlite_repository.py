@@ -0,0 +1,612 @@
+"""
+Embedded SQLite storage for single-node deployments and test machines.
+
+The database runs in WAL mode so readers never block the writer, and each
+thread keeps its own connection (sqlite3 connections must not be shared
+across threads). Schema, indexes and unique constraints mirror the
+Postgres migrations; partitioning has no SQLite equivalent.
+"""
+import os
+import sqlite3
+import threading
+import itertools
+import pandas as pd
+from datetime import date, datetime
+from contextlib import contextmanager
+from time import perf_counter
+from utils import query_stats
+from utils.repository import Repository
+from utils.bulk_import import table_columns
+from utils.compaction import UNSPECIFIED_MEAL, ARCHIVE_COLUMNS, archive_entries, unpack_rows
+from utils.export import EXPORT_TABLES, ARCHIVE_EXPORT_QUERY, archived_batches, write_batches
+from utils.queries import (
+    daily_rollup_params, food_rows_rollup_params, log_batch_rollup_rows, accumulate_rollup, rollup_rows,
+    profile_from_row, metrics_from_row, food_log_from_row, exercise_log_from_row,
+    summary_from_row, snapshot_from_row,
+    NUTRITION_SERIES_COLUMNS, MEAL_SERIES_COLUMNS
+)
+
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    description VARCHAR(200),
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username VARCHAR(50) UNIQUE NOT NULL,
+    password VARCHAR(256) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS user_profiles (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER UNIQUE REFERENCES users(id),
+    weight FLOAT,
+    height FLOAT,
+    age INTEGER,
+    gender VARCHAR(10),
+    goal VARCHAR(20),
+    activity_level VARCHAR(20),
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS health_metrics (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER UNIQUE REFERENCES users(id),
+    bmi FLOAT,
+    bmr FLOAT,
+    tdee FLOAT,
+    target_calories FLOAT,
+    protein_target FLOAT,
+    fat_target FLOAT,
+    carbs_target FLOAT,
+    calculated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS food_logs (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id),
+    food_name VARCHAR(100),
+    calories FLOAT,
+    protein FLOAT,
+    fat FLOAT,
+    carbs FLOAT,
+    portion_size VARCHAR(50),
+    meal_type VARCHAR(20),
+    consumed_at DATE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS exercise_logs (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id),
+    exercise_name VARCHAR(100),
+    duration INTEGER,
+    calories_burned FLOAT,
+    performed_at DATE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS daily_rollup (
+    user_id INTEGER REFERENCES users(id),
+    day DATE,
+    calories FLOAT NOT NULL DEFAULT 0,
+    protein FLOAT NOT NULL DEFAULT 0,
+    fat FLOAT NOT NULL DEFAULT 0,
+    carbs FLOAT NOT NULL DEFAULT 0,
+    food_count INTEGER NOT NULL DEFAULT 0,
+    calories_burned FLOAT NOT NULL DEFAULT 0,
+    exercise_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS food_log_compacted (
+    user_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    meal_type VARCHAR(20) NOT NULL,
+    calories FLOAT NOT NULL DEFAULT 0,
+    protein FLOAT NOT NULL DEFAULT 0,
+    fat FLOAT NOT NULL DEFAULT 0,
+    carbs FLOAT NOT NULL DEFAULT 0,
+    items INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day, meal_type)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS exercise_log_compacted (
+    user_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    duration INTEGER NOT NULL DEFAULT 0,
+    calories_burned FLOAT NOT NULL DEFAULT 0,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS log_archive (
+    id INTEGER PRIMARY KEY,
+    source VARCHAR(20) NOT NULL,
+    user_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    row_count INTEGER NOT NULL,
+    rows BLOB NOT NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS log_archive_source_user_day_idx ON log_archive (source, user_id, day);
+
+-- SQLite has no INCLUDE clause, so the summed columns are part of the key
+CREATE INDEX IF NOT EXISTS food_logs_user_consumed_idx
+    ON food_logs (user_id, consumed_at, calories, protein, fat, carbs, meal_type);
+CREATE INDEX IF NOT EXISTS exercise_logs_user_performed_idx
+    ON exercise_logs (user_id, performed_at, calories_burned, duration);
+"""
+
+DAILY_ROLLUP_ADD = """
+INSERT INTO daily_rollup
+(user_id, day, calories, protein, fat, carbs, food_count, calories_burned, exercise_count)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_id, day) DO UPDATE
+SET calories = calories + excluded.calories,
+    protein = protein + excluded.protein,
+    fat = fat + excluded.fat,
+    carbs = carbs + excluded.carbs,
+    food_count = food_count + excluded.food_count,
+    calories_burned = calories_burned + excluded.calories_burned,
+    exercise_count = exercise_count + excluded.exercise_count
+"""
+
+# Period start expressions matching Postgres date_trunc (weeks start on Monday)
+PERIOD_EXPRESSIONS = {
+    'day': "date({column})",
+    'week': "date({column}, '-6 days', 'weekday 1')",
+    'month': "date({column}, 'start of month')"
+}
+
+PANDAS_FREQUENCIES = {'day': 'D', 'week': 'W-MON', 'month': 'MS'}
+
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(sep=' '))
+sqlite3.register_converter("DATE", lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+
+
+def _rollup_params(day, params):
+    """Insert the day into daily_rollup_params() output after user_id."""
+    return (params[0], day) + tuple(params[1:])
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """sqlite3 cursor that reports each statement and fetch to query_stats."""
+
+    _record = None
+
+    def execute(self, sql, parameters=()):
+        start = perf_counter()
+        super().execute(sql, parameters)
+        elapsed = perf_counter() - start
+
+        explain = None
+        if query_stats.is_explainable(sql):
+            explain = lambda: self._explain(sql, parameters)
+        rows = self.rowcount if self.description is None and self.rowcount > 0 else 0
+        self._record = query_stats.record_execute(sql, elapsed, rows=rows, explain=explain)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        start = perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._record = query_stats.record_execute(sql, perf_counter() - start, rows=max(self.rowcount, 0))
+        return self
+
+    def _explain(self, sql, parameters):
+        plan = sqlite3.Cursor(self.connection).execute("EXPLAIN QUERY PLAN " + sql, parameters)
+        return "\n".join(row[3] for row in plan.fetchall())
+
+    def fetchone(self):
+        start = perf_counter()
+        row = super().fetchone()
+        query_stats.record_fetch(self._record, perf_counter() - start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        start = perf_counter()
+        rows = super().fetchmany() if size is None else super().fetchmany(size)
+        query_stats.record_fetch(self._record, perf_counter() - start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = perf_counter()
+        rows = super().fetchall()
+        query_stats.record_fetch(self._record, perf_counter() - start, len(rows))
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Routes the execute shortcuts through InstrumentedCursor."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class SqliteRepository(Repository):
+    """SQLite storage in WAL mode with one connection per thread."""
+
+    name = 'sqlite'
+    latest_schema_version = SCHEMA_VERSION
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("SQLITE_PATH", "kcaptrack.db")
+        self._local = threading.local()
+        self._connections = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES, timeout=10,
+                               factory=InstrumentedConnection)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        with self._lock:
+            self._connections += 1
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Yield this thread's connection inside a transaction."""
+        start = perf_counter()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        query_stats.record_connect(perf_counter() - start)
+        with conn:
+            yield conn
+
+    def stats(self):
+        with self._lock:
+            return {'backend': self.name, 'path': self.path, 'connections': self._connections}
+
+    def initialize(self):
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+            conn.execute(
+                "INSERT OR IGNORE INTO schema_version (version, description) VALUES (?, ?)",
+                (SCHEMA_VERSION, "SQLite schema")
+            )
+
+    def schema_version(self):
+        try:
+            row = self._fetchone("SELECT MAX(version) FROM schema_version", ())
+        except sqlite3.OperationalError:
+            return 0
+        return row[0] or 0
+
+    def _fetchone(self, query, params):
+        with self.connection() as conn:
+            return conn.execute(query, params).fetchone()
+
+    def _fetchall(self, query, params):
+        with self.connection() as conn:
+            return conn.execute(query, params).fetchall()
+
+    def get_user_by_username(self, username):
+        return self._fetchone("SELECT id, username, password FROM users WHERE username = ?", (username,))
+
+    def create_user(self, username, password_hash):
+        with self.connection() as conn:
+            cur = conn.execute(
+                "INSERT INTO users (username, password) VALUES (?, ?) ON CONFLICT (username) DO NOTHING",
+                (username, password_hash)
+            )
+            return cur.lastrowid if cur.rowcount else None
+
+    def get_user_profile(self, user_id):
+        return profile_from_row(self._fetchone("""
+        SELECT weight, height, age, gender, goal, activity_level
+        FROM user_profiles
+        WHERE user_id = ?
+        """, (user_id,)))
+
+    def save_user_profile(self, user_id, weight, height, age, gender, goal, activity_level):
+        with self.connection() as conn:
+            return profile_from_row(conn.execute("""
+            INSERT INTO user_profiles (user_id, weight, height, age, gender, goal, activity_level)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE
+            SET weight = excluded.weight, height = excluded.height, age = excluded.age,
+                gender = excluded.gender, goal = excluded.goal,
+                activity_level = excluded.activity_level, updated_at = CURRENT_TIMESTAMP
+            RETURNING weight, height, age, gender, goal, activity_level
+            """, (user_id, weight, height, age, gender, goal, activity_level)).fetchall()[0])
+
+    def get_health_metrics(self, user_id):
+        return metrics_from_row(self._fetchone("""
+        SELECT bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target
+        FROM health_metrics
+        WHERE user_id = ?
+        """, (user_id,)))
+
+    def save_health_metrics(self, user_id, bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target):
+        with self.connection() as conn:
+            return metrics_from_row(conn.execute("""
+            INSERT INTO health_metrics
+            (user_id, bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE
+            SET bmi = excluded.bmi, bmr = excluded.bmr, tdee = excluded.tdee,
+                target_calories = excluded.target_calories,
+                protein_target = excluded.protein_target, fat_target = excluded.fat_target,
+                carbs_target = excluded.carbs_target, calculated_at = CURRENT_TIMESTAMP
+            RETURNING bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target
+            """, (user_id, bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target)).fetchall()[0])
+
+    def log_food(self, user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type):
+        return self.log_foods_bulk(
+            user_id, [(user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type)]
+        )
+
+    def log_foods_bulk(self, user_id, rows):
+        # Dates are taken in local time; SQLite's CURRENT_DATE is UTC
+        today = date.today()
+        with self.connection() as conn:
+            conn.executemany("""
+            INSERT INTO food_logs
+            (user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type, consumed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [tuple(row) + (today,) for row in rows])
+            conn.execute(DAILY_ROLLUP_ADD, _rollup_params(today, food_rows_rollup_params(user_id, rows)))
+        return True
+
+    def log_exercise(self, user_id, exercise_name, duration, calories_burned):
+        today = date.today()
+        with self.connection() as conn:
+            conn.execute("""
+            INSERT INTO exercise_logs (user_id, exercise_name, duration, calories_burned, performed_at)
+            VALUES (?, ?, ?, ?, ?)
+            """, (user_id, exercise_name, duration, calories_burned, today))
+            conn.execute(DAILY_ROLLUP_ADD, _rollup_params(today, daily_rollup_params(
+                user_id, calories_burned=calories_burned, exercise_count=1
+            )))
+        return True
+
+    def log_batch(self, food_rows, exercise_rows):
+        with self.connection() as conn:
+            conn.executemany("""
+            INSERT INTO food_logs
+            (user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type, consumed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, food_rows)
+            conn.executemany("""
+            INSERT INTO exercise_logs (user_id, exercise_name, duration, calories_burned, performed_at)
+            VALUES (?, ?, ?, ?, ?)
+            """, exercise_rows)
+            conn.executemany(DAILY_ROLLUP_ADD, log_batch_rollup_rows(food_rows, exercise_rows))
+        return True
+
+    def copy_log_rows(self, table, chunks, progress=None):
+        columns = table_columns(table)
+        insert_sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        totals = {}
+        loaded = 0
+        with self.connection() as conn:
+            for chunk in chunks:
+                conn.executemany(insert_sql, chunk)
+                if table == 'food_logs':
+                    accumulate_rollup(totals, food_rows=chunk)
+                else:
+                    accumulate_rollup(totals, exercise_rows=chunk)
+                loaded += len(chunk)
+                if progress is not None:
+                    progress(loaded)
+            conn.executemany(DAILY_ROLLUP_ADD, rollup_rows(totals))
+        return loaded
+
+    def _food_rows(self, user_id, day):
+        # Compacted days have one aggregate row per meal instead of the raw rows
+        return self._fetchall("""
+        SELECT food_name, calories, protein, fat, carbs, portion_size, meal_type
+        FROM (
+            SELECT id, food_name, calories, protein, fat, carbs, portion_size, meal_type
+            FROM food_logs
+            WHERE user_id = :user_id AND consumed_at = :day
+            UNION ALL
+            SELECT NULL, items || ' items (compacted)', calories, protein, fat, carbs, NULL, meal_type
+            FROM food_log_compacted
+            WHERE user_id = :user_id AND day = :day
+        )
+        ORDER BY id DESC NULLS LAST
+        """, {'user_id': user_id, 'day': day})
+
+    def _exercise_rows(self, user_id, day):
+        return self._fetchall("""
+        SELECT exercise_name, duration, calories_burned
+        FROM (
+            SELECT id, exercise_name, duration, calories_burned
+            FROM exercise_logs
+            WHERE user_id = :user_id AND performed_at = :day
+            UNION ALL
+            SELECT NULL, sessions || ' sessions (compacted)', duration, calories_burned
+            FROM exercise_log_compacted
+            WHERE user_id = :user_id AND day = :day
+        )
+        ORDER BY id DESC NULLS LAST
+        """, {'user_id': user_id, 'day': day})
+
+    def get_daily_food_logs(self, user_id, date):
+        return [food_log_from_row(log) for log in self._food_rows(user_id, date)]
+
+    def get_daily_exercise_logs(self, user_id, date):
+        return [exercise_log_from_row(log) for log in self._exercise_rows(user_id, date)]
+
+    def get_daily_summary(self, user_id, date):
+        return summary_from_row(self._fetchone("""
+        SELECT calories, protein, fat, carbs, calories_burned
+        FROM daily_rollup
+        WHERE user_id = ? AND day = ?
+        """, (user_id, date)))
+
+    def get_day_snapshot(self, user_id, date):
+        # In-process reads are cheap enough that three queries beat JSON aggregation
+        metrics = self._fetchone("""
+        SELECT bmi, bmr, tdee, target_calories, protein_target, fat_target, carbs_target
+        FROM health_metrics
+        WHERE user_id = ?
+        """, (user_id,))
+        return snapshot_from_row((self._food_rows(user_id, date), self._exercise_rows(user_id, date), metrics))
+
+    def rebuild_daily_rollup(self, user_id=None):
+        user_filter = "" if user_id is None else "WHERE user_id = :user_id"
+        with self.connection() as conn:
+            conn.execute(f"DELETE FROM daily_rollup {user_filter}", {'user_id': user_id})
+            # SQLite has no FULL OUTER JOIN before 3.39, so union the two sides
+            conn.execute(f"""
+            INSERT INTO daily_rollup
+            (user_id, day, calories, protein, fat, carbs, food_count, calories_burned, exercise_count)
+            SELECT user_id, day, SUM(calories), SUM(protein), SUM(fat), SUM(carbs),
+                   SUM(food_count), SUM(calories_burned), SUM(exercise_count)
+            FROM (
+                SELECT user_id, consumed_at AS day, calories, protein, fat, carbs,
+                       1 AS food_count, 0 AS calories_burned, 0 AS exercise_count
+                FROM food_logs {user_filter}
+                UNION ALL
+                SELECT user_id, day, calories, protein, fat, carbs, items, 0, 0
+                FROM food_log_compacted {user_filter}
+                UNION ALL
+                SELECT user_id, performed_at AS day, 0, 0, 0, 0, 0, calories_burned, 1
+                FROM exercise_logs {user_filter}
+                UNION ALL
+                SELECT user_id, day, 0, 0, 0, 0, 0, calories_burned, sessions
+                FROM exercise_log_compacted {user_filter}
+            )
+            WHERE user_id IS NOT NULL
+            GROUP BY user_id, day
+            """, {'user_id': user_id})
+        return True
+
+    def _read_frame(self, query, params, columns):
+        with self.connection() as conn:
+            cur = conn.execute(query, params)
+            return pd.DataFrame.from_records(cur.fetchall(), columns=columns)
+
+    def get_nutrition_series(self, user_id, start, end, granularity):
+        period = PERIOD_EXPRESSIONS[granularity].format(column='day')
+        totals = self._read_frame(f"""
+        SELECT {period} AS period,
+               SUM(calories), SUM(protein), SUM(fat), SUM(carbs),
+               SUM(calories_burned), SUM(food_count), SUM(exercise_count)
+        FROM daily_rollup
+        WHERE user_id = ? AND day BETWEEN ? AND ?
+        GROUP BY 1
+        """, (user_id, start, end), NUTRITION_SERIES_COLUMNS)
+
+        # Zero-fill every period in the range, as the Postgres generate_series does
+        first = pd.Timestamp(start).to_period(PANDAS_FREQUENCIES[granularity][0]).start_time
+        periods = pd.date_range(first, pd.Timestamp(end), freq=PANDAS_FREQUENCIES[granularity]).date
+        totals['period'] = pd.to_datetime(totals['period']).dt.date
+        frame = pd.DataFrame({'period': periods}).merge(totals, on='period', how='left')
+        return frame.fillna(0)[NUTRITION_SERIES_COLUMNS]
+
+    def get_meal_series(self, user_id, start, end, granularity):
+        period = PERIOD_EXPRESSIONS[granularity].format(column='day')
+        frame = self._read_frame(f"""
+        SELECT {period} AS period, meal_type,
+               SUM(calories), SUM(protein), SUM(fat), SUM(carbs), SUM(items)
+        FROM (
+            SELECT consumed_at AS day, meal_type, calories, protein, fat, carbs, 1 AS items
+            FROM food_logs
+            WHERE user_id = :user_id AND consumed_at BETWEEN :start AND :end
+            UNION ALL
+            SELECT day, meal_type, calories, protein, fat, carbs, items
+            FROM food_log_compacted
+            WHERE user_id = :user_id AND day BETWEEN :start AND :end
+        )
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        """, {'user_id': user_id, 'start': start, 'end': end}, MEAL_SERIES_COLUMNS)
+        frame['period'] = pd.to_datetime(frame['period']).dt.date
+        return frame
+
+    def _archive(self, conn, table, rows):
+        """Write (id, user_id, ..., day) rows to log_archive, one entry per user and day."""
+        for (user_id, day), group in itertools.groupby(rows, key=lambda row: (row[1], row[-1])):
+            conn.executemany(
+                "INSERT INTO log_archive (source, user_id, day, row_count, rows) VALUES (?, ?, ?, ?, ?)",
+                archive_entries(table, [(user_id, day, [(row[0],) + tuple(row[2:-1]) for row in group])])
+            )
+
+    def compact_logs(self, cutoff):
+        # One write transaction; SQLite's single writer keeps the totals exact
+        with self.connection() as conn:
+            conn.execute("""
+            INSERT INTO food_log_compacted (user_id, day, meal_type, calories, protein, fat, carbs, items)
+            SELECT user_id, consumed_at, COALESCE(meal_type, ?),
+                   COALESCE(SUM(calories), 0), COALESCE(SUM(protein), 0),
+                   COALESCE(SUM(fat), 0), COALESCE(SUM(carbs), 0), COUNT(*)
+            FROM food_logs
+            WHERE consumed_at < ?
+            GROUP BY 1, 2, 3
+            ON CONFLICT (user_id, day, meal_type) DO UPDATE
+            SET calories = calories + excluded.calories,
+                protein = protein + excluded.protein,
+                fat = fat + excluded.fat,
+                carbs = carbs + excluded.carbs,
+                items = items + excluded.items
+            """, (UNSPECIFIED_MEAL, cutoff))
+            conn.execute("""
+            INSERT INTO exercise_log_compacted (user_id, day, duration, calories_burned, sessions)
+            SELECT user_id, performed_at, COALESCE(SUM(duration), 0), COALESCE(SUM(calories_burned), 0), COUNT(*)
+            FROM exercise_logs
+            WHERE performed_at < ?
+            GROUP BY 1, 2
+            ON CONFLICT (user_id, day) DO UPDATE
+            SET duration = duration + excluded.duration,
+                calories_burned = calories_burned + excluded.calories_burned,
+                sessions = sessions + excluded.sessions
+            """, (cutoff,))
+
+            self._archive(conn, 'food_logs', conn.execute("""
+            SELECT id, user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type, consumed_at
+            FROM food_logs WHERE consumed_at < ? ORDER BY user_id, consumed_at, id
+            """, (cutoff,)))
+            self._archive(conn, 'exercise_logs', conn.execute("""
+            SELECT id, user_id, exercise_name, duration, calories_burned, performed_at
+            FROM exercise_logs WHERE performed_at < ? ORDER BY user_id, performed_at, id
+            """, (cutoff,)))
+
+            return {
+                'food_logs': conn.execute("DELETE FROM food_logs WHERE consumed_at < ?", (cutoff,)).rowcount,
+                'exercise_logs': conn.execute("DELETE FROM exercise_logs WHERE performed_at < ?", (cutoff,)).rowcount
+            }
+
+    def get_archived_logs(self, user_id, table, start, end):
+        rows = self._fetchall("""
+        SELECT day, rows FROM log_archive
+        WHERE source = ? AND user_id = ? AND day BETWEEN ? AND ?
+        ORDER BY day, id
+        """, (table, user_id, start, end))
+        return [dict(row, day=day) for day, blob in rows for row in unpack_rows(table, blob)]
+
+    def export_user_data(self, user_id, table, fmt, out, batch_size=5000):
+        if table not in EXPORT_TABLES:
+            raise ValueError(f"Unknown export table {table!r}")
+
+        def fetch(conn, query, params):
+            cur = conn.execute(query.replace('%s', '?'), params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+        def batches():
+            with self.connection() as conn:
+                if table in ARCHIVE_COLUMNS:
+                    yield from archived_batches(fetch(conn, ARCHIVE_EXPORT_QUERY, (table, user_id)), table)
+                yield from fetch(conn, EXPORT_TABLES[table]['query'], (user_id,))
+
+        return write_batches(batches(), table, fmt, out)
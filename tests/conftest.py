@@ -0,0 +1,10 @@
+import os
+import sys
+import types
+
+# The app imports this repository as the `utils` package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if 'utils' not in sys.modules:
+    utils = types.ModuleType('utils')
+    utils.__path__ = [ROOT]
+    sys.modules['utils'] = utils
@@ -0,0 +1,73 @@
+import io
+import os
+from datetime import date, timedelta
+import pytest
+import requests
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.testing.v1 import AppTest
+from tests.conftest import ROOT
+
+
+@pytest.fixture
+def user_id(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_BACKEND", "sqlite")
+    monkeypatch.setenv("SQLITE_PATH", str(tmp_path / "kcaptrack.db"))
+    from utils import database
+    monkeypatch.setattr(database, '_repository', None)
+    database.get_repository().initialize()
+    user_id = database.get_repository().create_user('alice', 'hash')
+    database.log_food(user_id, 'Rice', 200, 4, 1, 44, '1 cup', 'Lunch')
+    database.log_food(user_id, 'Chicken', 250, 30, 10, 0, '150 g', 'Dinner')
+    return user_id
+
+
+def test_prepare_export_downloads_file(user_id, monkeypatch):
+    # No network for the page's animations
+    monkeypatch.setattr(requests, 'get', lambda *args, **kwargs: (_ for _ in ()).throw(requests.ConnectionError()))
+    deferred = {}
+    add_deferred = MediaFileManager.add_deferred
+
+    def capture(self, data_callable, *args, **kwargs):
+        file_id = add_deferred(self, data_callable, *args, **kwargs)
+        deferred[file_id] = data_callable
+        return file_id
+
+    monkeypatch.setattr(MediaFileManager, 'add_deferred', capture)
+
+    at = AppTest.from_file(os.path.join(ROOT, '1_User_Profile.py'), default_timeout=30)
+    at.session_state['authenticated'] = True
+    at.session_state['user_id'] = user_id
+    at.session_state['username'] = 'alice'
+    at.run()
+    next(button for button in at.button if button.label == "Prepare Export").click().run()
+
+    assert not at.exception
+    assert not at.error
+    download = at.get('download_button')[0].proto
+    assert download.label == "Download 2 rows"
+    export = at.session_state['export']
+    assert os.path.exists(export['path'])
+
+    # The file is read only when the download is requested
+    data = deferred[download.deferred_file_id]()
+    lines = data.decode().splitlines()
+    assert len(lines) == 3
+    assert any('Rice' in line for line in lines)
+
+    # A new export replaces the previous file
+    next(button for button in at.button if button.label == "Prepare Export").click().run()
+    assert not os.path.exists(export['path'])
+    os.unlink(at.session_state['export']['path'])
+
+
+def test_export_includes_compacted_history(user_id):
+    from utils import database
+    database.get_repository().compact_logs(date.today() + timedelta(days=1))
+    assert database.get_daily_food_logs(user_id)[0]['food_name'] != 'Rice'
+
+    out = io.BytesIO()
+    assert database.export_user_data(user_id, 'food_logs', 'csv', out) == 2
+    lines = out.getvalue().decode('utf-8').splitlines()
+    assert lines[0].startswith('id,food_name')
+    assert {line.split(',')[1] for line in lines[1:]} == {'Rice', 'Chicken'}
+    assert all(line.endswith(date.today().isoformat()) for line in lines[1:])
@@ -0,0 +1,31 @@
+import pytest
+
+from utils.enums import Gender, Goal
+from utils.health_calculations import (
+    calculate_bmr, calculate_tdee, calculate_target_calories, calculate_macronutrients
+)
+
+
+@pytest.mark.parametrize('gender', [Gender.MALE, 'Male', 'male', ' MALE '])
+def test_bmr_parses_gender_spellings(gender):
+    assert calculate_bmr(80, 180, 30, gender) == 1780
+
+
+def test_bmr_rejects_unknown_gender():
+    with pytest.raises(ValueError):
+        calculate_bmr(80, 180, 30, 'unknown')
+
+
+@pytest.mark.parametrize('missing', [None, ''])
+def test_missing_gender_and_goal_are_rejected(missing):
+    with pytest.raises(ValueError):
+        calculate_bmr(80, 180, 30, missing)
+    with pytest.raises(ValueError):
+        calculate_target_calories(2000, missing)
+
+
+def test_goal_and_activity_level_are_parsed():
+    assert calculate_tdee(1000, 'Very Active') == 1725
+    assert calculate_tdee(1000, 'something else') == 1200
+    assert calculate_target_calories(2000, 'cutting') == calculate_target_calories(2000, Goal.CUTTING) == 1600
+    assert calculate_macronutrients(2000, 'bulking') == calculate_macronutrients(2000, Goal.BULKING)
@@ -0,0 +1,107 @@
+import json
+import sqlite3
+from datetime import date
+
+import pytest
+
+from utils.write_behind import WriteBehindBuffer
+
+
+class FakeRepository:
+    """Records committed rows; food named 'poison' is rejected like a constraint violation."""
+
+    def __init__(self):
+        self.food_rows = []
+        self.down = False
+
+    def log_batch(self, food_rows, exercise_rows):
+        if self.down:
+            raise sqlite3.OperationalError("database is locked")
+        if any(row[1] == 'poison' for row in food_rows):
+            raise sqlite3.IntegrityError("CHECK constraint failed")
+        self.food_rows.extend(food_rows)
+        return True
+
+
+def food(user_id, name):
+    return (user_id, name, 100, 1, 1, 1, 'medium', 'lunch')
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return str(tmp_path / 'write_behind.journal')
+
+
+def test_poison_row_is_dead_lettered(journal):
+    repository = FakeRepository()
+    buffer = WriteBehindBuffer(repository, journal, interval=3600)
+    try:
+        buffer.add_foods([food(1, 'rice'), food(1, 'poison'), food(2, 'beans')])
+        assert buffer.flush() == 3
+        assert [row[1] for row in repository.food_rows] == ['rice', 'beans']
+        assert buffer.stats()['pending'] == 0
+        assert buffer.stats()['dead_lettered'] == 1
+        with open(journal + '.dead', encoding='utf-8') as dead:
+            kind, row, error = json.loads(dead.readline())
+        assert (kind, row[1]) == ('food', 'poison')
+        assert 'CHECK' in error
+    finally:
+        buffer.close()
+
+
+def test_rows_stay_queued_while_the_database_is_down(journal):
+    repository = FakeRepository()
+    buffer = WriteBehindBuffer(repository, journal, interval=3600)
+    try:
+        buffer.add_foods([food(1, 'rice'), food(1, 'beans')])
+        repository.down = True
+        with pytest.raises(sqlite3.OperationalError):
+            buffer.flush()
+        assert buffer.stats()['pending'] == 2
+        assert buffer.stats()['dead_lettered'] == 0
+        repository.down = False
+        assert buffer.flush() == 2
+    finally:
+        buffer.close()
+
+
+def test_each_process_gets_its_own_journal_and_adopts_orphans(journal):
+    first = WriteBehindBuffer(FakeRepository(), journal, interval=3600)
+    second = WriteBehindBuffer(FakeRepository(), journal, interval=3600)
+    try:
+        assert first.journal_path == journal
+        assert second.journal_path == journal + '.1'
+        second.add_foods([food(3, 'oats')])
+    finally:
+        first.close()
+    # The second buffer dies without flushing; its lock goes with it
+    second._stopped.set()
+    second._journal_lock.close()
+
+    repository = FakeRepository()
+    adopter = WriteBehindBuffer(repository, journal, interval=3600)
+    try:
+        assert adopter.pending_rows('food', 3, date.today())
+        assert adopter.flush() == 1
+        assert repository.food_rows[0][1] == 'oats'
+    finally:
+        adopter.close()
+
+
+def test_failed_journal_rewrite_keeps_the_journal_usable(journal, monkeypatch):
+    buffer = WriteBehindBuffer(FakeRepository(), journal, interval=3600)
+    try:
+        buffer.add_foods([food(1, 'rice')])
+
+        def fail(*args):
+            raise OSError("disk full")
+
+        with monkeypatch.context() as patch:
+            patch.setattr('utils.write_behind.os.replace', fail)
+            with pytest.raises(OSError):
+                with buffer._lock:
+                    buffer._rewrite_journal()
+        buffer.add_foods([food(1, 'beans')])
+        assert buffer.flush() == 2
+    finally:
+        buffer.close()
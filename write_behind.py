@@ -0,0 +1,402 @@
+"""
+Write-behind buffering for food and exercise logs.
+
+When enabled (WRITE_BEHIND=1), log writes are appended to a local journal
+file and an in-memory queue, then return at once. A background thread
+writes the queue to the database in multi-row transactions every
+WRITE_BEHIND_INTERVAL_MS, or sooner once WRITE_BEHIND_MAX_ROWS rows are
+waiting. Reads in database.py merge the user's queued rows so entries
+show up before they are flushed; they hold the buffer's read gate while
+they do, so a batch is never counted both in the database and in the
+queue.
+
+Each process holds an fcntl lock on its own journal slot (the configured
+path, then path.1, path.2, ...). The journal is replayed when the buffer
+starts, along with any slot left behind by a process that has since
+died. A crash after a batch commits but before the journal is rewritten
+replays that batch, so rows are written at least once.
+
+When a batch fails its rows are retried one at a time. A row rejected
+for its content is moved to the dead-letter file (path.dead) with the
+error, so it cannot hold up the queue; on any other error the rows stay
+queued for the next flush.
+"""
+import os
+import re
+import glob
+import json
+import fcntl
+import sqlite3
+import logging
+import threading
+import itertools
+import psycopg2
+from contextlib import ExitStack, contextmanager
+from datetime import date, timedelta
+from utils.queries import food_log_from_row, exercise_log_from_row
+
+logger = logging.getLogger(__name__)
+
+# Errors caused by a row's content; writing it again can never succeed
+BAD_ROW_ERRORS = (
+    ValueError, TypeError,
+    sqlite3.DataError, sqlite3.IntegrityError,
+    psycopg2.DataError, psycopg2.IntegrityError
+)
+
+
+def period_start(day, granularity):
+    """First day of the day, week (Monday) or month containing `day`."""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _lock_slot(path):
+    """Take the lock of one journal slot; return the lock file, or None if another process holds it."""
+    with ExitStack() as stack:
+        lock = stack.enter_context(open(path + '.lock', 'a'))
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        # Held until the buffer closes
+        stack.pop_all()
+    return lock
+
+
+def _read_journal(path):
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path, encoding='utf-8') as journal:
+        for line in journal:
+            try:
+                kind, row = json.loads(line)
+            except ValueError:
+                # A torn final line from a crash mid-write
+                continue
+            entries.append((kind, tuple(row[:-1]) + (date.fromisoformat(row[-1]),)))
+    return entries
+
+
+class ReadGate:
+    """Lets any number of reads in at once, or one flush commit, never both."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def shared(self):
+        with self._cond:
+            # Waiting flushes go first so a steady stream of reads cannot starve them
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class WriteBehindBuffer:
+    """Journaled queue of pending log rows with a background flusher."""
+
+    def __init__(self, repository, journal_path, interval=0.5, max_rows=100, on_flush=None):
+        self.repository = repository
+        self.dead_letter_path = journal_path + '.dead'
+        self.interval = interval
+        self.max_rows = max_rows
+        # Called with the user ids of each batch once it is committed
+        self.on_flush = on_flush
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._gate = ReadGate()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self.journal_path, self._journal_lock = self._claim_slot(journal_path)
+        # Entries are ('food', row) or ('exercise', row) with the date last
+        self._pending = _read_journal(self.journal_path)
+        orphans = self._orphaned_slots(journal_path)
+        for path, _ in orphans:
+            adopted = _read_journal(path)
+            if adopted:
+                logger.warning("Write-behind adopting %d queued rows from %s", len(adopted), path)
+            self._pending.extend(adopted)
+        self._journal = None
+        with self._lock:
+            self._rewrite_journal()
+        # Only now that our journal holds their rows
+        for path, lock in orphans:
+            os.remove(path)
+            lock.close()
+
+        self._flushed = 0
+        self._batches = 0
+        self._failures = 0
+        self._dead_lettered = 0
+        self._last_error = None
+
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _claim_slot(base_path):
+        for slot in itertools.count():
+            path = base_path if slot == 0 else f"{base_path}.{slot}"
+            lock = _lock_slot(path)
+            if lock is not None:
+                return path, lock
+
+    def _orphaned_slots(self, base_path):
+        """Lock the slots whose process is gone; return [(path, lock)]."""
+        slots = []
+        slot_pattern = re.compile(re.escape(base_path) + r'(\.\d+)?')
+        for path in sorted(glob.glob(glob.escape(base_path) + '*')):
+            if path == self.journal_path or not slot_pattern.fullmatch(path):
+                continue
+            lock = _lock_slot(path)
+            if lock is not None:
+                slots.append((path, lock))
+        return slots
+
+    def _append(self, entries):
+        with self._lock:
+            self._journal.write(''.join(
+                json.dumps([kind, list(row)], default=str) + '\n' for kind, row in entries
+            ))
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._pending.extend(entries)
+            if len(self._pending) >= self.max_rows:
+                self._wakeup.set()
+
+    def add_foods(self, rows):
+        """Queue food_logs rows as built by queries.food_rows_from_items."""
+        today = date.today()
+        self._append([('food', tuple(row) + (today,)) for row in rows])
+
+    def add_food(self, user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type):
+        self.add_foods([(user_id, food_name, calories, protein, fat, carbs, portion_size, meal_type)])
+
+    def add_exercise(self, user_id, exercise_name, duration, calories_burned):
+        self._append([('exercise', (user_id, exercise_name, duration, calories_burned, date.today()))])
+
+    def _rewrite_journal(self):
+        # Called with _lock held, after flushed entries left _pending. On
+        # failure the current journal and its handle stay as they were.
+        temp_path = self.journal_path + '.tmp'
+        with ExitStack() as stack:
+            journal = stack.enter_context(open(temp_path, 'w', encoding='utf-8'))
+            journal.write(''.join(
+                json.dumps([kind, list(row)], default=str) + '\n' for kind, row in self._pending
+            ))
+            journal.flush()
+            os.fsync(journal.fileno())
+            os.replace(temp_path, self.journal_path)
+            # The handle now appends to the replaced journal
+            stack.pop_all()
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = journal
+
+    def flush(self):
+        """Write everything queued so far to the database; return the row count."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = self._pending[:self.max_rows]
+                if not batch:
+                    return written
+                try:
+                    self._commit(batch)
+                except Exception as e:
+                    if len(batch) == 1 and not isinstance(e, BAD_ROW_ERRORS):
+                        raise
+                    logger.warning("Write-behind batch of %d rows failed, retrying row by row: %s", len(batch), e)
+                    for entry in batch:
+                        try:
+                            self._commit([entry])
+                        except BAD_ROW_ERRORS as e:
+                            self._dead_letter(entry, e)
+                written += len(batch)
+
+    def _commit(self, batch):
+        # Readers are held off until the rows have left the queue
+        with self._gate.exclusive():
+            self.repository.log_batch(
+                [row for kind, row in batch if kind == 'food'],
+                [row for kind, row in batch if kind == 'exercise']
+            )
+            # Only flush() removes entries, so the batch is still the prefix
+            with self._lock:
+                del self._pending[:len(batch)]
+                self._rewrite_journal()
+                self._flushed += len(batch)
+                self._batches += 1
+            if self.on_flush is not None:
+                self.on_flush({row[0] for kind, row in batch})
+
+    def _dead_letter(self, entry, error):
+        kind, row = entry
+        logger.error("Write-behind moved a %s row for user %s to %s: %s",
+                     kind, row[0], self.dead_letter_path, error)
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as dead:
+            dead.write(json.dumps([kind, list(row), str(error)], default=str) + '\n')
+            dead.flush()
+            os.fsync(dead.fileno())
+        with self._lock:
+            del self._pending[:1]
+            self._rewrite_journal()
+            self._dead_lettered += 1
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # Rows stay queued and journaled; the next tick retries
+                self._failures += 1
+                self._last_error = str(e)
+                logger.warning("Write-behind flush failed: %s", e)
+
+    def close(self):
+        """Stop the flusher and make a last attempt to flush the queue."""
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.warning("Write-behind flush on close failed; rows remain in %s: %s", self.journal_path, e)
+        with self._lock:
+            self._journal.close()
+        self._journal_lock.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'flushed': self._flushed,
+                'batches': self._batches,
+                'failures': self._failures,
+                'dead_lettered': self._dead_lettered,
+                'last_error': self._last_error
+            }
+
+    # Read-your-writes
+
+    @contextmanager
+    def reading(self):
+        """Hold off flush commits while a read and its merge run."""
+        with self._gate.shared():
+            yield self
+
+    def pending_rows(self, kind, user_id, start, end=None):
+        """Queued rows of one kind for a user between two dates, newest first."""
+        end = start if end is None else end
+        with self._lock:
+            return [
+                row for entry_kind, row in reversed(self._pending)
+                if entry_kind == kind and row[0] == user_id and start <= row[-1] <= end
+            ]
+
+    def merge_food_logs(self, logs, user_id, day):
+        return [food_log_from_row(row[1:]) for row in self.pending_rows('food', user_id, day)] + logs
+
+    def merge_exercise_logs(self, logs, user_id, day):
+        return [exercise_log_from_row(row[1:]) for row in self.pending_rows('exercise', user_id, day)] + logs
+
+    def merge_summary(self, summary, user_id, day):
+        summary = dict(summary)
+        for row in self.pending_rows('food', user_id, day):
+            summary['total_calories'] += row[2] or 0
+            summary['total_protein'] += row[3] or 0
+            summary['total_fat'] += row[4] or 0
+            summary['total_carbs'] += row[5] or 0
+        for row in self.pending_rows('exercise', user_id, day):
+            summary['total_calories_burned'] += row[3] or 0
+        return summary
+
+    def merge_snapshot(self, snapshot, user_id, day):
+        food_rows = self.pending_rows('food', user_id, day)
+        exercise_rows = self.pending_rows('exercise', user_id, day)
+        if not food_rows and not exercise_rows:
+            return snapshot
+
+        snapshot['food_logs'] = [food_log_from_row(row[1:]) for row in food_rows] + snapshot['food_logs']
+        snapshot['exercise_logs'] = [exercise_log_from_row(row[1:]) for row in exercise_rows] + snapshot['exercise_logs']
+        for row in food_rows:
+            meal = snapshot['meal_totals'].setdefault(row[7], {'calories': 0, 'protein': 0, 'fat': 0, 'carbs': 0})
+            meal['calories'] += row[2] or 0
+            meal['protein'] += row[3] or 0
+            meal['fat'] += row[4] or 0
+            meal['carbs'] += row[5] or 0
+        snapshot['summary'] = self.merge_summary(snapshot['summary'], user_id, day)
+        return snapshot
+
+    def merge_nutrition_series(self, frame, user_id, start, end, granularity):
+        food_rows = self.pending_rows('food', user_id, start, end)
+        exercise_rows = self.pending_rows('exercise', user_id, start, end)
+        if not food_rows and not exercise_rows:
+            return frame
+
+        frame = frame.copy()
+        for row in food_rows:
+            match = frame['period'] == period_start(row[-1], granularity)
+            frame.loc[match, 'calories'] += row[2] or 0
+            frame.loc[match, 'protein'] += row[3] or 0
+            frame.loc[match, 'fat'] += row[4] or 0
+            frame.loc[match, 'carbs'] += row[5] or 0
+            frame.loc[match, 'food_count'] += 1
+        for row in exercise_rows:
+            match = frame['period'] == period_start(row[-1], granularity)
+            frame.loc[match, 'calories_burned'] += row[3] or 0
+            frame.loc[match, 'exercise_count'] += 1
+        return frame
+
+    def merge_meal_series(self, frame, user_id, start, end, granularity):
+        food_rows = self.pending_rows('food', user_id, start, end)
+        if not food_rows:
+            return frame
+
+        frame = frame.copy()
+        for row in food_rows:
+            period = period_start(row[-1], granularity)
+            match = (frame['period'] == period) & (frame['meal_type'] == row[7])
+            if not match.any():
+                frame.loc[len(frame)] = [period, row[7], 0, 0, 0, 0, 0]
+                match = (frame['period'] == period) & (frame['meal_type'] == row[7])
+            frame.loc[match, 'calories'] += row[2] or 0
+            frame.loc[match, 'protein'] += row[3] or 0
+            frame.loc[match, 'fat'] += row[4] or 0
+            frame.loc[match, 'carbs'] += row[5] or 0
+            frame.loc[match, 'items'] += 1
+        return frame.sort_values(['period', 'meal_type']).reset_index(drop=True)